@@ -0,0 +1,74 @@
+"""
+Benchmark - So sánh latency của các AI strategy (sequential / hedged / race)
+
+Chạy với provider giả lập (không gọi API thật):
+    cd BE && python -m benchmarks.bench_ai_strategies
+"""
+
+import asyncio
+import statistics
+import time
+
+from models.schemas import Question
+from services.ai_service import AIService, STRATEGIES
+
+
+# Kịch bản: provider -> (độ trễ giây, thành công?)
+SCENARIOS = {
+    "gemini nhanh": {"gemini": (0.20, True), "grok": (0.30, True), "openai": (0.40, True)},
+    "gemini chậm nhưng ok": {"gemini": (1.50, True), "grok": (0.30, True), "openai": (0.40, True)},
+    "gemini treo rồi lỗi": {"gemini": (2.00, False), "grok": (0.30, True), "openai": (0.40, True)},
+    "gemini + grok lỗi": {"gemini": (0.50, False), "grok": (0.50, False), "openai": (0.40, True)},
+}
+
+HEDGE_DELAY = 0.5
+RUNS = 5
+
+
+def _stub(delay: float, ok: bool):
+    async def generate(prompt: str):
+        await asyncio.sleep(delay)
+        if not ok:
+            return [], False
+        return [Question(type="trac_nghiem", content="Câu hỏi", correct_answer="A", score=1.0)], True
+    return generate
+
+
+def _stubbed_service(scenario: dict) -> AIService:
+    service = AIService()
+    service.hedge_delay = HEDGE_DELAY
+    # Thứ tự tĩnh Gemini → Grok → OpenAI để các kịch bản so sánh được với nhau
+    service.adaptive_order = False
+    # Key giả: provider chưa cấu hình bị bỏ qua trước khi gọi generate_fn (không gọi API thật)
+    for provider in service.providers:
+        provider.api_key = "bench"
+    service.generate_with_gemini = _stub(*scenario["gemini"])
+    service.generate_with_grok = _stub(*scenario["grok"])
+    service.generate_with_openai = _stub(*scenario["openai"])
+    return service
+
+
+async def _measure(service: AIService, strategy: str):
+    samples = []
+    winner = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        _, winner = await service.generate_exam("Nội dung benchmark", 1, "100% Trắc nghiệm", strategy=strategy, force_refresh=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), winner
+
+
+async def main():
+    print(f"hedge_delay={HEDGE_DELAY}s, runs={RUNS} (median)")
+    print(f"{'scenario':<24}" + "".join(f"{s:>20}" for s in STRATEGIES))
+    for name, scenario in SCENARIOS.items():
+        service = _stubbed_service(scenario)
+        row = f"{name:<24}"
+        for strategy in STRATEGIES:
+            latency, winner = await _measure(service, strategy)
+            row += f"{f'{latency * 1000:.0f}ms ({winner})':>20}"
+        print(row)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Benchmark - Parser cũ (split + index theo từng label) vs single-pass parser
+
+Parser cũ được giữ nguyên ở đây làm chuẩn đối chiếu: trước khi đo,
+benchmark kiểm tra 2 parser cho ra cùng list Question trên response chuẩn và
+response dồn trên 1 dòng (label + KẾT THÚC CÂU giữa dòng).
+    cd BE && python -m benchmarks.bench_exam_parser
+"""
+
+import re
+import timeit
+from typing import List
+
+from models.schemas import Question
+from services.exam_parser import IncrementalQuestionParser, parse_ai_response
+
+
+# ---- Parser cũ (AIService._parse_ai_response trước khi tối ưu) ----
+def _legacy_get_value_by_label(block: str, label: str) -> str:
+    if label not in block:
+        return ""
+    start = block.index(label) + len(label)
+    labels = ["Loại:", "Điểm:", "Nội dung:", "Đáp án:", "Rubric:", "KẾT THÚC CÂU"]
+    end = len(block)
+    for l in labels:
+        try:
+            pos = block.index(l, start)
+            if pos < end:
+                end = pos
+        except ValueError:
+            continue
+    return block[start:end].strip()
+
+
+def _legacy_clean_text(text: str) -> str:
+    return text.replace('*', '').replace('_', '').replace('#', '').strip()
+
+
+def legacy_parse(response: str) -> List[Question]:
+    questions = []
+    for block in response.split("KẾT THÚC CÂU"):
+        block = block.strip()
+        if not block:
+            continue
+        q_type = _legacy_get_value_by_label(block, "Loại:")
+        score = _legacy_get_value_by_label(block, "Điểm:")
+        content = _legacy_get_value_by_label(block, "Nội dung:")
+        answer = _legacy_get_value_by_label(block, "Đáp án:")
+        rubric = _legacy_get_value_by_label(block, "Rubric:")
+        content = re.sub(r'^(Câu|Câu hỏi)\s*\d+[:.]?\s*', '', content, flags=re.IGNORECASE)
+        try:
+            score_float = float(re.search(r'[\d.]+', score).group()) if score else None
+        except:
+            score_float = None
+        questions.append(Question(
+            type=_legacy_clean_text(q_type),
+            content=f"({score} điểm) {_legacy_clean_text(content)}" if score else _legacy_clean_text(content),
+            correct_answer=_legacy_clean_text(answer),
+            rubric=None if rubric == "N/A" else _legacy_clean_text(rubric),
+            score=score_float
+        ))
+    return questions
+
+
+# ---- Dữ liệu ----
+def build_response(count: int = 50) -> str:
+    """Response chuẩn theo prompt: 70% trắc nghiệm, 30% tự luận, rubric dài"""
+    blocks = []
+    for i in range(1, count + 1):
+        if i <= count * 0.7:
+            blocks.append(
+                f"Loại: trac_nghiem\nĐiểm: 0.2\n"
+                f"Nội dung: Câu {i}: Trong chương {i % 7 + 1}, khái niệm nào sau đây là đúng nhất?\n"
+                f"A. Phương án {i}A\nB. Phương án {i}B\nC. Phương án {i}C\nD. Phương án {i}D\n"
+                f"Đáp án: {'ABCD'[i % 4]}\nRubric: N/A\nKẾT THÚC CÂU\n"
+            )
+        else:
+            rubric = " ".join(f"Ý {k}: trình bày đúng luận điểm {k} (0.25 điểm)." for k in range(1, 13))
+            blocks.append(
+                f"Loại: tu_luan\nĐiểm: 1.5\n"
+                f"Nội dung: Câu hỏi {i}. Phân tích **vai trò** của nội dung số {i} trong thực tiễn.\n"
+                f"Đáp án: Học sinh cần nêu được định nghĩa, ví dụ và ý nghĩa của nội dung {i}.\n"
+                f"Rubric: {rubric}\nKẾT THÚC CÂU\n"
+            )
+    return "Dưới đây là đề thi:\n" + "".join(blocks)
+
+
+def check_equivalence(response: str):
+    expected = legacy_parse(response)
+    actual = parse_ai_response(response)
+    assert actual == expected, "single-pass parser differs from legacy parser"
+
+    streamed = []
+    parser = IncrementalQuestionParser()
+    for i in range(0, len(response), 37):
+        streamed.extend(parser.feed(response[i:i + 37]))
+    streamed.extend(parser.close())
+    assert streamed == expected, "incremental parser differs from legacy parser"
+    return len(expected)
+
+
+def main():
+    for count, layout in ((10, "chuẩn"), (50, "chuẩn"), (50, "1 dòng")):
+        response = build_response(count)
+        if layout == "1 dòng":
+            response = response.replace("\n", " ")
+        parsed = check_equivalence(response)
+        number = 200
+        legacy = timeit.timeit(lambda: legacy_parse(response), number=number) / number
+        single = timeit.timeit(lambda: parse_ai_response(response), number=number) / number
+        print(
+            f"{count} câu {layout} ({len(response)} ký tự, {parsed} parsed, kết quả giống nhau): "
+            f"legacy {legacy * 1000:.3f}ms | single-pass {single * 1000:.3f}ms | x{legacy / single:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
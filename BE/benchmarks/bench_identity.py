@@ -0,0 +1,157 @@
+"""
+Benchmark - Số lời gọi Firestore để tra user: chuỗi fallback cũ vs identity index
+
+Firestore giả lập đếm RPC (get / get_all / query / commit), mỗi RPC tốn RTT giây.
+Tra theo doc ID, uid (khác doc ID), username và email; index cold (cache trống) / warm.
+    cd BE && python -m benchmarks.bench_identity
+"""
+
+import asyncio
+import time
+
+from services.identity_index import IdentityIndex
+
+RTT = 0.01
+USERS = 200
+
+
+# ---- Firestore giả lập ----
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference, self.id = ref, ref.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeRef:
+    def __init__(self, db, path):
+        self.db, self.path = db, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    async def get(self, field_paths=None):
+        await self.db.rpc()
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+
+class FakeQuery:
+    def __init__(self, db, collection, field, value):
+        self.db, self.collection, self.field, self.value = db, collection, field, value
+
+    def limit(self, _n):
+        return self
+
+    async def get(self):
+        await self.db.rpc()
+        prefix = self.collection + "/"
+        return [FakeSnapshot(FakeRef(self.db, p), d) for p, d in self.db.docs.items()
+                if p.startswith(prefix) and d.get(self.field) == self.value][:1]
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def document(self, doc_id):
+        return FakeRef(self.db, f"{self.name}/{doc_id}")
+
+    def where(self, field, _op, value):
+        return FakeQuery(self.db, self.name, field, value)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, ref, data):
+        self.ops.append((ref.path, data))
+
+    create = set
+
+    async def commit(self):
+        await self.db.rpc()
+        for path, data in self.ops:
+            self.db.docs[path] = dict(data)
+
+
+class FakeDB:
+    def __init__(self):
+        self.docs = {}
+        self.rpcs = 0
+
+    async def rpc(self):
+        self.rpcs += 1
+        await asyncio.sleep(RTT)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    async def get_all(self, refs):
+        refs = list(refs)
+        await self.rpc()
+        for ref in refs:
+            yield FakeSnapshot(ref, self.docs.get(ref.path))
+
+
+def build_db() -> FakeDB:
+    db = FakeDB()
+    for i in range(USERS):
+        # uid khác doc ID (user tạo từ Firebase Auth / import)
+        db.docs[f"users/d{i}"] = {"uid": f"firebase-{i}", "username": f"user{i}",
+                                  "email": f"user{i}@school.edu", "fullName": f"Học sinh {i}"}
+    return db
+
+
+# ---- Chuỗi fallback cũ (đăng ký lớp / get_user / login) ----
+async def legacy_resolve(db, identifier):
+    snap = await db.collection('users').document(identifier).get()
+    if snap.exists:
+        return snap.id
+    uid_docs, user_docs = await asyncio.gather(
+        db.collection('users').where('uid', '==', identifier).limit(1).get(),
+        db.collection('users').where('username', '==', identifier.lower()).limit(1).get(),
+    )
+    if uid_docs or user_docs:
+        return (uid_docs or user_docs)[0].id
+    email_docs = await db.collection('users').where('email', '==', identifier.lower()).limit(1).get()
+    return email_docs[0].id if email_docs else None
+
+
+KINDS = ('id', 'uid', 'username', 'email')
+
+
+async def measure(label, db, resolve, identifiers):
+    db.rpcs = 0
+    start = time.perf_counter()
+    resolved = [await resolve(db, i) for i in identifiers]
+    elapsed = time.perf_counter() - start
+    assert all(resolved), f"{label}: unresolved identifiers"
+    print(f"  {label:<18} {db.rpcs / len(identifiers):>6.2f} RPC/lookup  {elapsed / len(identifiers) * 1000:>6.1f} ms/lookup")
+
+
+async def main():
+    print(f"RTT={RTT * 1000:.0f}ms / RPC, {USERS} users")
+    db = build_db()
+    index = IdentityIndex(fallback_queries=True)
+    # Index đã được backfill, cache trống
+    for i in range(USERS):
+        await index.index_user(db, f"d{i}", db.docs[f"users/d{i}"])
+    index._entries.clear()
+
+    for kind, make in (("doc id", lambda i: f"d{i}"), ("uid", lambda i: f"firebase-{i}"),
+                       ("username", lambda i: f"user{i}"), ("email", lambda i: f"user{i}@school.edu")):
+        identifiers = [make(i) for i in range(0, USERS, 4)]
+        print(f"\nlookup by {kind}")
+        await measure("legacy cascade", db, legacy_resolve, identifiers)
+        index._entries.clear()
+        await measure("index (cold)", db, lambda d, i: index.resolve(d, i, KINDS), identifiers)
+        await measure("index (warm)", db, lambda d, i: index.resolve(d, i, KINDS), identifiers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
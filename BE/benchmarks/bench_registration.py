@@ -0,0 +1,154 @@
+"""
+Benchmark - Thời gian transaction đăng ký lớp theo số lớp đã đăng ký
+
+Firestore giả lập: mỗi RPC (get / get_all) tốn RTT giây. So sánh:
+- legacy: đọc từng lớp đã đăng ký tuần tự trong transaction + parse lịch bằng regex
+- hiện tại: handle_class_registration thật (1 get_all cho mọi lớp đã đăng ký, so bitmask)
+    cd BE && python -m benchmarks.bench_registration
+"""
+
+import asyncio
+import copy
+import statistics
+import time
+from types import SimpleNamespace
+
+from models.schemas import ClassRegistrationRequest
+from routers import classes_router
+from services.class_schedule import compile_schedule, get_class_schedule_info, parse_dates, parse_days, parse_periods
+from services.firebase_service import firebase_service
+
+RTT = 0.02
+RUNS = 5
+SEMESTER = "HK1-2025"
+
+
+# ---- Firestore giả lập ----
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference, self.id = ref, ref.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeRef:
+    def __init__(self, db, collection, doc_id):
+        self.db, self.collection, self.id = db, collection, doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    async def get(self, transaction=None, field_paths=None):
+        await asyncio.sleep(RTT)
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def document(self, doc_id):
+        return FakeRef(self.db, self.name, doc_id)
+
+
+class FakeTransaction:
+    def update(self, ref, data):
+        pass
+
+
+class FakeDB:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def get_all(self, refs, field_paths=None, transaction=None):
+        await asyncio.sleep(RTT)
+        for ref in refs:
+            yield FakeSnapshot(ref, self.docs.get(ref.path))
+
+
+def build_db(registered: int) -> FakeDB:
+    """Học sinh đã đăng ký `registered` lớp không trùng lịch; lớp mới cũng không trùng"""
+    docs = {}
+    ids = []
+    for i in range(registered + 1):
+        day, period = 2 + i % 6, 1 + (i // 6) * 3
+        data = {
+            "name": f"Lớp {i}", "semester": SEMESTER, "maxSlots": 50, "currentSlots": 0,
+            "schedule": f"{day} | Tiết {period}-{period + 2} | P.{i} | 01/09/2025 - 15/12/2025",
+        }
+        data["scheduleCompiled"] = compile_schedule(data)
+        docs[f"classes/c{i}"] = data
+        ids.append(f"c{i}")
+    docs["users/u1"] = {"registeredClassIds": ids[:registered]}
+    return FakeDB(docs)
+
+
+# ---- Legacy: đọc tuần tự + parse regex cho từng lớp ----
+async def legacy_conflict_check(db: FakeDB, class_id: str):
+    u_snap, c_snap = await asyncio.gather(
+        db.collection("users").document("u1").get(),
+        db.collection("classes").document(class_id).get(),
+    )
+    user, new_data = u_snap.to_dict(), c_snap.to_dict()
+    d, p, r = get_class_schedule_info(new_data)
+    new_days, new_periods, (new_start, new_end) = parse_days(d), parse_periods(p), parse_dates(r)
+    for existing_id in user["registeredClassIds"]:
+        ex_data = (await db.collection("classes").document(existing_id).get()).to_dict()
+        d, p, r = get_class_schedule_info(ex_data)
+        ex_start, ex_end = parse_dates(r)
+        overlap = (new_days & parse_days(d)) and (new_periods & parse_periods(p))
+        if overlap and max(new_start, ex_start) <= min(new_end, ex_end):
+            raise Exception("conflict")
+
+
+# ---- Hiện tại: chạy endpoint thật, đo riêng phần thân transaction ----
+transaction_durations = []
+
+
+def timed_transaction(func):
+    async def run(transaction):
+        start = time.perf_counter()
+        try:
+            return await func(transaction)
+        finally:
+            transaction_durations.append(time.perf_counter() - start)
+    return run
+
+
+async def current_registration(db: FakeDB, class_id: str):
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(firebase_db=db)))
+    reg = ClassRegistrationRequest(userId="u1", classId=class_id, semester=SEMESTER, isRegister=True)
+    await classes_router.handle_class_registration(request, reg)
+
+
+async def main():
+    firebase_service._firestore_transaction = timed_transaction
+    print(f"RTT={RTT * 1000:.0f}ms / RPC, runs={RUNS} (median)")
+    print(f"{'registered':>10}{'legacy (ms)':>14}{'get_all (ms)':>14}")
+    for registered in (0, 1, 2, 4, 8, 12):
+        db = build_db(registered)
+        new_class = f"c{registered}"
+
+        legacy = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            await legacy_conflict_check(db, new_class)
+            legacy.append(time.perf_counter() - start)
+
+        transaction_durations.clear()
+        for _ in range(RUNS):
+            await current_registration(db, new_class)
+
+        print(f"{registered:>10}{statistics.median(legacy) * 1000:>14.1f}"
+              f"{statistics.median(transaction_durations) * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+"""
+Benchmark - Thông lượng đăng ký vào 1 lớp "nóng": transaction trực tiếp vs surge mode
+
+Firestore giả lập trong bộ nhớ: mỗi RPC (get / get_all / commit) tốn RTT giây,
+transaction kiểu optimistic (commit bị abort nếu document đã đọc bị sửa trong lúc đó,
+thử lại tối đa 5 lần như async_transactional mặc định).
+    cd BE && python -m benchmarks.bench_registration_surge
+"""
+
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import time
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+
+from models.schemas import ClassRegistrationRequest
+from routers import classes_router
+from services.class_schedule import compile_schedule
+from services.firebase_service import firebase_service
+from services.registration_queue import RegistrationQueue
+
+RTT = 0.01
+MAX_ATTEMPTS = 5
+SEMESTER = "HK1-2025"
+HOT_CLASS = "hot"
+
+
+# ---- Firestore giả lập ----
+class Aborted(Exception):
+    pass
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference, self.id = ref, ref.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeRef:
+    def __init__(self, db, path):
+        self.db, self.path = db, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    async def get(self, transaction=None, field_paths=None):
+        await asyncio.sleep(RTT)
+        return self.db.read(self, transaction)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def document(self, doc_id):
+        return FakeRef(self.db, f"{self.name}/{doc_id}")
+
+
+class FakeTransaction:
+    def __init__(self):
+        self.read_versions = {}
+        self.writes = []
+
+    def update(self, ref, data):
+        self.writes.append(("update", ref.path, data))
+
+    def set(self, ref, data):
+        self.writes.append(("set", ref.path, data))
+
+    def delete(self, ref):
+        self.writes.append(("delete", ref.path, None))
+
+
+class FakeDB:
+    def __init__(self, docs):
+        self.docs = docs
+        self.versions = {path: 0 for path in docs}
+        self.rpcs = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self):
+        return FakeTransaction()
+
+    def read(self, ref, transaction):
+        self.rpcs += 1
+        if transaction is not None:
+            transaction.read_versions.setdefault(ref.path, self.versions.get(ref.path, 0))
+        return FakeSnapshot(ref, self.docs.get(ref.path))
+
+    async def get_all(self, refs, field_paths=None, transaction=None):
+        refs = list(refs)
+        await asyncio.sleep(RTT)
+        self.rpcs += 1
+        for ref in refs:
+            if transaction is not None:
+                transaction.read_versions.setdefault(ref.path, self.versions.get(ref.path, 0))
+            yield FakeSnapshot(ref, self.docs.get(ref.path))
+
+    async def commit(self, transaction):
+        await asyncio.sleep(RTT)
+        self.rpcs += 1
+        if any(self.versions.get(p, 0) != v for p, v in transaction.read_versions.items()):
+            raise Aborted("document changed since read")
+        for op, path, data in transaction.writes:
+            if op == "update":
+                self.docs[path].update(data)
+            elif op == "set":
+                self.docs[path] = dict(data)
+            else:
+                self.docs.pop(path, None)
+            self.versions[path] = self.versions.get(path, 0) + 1
+
+
+stats = {"attempts": 0, "aborts": 0}
+
+
+def fake_transactional(func):
+    async def run(transaction):
+        db = CURRENT_DB
+        for attempt in range(MAX_ATTEMPTS):
+            tx = FakeTransaction()
+            stats["attempts"] += 1
+            result = await func(tx)
+            try:
+                await db.commit(tx)
+                return result
+            except Aborted:
+                stats["aborts"] += 1
+        raise Aborted(f"transaction aborted after {MAX_ATTEMPTS} attempts")
+    return run
+
+
+CURRENT_DB = None
+
+
+def build_db(students: int, max_slots: int) -> FakeDB:
+    """Mỗi học sinh đã có 2 lớp không trùng lịch với lớp nóng"""
+    def make_class(name, schedule, slots=50):
+        data = {"name": name, "semester": SEMESTER, "maxSlots": slots, "currentSlots": 0, "schedule": schedule}
+        data["scheduleCompiled"] = compile_schedule(data)
+        return data
+
+    docs = {
+        f"classes/{HOT_CLASS}": make_class("Lớp nóng", "2 | Tiết 1-3 | P.1 | 01/09/2025 - 15/12/2025", max_slots),
+        "classes/a": make_class("Lớp A", "3 | Tiết 1-3 | P.2 | 01/09/2025 - 15/12/2025", 10 ** 6),
+        "classes/b": make_class("Lớp B", "4 | Tiết 4-6 | P.3 | 01/09/2025 - 15/12/2025", 10 ** 6),
+    }
+    for i in range(students):
+        docs[f"users/u{i}"] = {"registeredClassIds": ["a", "b"]}
+    return FakeDB(docs)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Nuốt log của router trong lúc đo ([DEBUG], traceback khi transaction abort là chuyện bình thường ở đây)"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def make_request(db):
+    return SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(firebase_db=db)))
+
+
+async def run_direct(students: int, max_slots: int):
+    global CURRENT_DB
+    db = CURRENT_DB = build_db(students, max_slots)
+    return await run_direct_on(db, students)
+
+
+async def run_direct_on(db: FakeDB, students: int):
+    classes_router.registration_queue = RegistrationQueue(enabled=False)
+    request = make_request(db)
+
+    async def one(i):
+        reg = ClassRegistrationRequest(userId=f"u{i}", classId=HOT_CLASS, semester=SEMESTER, isRegister=True)
+        try:
+            await classes_router.handle_class_registration(request, reg)
+            return 200
+        except HTTPException as e:
+            return e.status_code
+
+    start = time.perf_counter()
+    with quiet():
+        codes = await asyncio.gather(*(one(i) for i in range(students)))
+    return time.perf_counter() - start, codes, db
+
+
+async def run_surge(students: int, max_slots: int):
+    global CURRENT_DB
+    db = CURRENT_DB = build_db(students, max_slots)
+    queue = RegistrationQueue(enabled=True, max_group=100)
+    classes_router.registration_queue = queue
+    request = make_request(db)
+
+    async def one(i):
+        reg = ClassRegistrationRequest(userId=f"u{i}", classId=HOT_CLASS, semester=SEMESTER, isRegister=True)
+        response = await classes_router.handle_class_registration(request, reg)
+        ticket = queue.get(json.loads(response.body)["ticketId"])
+        await queue.wait(ticket, 60)
+        return ticket.status_code
+
+    start = time.perf_counter()
+    with quiet():
+        codes = await asyncio.gather(*(one(i) for i in range(students)))
+    elapsed = time.perf_counter() - start
+    await queue.shutdown()
+    return elapsed, codes, db, queue.get_stats()
+
+
+def summarize(label, elapsed, codes, db):
+    ok = codes.count(200)
+    slots = db.docs[f"classes/{HOT_CLASS}"]["currentSlots"]
+    enrolled = sum(1 for p, d in db.docs.items() if p.startswith("users/") and HOT_CLASS in d["registeredClassIds"])
+    others = {c: codes.count(c) for c in sorted(set(codes)) if c != 200}
+    print(f"  {label:<8} {elapsed * 1000:>9.0f}ms  {len(codes) / elapsed:>8.0f} req/s  ok={ok:<5} "
+          f"other={others}  slots={slots} enrolled={enrolled}  rpcs={db.rpcs} "
+          f"attempts={stats['attempts']} aborts={stats['aborts']}")
+
+
+async def main():
+    firebase_service._firestore_transaction = fake_transactional
+    print(f"RTT={RTT * 1000:.0f}ms / RPC, optimistic transactions, max {MAX_ATTEMPTS} attempts")
+    for students, max_slots in ((50, 1000), (200, 1000), (1000, 1000), (1000, 300)):
+        print(f"\n{students} students -> 1 class (maxSlots={max_slots})")
+        for label, runner in (("direct", run_direct), ("surge", run_surge)):
+            stats.update(attempts=0, aborts=0)
+            result = await runner(students, max_slots)
+            summarize(label, *result[:3])
+            if label == "surge":
+                q = result[3]
+                print(f"  {'':<8} groups={q['groups']} avg_group={q['avg_group_size']} max_group={q['max_group_size']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
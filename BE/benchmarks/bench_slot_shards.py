@@ -0,0 +1,51 @@
+"""
+Benchmark - Đăng ký đồng thời vào 1 lớp "nóng" theo số shard của bộ đếm chỗ
+
+Dùng Firestore giả lập của bench_registration_surge (RTT / RPC, transaction optimistic,
+tối đa 5 lần thử). Chạy endpoint thật ở chế độ trực tiếp (không surge) và kiểm tra
+tổng count các shard == số học sinh đã vào lớp <= maxSlots.
+    cd BE && python -m benchmarks.bench_slot_shards
+"""
+
+import asyncio
+
+from benchmarks import bench_registration_surge as fake
+from services.firebase_service import firebase_service
+from services.slot_counter import configure_shards
+
+STUDENTS = 400
+SHARD_COUNTS = (0, 1, 4, 16, 64)
+
+
+async def run(shards: int, max_slots: int):
+    db = fake.CURRENT_DB = fake.build_db(STUDENTS, max_slots)
+    if shards:
+        await configure_shards(db, fake.HOT_CLASS, shards)
+    fake.stats.update(attempts=0, aborts=0)
+    db.rpcs = 0
+
+    elapsed, codes, db = await fake.run_direct_on(db, STUDENTS)
+
+    class_path = f"classes/{fake.HOT_CLASS}"
+    if shards:
+        counted = sum(d["count"] for p, d in db.docs.items() if p.startswith(f"{class_path}/slot_shards/"))
+    else:
+        counted = db.docs[class_path]["currentSlots"]
+    enrolled = sum(1 for p, d in db.docs.items() if p.startswith("users/") and fake.HOT_CLASS in d["registeredClassIds"])
+    others = {c: codes.count(c) for c in sorted(set(codes)) if c != 200}
+    exact = "OK" if counted == enrolled <= max_slots else "MISMATCH"
+    print(f"  shards={shards:<3} {elapsed * 1000:>7.0f}ms  ok={codes.count(200):<4} other={str(others):<18} "
+          f"counted={counted:<4} enrolled={enrolled:<4} {exact}  attempts={fake.stats['attempts']} aborts={fake.stats['aborts']}")
+
+
+async def main():
+    firebase_service._firestore_transaction = fake.fake_transactional
+    print(f"RTT={fake.RTT * 1000:.0f}ms / RPC, {STUDENTS} students register concurrently (direct mode)")
+    for max_slots in (10000, 300):
+        print(f"\nmaxSlots={max_slots}")
+        for shards in SHARD_COUNTS:
+            await run(shards, max_slots)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -27,6 +27,9 @@ from routers import (
     exams_router,
     settings_router,
 )
+from services.ai_service import ai_service
+from services.exam_meta_cache import exam_meta_cache
+from services.registration_queue import registration_queue
 
 # 4. Service Type Check (For Microservices)
 SERVICE_TYPE = os.getenv("SERVICE_TYPE", "ALL").upper()
@@ -47,11 +50,19 @@ async def lifespan(app: FastAPI):
     # 1. Initialize Firebase (Blocking)
     if firebase_service.initialize():
         print("[FIREBASE] Connected Successfully")
-        # Assign to app state as requested
-        app.state.firebase_db = firebase_service.db
+        # Routers share the non-blocking AsyncClient (never stalls the event loop)
+        app.state.firebase_db = firebase_service.async_db
     else:
         print("[FIREBASE] FAILED TO CONNECT - Check serviceAccountKey.json")
 
+    # 2. Optional: invalidate exam metadata cache on changes made outside this process
+    if app.state.firebase_db and SERVICE_TYPE in ["CORE", "ALL"] and os.getenv("EXAM_META_CACHE_LISTEN", "false").lower() == "true":
+        exam_meta_cache.start_listener(firebase_service.db)
+
+    # 3. Open pooled AI provider clients (only where AI routes are served)
+    if SERVICE_TYPE in ["AI", "ALL"]:
+        await ai_service.startup()
+
     print(f"[SERVER] Running Type: {SERVICE_TYPE}")
 
     # In ra tất cả các routes đăng ký để debug
@@ -65,6 +76,11 @@ async def lifespan(app: FastAPI):
 
     # --- SHUTDOWN LOGIC ---
     print(f"[SHUTDOWN] Cleaning up {SERVICE_TYPE} resources...")
+    if SERVICE_TYPE in ["AI", "ALL"]:
+        await ai_service.shutdown()
+    exam_meta_cache.stop_listener()
+    # Xử lý nốt các yêu cầu đăng ký lớp đang xếp hàng (surge mode)
+    await registration_queue.shutdown()
 
 
 # Initialize FastAPI with lifespan
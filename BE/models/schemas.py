@@ -23,6 +23,17 @@ class GenerateExamRequest(BaseModel):
     count: int = Field(default=10, ge=1, le=50, description="Số câu hỏi")
     structure: str = Field(default="70% Trắc nghiệm - 30% Tự luận", description="Cấu trúc đề")
     subject: Optional[str] = Field(default=None, description="Tên môn học")
+    strategy: Optional[str] = Field(default=None, description="Chiến lược fallback: sequential, hedged hoặc race (mặc định theo AI_STRATEGY)")
+    force_refresh: bool = Field(default=False, description="Bỏ qua cache, luôn gọi AI tạo đề mới")
+    long_document: Optional[bool] = Field(default=None, description="Map-reduce theo chunk cho tài liệu dài (mặc định: tự động theo độ dài)")
+    chunk_tokens: Optional[int] = Field(default=None, ge=500, le=100000, description="Token budget mỗi chunk (long-document mode)")
+    parallelism: Optional[int] = Field(default=None, ge=1, le=16, description="Số chunk chạy song song (long-document mode)")
+
+
+class BatchGenerateExamRequest(BaseModel):
+    """Request body để tạo nhiều đề thi trong 1 lần gọi"""
+    jobs: List[GenerateExamRequest] = Field(..., min_length=1, max_length=100, description="Danh sách job tạo đề")
+    max_workers: Optional[int] = Field(default=None, ge=1, le=32, description="Số job chạy song song (mặc định theo AI_BATCH_WORKERS)")
 
 
 class Question(BaseModel):
@@ -41,6 +52,7 @@ class GenerateExamResponse(BaseModel):
     model_used: str = Field(..., description="AI model đã sử dụng: gemini, grok, hoặc openai")
     total_questions: int
     message: Optional[str] = None
+    stages: Optional[Dict[str, Any]] = Field(default=None, description="Latency từng bước (long-document mode)")
 
 
 class ErrorResponse(BaseModel):
@@ -153,6 +165,11 @@ class ExamResultRequest(BaseModel):
     submittedAt: Optional[str] = None
 
 
+class BulkExamResultRequest(BaseModel):
+    """Request body for bulk result submission (items validated one by one as ExamResultRequest)"""
+    results: List[Dict[str, Any]] = Field(..., min_length=1, max_length=2000)
+
+
 class RegistrationSettingsRequest(BaseModel):
     """Request body for registration settings"""
     semester: str
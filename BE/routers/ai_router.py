@@ -2,13 +2,31 @@
 AI Router - Endpoints cho AI generation
 """
 
-from fastapi import APIRouter, HTTPException
-from models.schemas import GenerateExamRequest, GenerateExamResponse, ErrorResponse
-from services.ai_service import ai_service
+import json
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from models.schemas import GenerateExamRequest, GenerateExamResponse, ErrorResponse, BatchGenerateExamRequest
+from services.ai_service import ai_service, STRATEGIES
+from services.exam_cache import exam_cache
 
 router = APIRouter()
 
 
+def _event_stream(events, format: str) -> StreamingResponse:
+    """Encode async iterator các event dict thành SSE hoặc NDJSON"""
+    async def body():
+        async for event in events:
+            payload = json.dumps(event, ensure_ascii=False)
+            if format == "sse":
+                yield f"event: {event['event']}\ndata: {payload}\n\n"
+            else:
+                yield payload + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.post(
     "/generate-exam",
     response_model=GenerateExamResponse,
@@ -22,15 +40,36 @@ async def generate_exam(request: GenerateExamRequest):
     - **count**: Số câu hỏi (mặc định 10)
     - **structure**: Cấu trúc đề (vd: "70% Trắc nghiệm - 30% Tự luận")
     - **subject**: Tên môn học (optional)
+    - **strategy**: sequential | hedged | race (optional)
+    - **force_refresh**: bỏ qua cache đề đã tạo (optional)
+    - **long_document / chunk_tokens / parallelism**: map-reduce cho tài liệu dài (optional)
     
     AI sẽ thử theo thứ tự: Gemini → Grok → OpenAI
     """
     try:
-        questions, model_used = await ai_service.generate_exam(
-            text=request.text,
-            count=request.count,
-            structure=request.structure
-        )
+        stages = None
+        long_document = request.long_document
+        if long_document is None:
+            long_document = ai_service.is_long_document(request.text)
+
+        if long_document:
+            questions, model_used, stages = await ai_service.generate_exam_long(
+                text=request.text,
+                count=request.count,
+                structure=request.structure,
+                strategy=request.strategy,
+                force_refresh=request.force_refresh,
+                chunk_tokens=request.chunk_tokens,
+                parallelism=request.parallelism
+            )
+        else:
+            questions, model_used = await ai_service.generate_exam(
+                text=request.text,
+                count=request.count,
+                structure=request.structure,
+                strategy=request.strategy,
+                force_refresh=request.force_refresh
+            )
         
         if not questions:
             raise HTTPException(
@@ -43,27 +82,105 @@ async def generate_exam(request: GenerateExamRequest):
             questions=questions,
             model_used=model_used,
             total_questions=len(questions),
-            message=f"Tạo đề thành công bằng {model_used.upper()}!"
+            message=f"Tạo đề thành công bằng {model_used.upper()}!",
+            stages=stages
         )
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/generate-exam/stream")
+async def generate_exam_stream(request: GenerateExamRequest, format: str = Query(default="sse", pattern="^(sse|ndjson)$")):
+    """
+    Tạo đề thi dạng streaming: mỗi câu hỏi được gửi ngay khi AI viết xong "KẾT THÚC CÂU"
+    
+    - **format**: sse (text/event-stream) hoặc ndjson (application/x-ndjson)
+    
+    Event: question | done | error (xem AIService.stream_exam)
+    """
+    events = ai_service.stream_exam(
+        text=request.text,
+        count=request.count,
+        structure=request.structure,
+        force_refresh=request.force_refresh
+    )
+    return _event_stream(events, format)
+
+
+@router.post("/generate-exam/batch")
+async def generate_exam_batch(request: BatchGenerateExamRequest, format: str = Query(default="ndjson", pattern="^(sse|ndjson)$")):
+    """
+    Tạo nhiều đề thi (vd: 1 đề / chương) với worker pool giới hạn
+    
+    - **jobs**: danh sách GenerateExamRequest
+    - **max_workers**: số job chạy song song (optional)
+    
+    Mỗi job trả về 1 event "job" (index, status, questions, model_used, elapsed) ngay khi xong,
+    cuối cùng là event "done" tổng kết.
+    """
+    for job in request.jobs:
+        if job.strategy and job.strategy.lower() not in STRATEGIES:
+            raise HTTPException(status_code=400, detail=f"Unknown AI strategy '{job.strategy}'")
+
+    jobs = [
+        {
+            "text": job.text,
+            "count": job.count,
+            "structure": job.structure,
+            "strategy": job.strategy,
+            "force_refresh": job.force_refresh,
+        }
+        for job in request.jobs
+    ]
+
+    async def events():
+        succeeded = failed = 0
+        async for result in ai_service.generate_exam_batch(jobs, max_workers=request.max_workers):
+            if result["status"] == "success":
+                succeeded += 1
+            else:
+                failed += 1
+            yield result
+        yield {"event": "done", "total_jobs": len(jobs), "succeeded": succeeded, "failed": failed}
+
+    return _event_stream(events(), format)
+
+
 @router.get("/models")
 async def get_available_models():
+    # priority = thứ tự fallback thực tế (adaptive theo telemetry nếu bật)
+    order = ai_service.provider_order()
+    providers = sorted(ai_service.providers, key=lambda provider: order.index(provider.name))
     return {
         "models": [
-            {"name": "gemini", "display": "Gemini 2.5 Flash", "priority": 1},
-            {"name": "grok", "display": "Grok 2", "priority": 2},
-            {"name": "openai", "display": "GPT-4o", "priority": 3}
+            {
+                "name": provider.name,
+                "display": provider.display,
+                "priority": priority,
+                "configured": provider.is_configured,
+                "circuit": provider.breaker.snapshot(),
+                "stats": ai_service.stats[provider.name].snapshot()
+            }
+            for priority, provider in enumerate(providers, start=1)
         ],
-        "fallback_order": ["gemini", "grok", "openai"]
+        "fallback_order": order,
+        "adaptive_order": ai_service.adaptive_order,
+        "strategy": ai_service.strategy,
+        "hedge_delay": ai_service.hedge_delay
     }
 
 
+@router.get("/cache/stats")
+async def get_exam_cache_stats():
+    """Hit/miss counters của exam cache (để sizing)"""
+    return {"success": True, "cache": exam_cache.get_stats()}
+
+
 @router.get("/structures")
 async def get_exam_structures():
     """Lấy danh sách cấu trúc đề có sẵn"""
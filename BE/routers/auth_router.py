@@ -6,6 +6,8 @@ from fastapi import APIRouter, HTTPException, Header, Request
 from typing import Optional
 from models.schemas import TokenVerifyRequest, TokenVerifyResponse, UserLoginRequest, UserCreateRequest, PasswordUpdateRequest, UserCheckRequest
 from services.firebase_service import firebase_service
+from services.identity_index import identity_index
+from google.api_core.exceptions import Conflict
 
 router = APIRouter()
 
@@ -34,25 +36,14 @@ async def login_user(request: Request, login_data: UserLoginRequest):
         username_raw = login_data.username.lower().strip()
         
         # 1. Tìm user theo username
-        # Thử 3 trường hợp: Khớp chính xác, stripping domain nếu là email, hoặc khớp với field email
-        query = db.collection('users').where('username', '==', username_raw).limit(1).get()
-        user_docs = list(query)
-        
-        if not user_docs and "@" in username_raw:
-             # Thử tìm theo phần tên trước @ (ví dụ: admin@gmail.com -> tìm doc có username 'admin')
-             username_prefix = username_raw.split("@")[0]
-             query = db.collection('users').where('username', '==', username_prefix).limit(1).get()
-             user_docs = list(query)
-             
-             if not user_docs:
-                  # Thử tìm theo field email (nếu doc có lưu email riêng)
-                  query = db.collection('users').where('email', '==', username_raw).limit(1).get()
-                  user_docs = list(query)
-
-        if not user_docs:
+        # Thử 3 trường hợp theo thứ tự: Khớp chính xác, phần tên trước @ nếu là email, hoặc khớp với field email
+        # (identity index: cache 0 lần đọc, miss 1 get_all cho cả 3 ứng viên)
+        found = await identity_index.load_user(db, username_raw, ('username', 'username@', 'email'))
+
+        if not found:
             raise HTTPException(status_code=401, detail="Tên đăng nhập không chính xác hoặc tài khoản chưa được thiết lập hồ sơ")
 
-        user_data = user_docs[0].to_dict()
+        user_id, user_data, _kind = found
         role = user_data.get('role', 'student')
 
         # 2. Nếu là Admin, yêu cầu xác thực Firebase qua ID Token
@@ -70,7 +61,7 @@ async def login_user(request: Request, login_data: UserLoginRequest):
         return {
             "success": True,
             "user": {
-                "uid": user_data.get('uid', user_docs[0].id),
+                "uid": user_data.get('uid', user_id),
                 "username": user_data.get('username'),
                 "fullName": user_data.get('fullName'),
                 "role": role,
@@ -104,13 +95,13 @@ async def register_user(request: Request, user_data: UserCreateRequest):
              raise HTTPException(status_code=400, detail="Chỉ Admin hệ thống mới có quyền tạo tài khoản Quản trị viên")
 
         # Kiểm tra username tồn tại
-        existing = db.collection('users').where('username', '==', user_data.username.lower().strip()).get()
-        if len(list(existing)) > 0:
+        username = user_data.username.lower().strip()
+        if await identity_index.resolve(db, username, ('username',)):
             raise HTTPException(status_code=400, detail="Tên đăng nhập đã tồn tại")
 
         # Tạo document mới
         new_user = {
-            'username': user_data.username.lower().strip(),
+            'username': username,
             'fullName': user_data.fullName,
             'password': user_data.password,
             'role': user_data.role,
@@ -121,7 +112,15 @@ async def register_user(request: Request, user_data: UserCreateRequest):
 
         doc_ref = db.collection('users').document()
         new_user['uid'] = doc_ref.id
-        doc_ref.set(new_user)
+        # User + entry index trong 1 batch; create() chặn 2 request đăng ký cùng username đồng thời
+        batch = db.batch()
+        batch.set(doc_ref, new_user)
+        await identity_index.index_user(db, doc_ref.id, new_user, batch=batch, create=True)
+        try:
+            await batch.commit()
+        except Conflict:
+            raise HTTPException(status_code=400, detail="Tên đăng nhập đã tồn tại")
+        identity_index.remember(doc_ref.id, new_user)
 
         return {
             "success": True,
@@ -196,12 +195,11 @@ async def update_password(request: Request, password_data: PasswordUpdateRequest
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        users = db.collection('users').where('username', '==', password_data.username.lower().strip()).limit(1).get()
-        user_docs = list(users)
-        if not user_docs:
+        user_id = await identity_index.resolve(db, password_data.username, ('username',))
+        if not user_id:
             raise HTTPException(status_code=404, detail="Username not found")
         
-        user_docs[0].reference.update({
+        await db.collection('users').document(user_id).update({
             'password': password_data.newPassword,
             'updatedAt': firebase_service._get_server_timestamp()
         })
@@ -230,8 +228,7 @@ async def check_username_exists(request: Request, user_data: UserCheckRequest):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
         
-        users = db.collection('users').where('username', '==', user_data.username.lower().strip()).limit(1).get()
-        exists = len(list(users)) > 0
+        exists = await identity_index.resolve(db, user_data.username, ('username',)) is not None
         
         return {"exists": exists}
     except HTTPException:
@@ -260,32 +257,23 @@ async def login_firebase(request: Request, verify_data: TokenVerifyRequest):
     email = result.get("email")
 
     # 2. Tìm user trong Firestore
-    # Ưu tiên: Document ID khớp UID (Chuẩn nhất)
-    user_doc = db.collection('users').document(uid).get()
+    # Ưu tiên: Document ID khớp UID (Chuẩn nhất), sau đó Document có field 'uid' == uid
+    found = await identity_index.load_user(db, uid, ('id', 'uid'))
     
-    if not user_doc.exists:
-        # Thử tìm: Document có field 'uid' == uid
-        query = db.collection('users').where('uid', '==', uid).limit(1).get()
-        docs = list(query)
-        
-        if docs:
-            user_doc = docs[0]
-            # Cập nhật ID tài liệu thành UID để chuẩn hóa
-            # (Note: Cloud Firestore doesn't support renaming doc IDs, 
-            # but we can keep using this doc object)
-        else:
-            # --- TỰ ĐỘNG TẠO HỒ SƠ ADMIN NẾU CHƯA CÓ ---
-            # Không lưu username và email vào database theo yêu cầu mới
-            new_admin = {
-                'uid': uid,
-                'role': 'admin',
-                'fullName': "Administrator",
-                'createdAt': firebase_service._get_server_timestamp(),
-            }
-            db.collection('users').document(uid).set(new_admin)
-            user_doc = db.collection('users').document(uid).get()
+    if found:
+        user_data = found[1]
+    else:
+        # --- TỰ ĐỘNG TẠO HỒ SƠ ADMIN NẾU CHƯA CÓ ---
+        # Không lưu username và email vào database theo yêu cầu mới
+        new_admin = {
+            'uid': uid,
+            'role': 'admin',
+            'fullName': "Administrator",
+            'createdAt': firebase_service._get_server_timestamp(),
+        }
+        await db.collection('users').document(uid).set(new_admin)
+        user_data = (await db.collection('users').document(uid).get()).to_dict()
 
-    user_data = user_doc.to_dict()
     # Kiểm tra Role
     if user_data.get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Truy cập bị từ chối: Tài khoản này không có quyền Admin")
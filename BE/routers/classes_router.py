@@ -3,13 +3,38 @@ Classes Router - Class management endpoints
 Handles all class CRUD and registration operations
 """
 from models.schemas import ClassModel, ClassRegistrationRequest
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
 from typing import Optional, List
 from services.firebase_service import firebase_service
-from datetime import datetime
+from services.class_schedule import compile_schedule
+from services.class_registration import (
+    RegistrationError,
+    apply_slot,
+    existing_class_ids,
+    plan_registration,
+    read_classes,
+    registered_ids_of,
+    resolve_user_ref,
+    user_update,
+)
+from services.identity_index import identity_index
+from services.registration_queue import registration_queue
+from services.slot_counter import (
+    DEFAULT_SHARDS,
+    MAX_SHARDS,
+    configure_shards,
+    delete_shards,
+    load_slots,
+    shard_count_of,
+    slot_rollup,
+)
+from google.cloud import firestore
+import asyncio
 import traceback
 
 router = APIRouter()
+
  
 def to_snapshot(result):
     """
@@ -25,75 +50,6 @@ def to_snapshot(result):
     except:
         return None
 
-import re
-
-def parse_periods(p_str):
-    """Bulletproof: extracts all numbers/ranges from strings like 'Tiết 1-3, 5'"""
-    if not p_str: return set()
-    res = set()
-    try:
-        # Normalize: remove "Tiết", " ", etc
-        clean = str(p_str).upper().replace('TIẾT', '').strip()
-        # Handle commas and ranges
-        segments = [s.strip() for s in clean.replace(',', ' ').split()]
-        for seg in segments:
-            if '-' in seg:
-                parts = re.findall(r'\d+', seg)
-                if len(parts) >= 2:
-                    res.update(range(int(parts[0]), int(parts[-1]) + 1))
-            else:
-                nums = re.findall(r'\d+', seg)
-                for n in nums: res.add(int(n))
-    except: pass
-    return res
-
-def parse_days(d_str):
-    """Bulletproof: extracts days from '2-4-6', 'Thứ 2,4', etc"""
-    if not d_str: return set()
-    res = set()
-    try:
-        clean = str(d_str).lower().replace('thứ', '').strip()
-        # Special case: Sunday
-        if 'nhật' in clean or 'cn' in clean: res.add(8)
-        # Extract all digits
-        nums = re.findall(r'\d+', clean)
-        for n in nums:
-            val = int(n)
-            if 2 <= val <= 8: res.add(val)
-    except: pass
-    return res
-
-def parse_dates(dr_str):
-    if not dr_str: return None, None
-    try:
-        # Extract anything that looks like a date dd/mm/yyyy
-        dates = re.findall(r'\d{1,2}/\d{1,2}/\d{4}', str(dr_str))
-        if len(dates) >= 2:
-            d1 = datetime.strptime(dates[0], "%d/%m/%Y").date()
-            d2 = datetime.strptime(dates[1], "%d/%m/%Y").date()
-            return min(d1, d2), max(d1, d2)
-    except: pass
-    return None, None
-
-def get_class_schedule_info(data):
-    """Extracts components with robust fallback to 'schedule' string"""
-    days = data.get('dayOfWeek')
-    periods = data.get('periods')
-    dates = data.get('dateRange')
-    
-    # Fallback to schedule string parsing if fields missing
-    sched = data.get('schedule', '')
-    if sched and '|' in sched:
-        parts = [p.strip() for p in sched.split('|')]
-        # Format: Days | Periods | Room | DateRange
-        if not days and len(parts) >= 1: days = parts[0]
-        if not periods and len(parts) >= 2: periods = parts[1]
-        if not dates:
-            if len(parts) >= 4: dates = parts[3]
-            elif len(parts) == 3: dates = parts[2]
-            
-    return days, periods, dates
-
 @router.get("/list/{semester}")
 async def get_classes_by_semester(request: Request, semester: str):
     """Get all classes for a specific semester"""
@@ -102,19 +58,23 @@ async def get_classes_by_semester(request: Request, semester: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        classes = db.collection('classes').where('semester', '==', semester).order_by('createdAt', direction='DESCENDING').get()
+        classes = await db.collection('classes').where('semester', '==', semester).order_by('createdAt', direction='DESCENDING').get()
+        
+        docs = [(doc.id, doc.to_dict()) for doc in classes]
+        # Lớp chia shard: số chỗ lấy từ rollup (1 get_all chung cho các lớp chưa có trong cache)
+        sharded = {doc_id: shard_count_of(data) for doc_id, data in docs if shard_count_of(data)}
+        totals = await slot_rollup.totals(db, sharded) if sharded else {}
         
         result = []
-        for doc in classes:
-            data = doc.to_dict()
+        for doc_id, data in docs:
             result.append({
-                "classId": data.get('classId', doc.id),
+                "classId": data.get('classId', doc_id),
                 "name": data.get('name'),
                 "teacher": data.get('teacher'),
                 "schedule": data.get('schedule'),
                 "room": data.get('room', ''),
                 "maxSlots": data.get('maxSlots', 50),
-                "currentSlots": data.get('currentSlots', 0),
+                "currentSlots": totals.get(doc_id, data.get('currentSlots', 0)),
                 "semester": data.get('semester'),
             })
         
@@ -133,7 +93,7 @@ async def get_classes_by_teacher(request: Request, teacher_name: str):
             
         # Tìm các lớp có trường 'teacher' hoặc 'teacherName' khớp với teacher_name
         # Lưu ý: Firestore thực hiện query 'in' hoặc 'where'
-        classes = db.collection('classes').where('teacher', '==', teacher_name).get()
+        classes = await db.collection('classes').where('teacher', '==', teacher_name).get()
         
         result = []
         for doc in classes:
@@ -158,12 +118,16 @@ async def get_class(request: Request, class_id: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        doc_res = db.collection('classes').document(class_id).get()
+        doc_res = await db.collection('classes').document(class_id).get()
         doc = to_snapshot(doc_res)
         if doc is None or not doc.exists:
             raise HTTPException(status_code=404, detail="Class not found")
         
-        return {"success": True, "class": doc.to_dict()}
+        data = doc.to_dict()
+        if shard_count_of(data):
+            totals = await slot_rollup.totals(db, {doc.id: shard_count_of(data)})
+            data['currentSlots'] = totals[doc.id]
+        return {"success": True, "class": data}
     except HTTPException:
         raise
     except Exception as e:
@@ -178,7 +142,7 @@ async def get_students_in_class(request: Request, class_id: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        students = db.collection('users').where('role', '==', 'student').where('classId', '==', class_id).get()
+        students = await db.collection('users').where('role', '==', 'student').where('classId', '==', class_id).get()
         
         result = []
         for doc in students:
@@ -205,8 +169,21 @@ async def create_or_update_class(request: Request, class_data: ClassModel):
         
         data = class_data.dict()
         data['createdAt'] = firebase_service._get_server_timestamp()
+        # Parse lịch 1 lần lúc lưu -> đăng ký chỉ còn so bitmask + khoảng ngày
+        data['scheduleCompiled'] = compile_schedule(data)
         
-        db.collection('classes').document(class_data.classId).set(data, merge=True)
+        class_ref = db.collection('classes').document(class_data.classId)
+        existing = await class_ref.get(field_paths=['slotShards'])
+        shards = shard_count_of(existing.to_dict()) if existing.exists else DEFAULT_SHARDS
+        if shards:
+            # Số chỗ của lớp chia shard nằm ở các shard -> không ghi đè currentSlots
+            if existing.exists:
+                data.pop('currentSlots', None)
+            await class_ref.set(data, merge=True)
+            # Tạo shard cho lớp mới / chia lại capacity theo maxSlots mới
+            await configure_shards(db, class_data.classId, shards)
+        else:
+            await class_ref.set(data, merge=True)
         
         return {"success": True, "message": "Class saved successfully", "classId": class_data.classId}
     except Exception as e:
@@ -221,17 +198,88 @@ async def delete_class(request: Request, class_id: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        db.collection('classes').document(class_id).delete()
+        class_ref = db.collection('classes').document(class_id)
+        batch = db.batch()
+        await delete_shards(db, class_ref, batch)
+        batch.delete(class_ref)
+        await batch.commit()
+        slot_rollup.invalidate(class_id)
         return {"success": True, "message": "Class deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/{class_id}/slot-shards")
+async def configure_slot_shards(request: Request, class_id: str, shards: int = Query(..., ge=0, le=MAX_SHARDS)):
+    """
+    Chia bộ đếm chỗ của lớp "nóng" thành N shard (0 = tắt, gộp lại vào currentSlots).
+    Gọi lại với cùng N để chia lại capacity sau khi các shard lệch nhau.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        result = await configure_shards(db, class_id, shards)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Class not found")
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/backfill-schedules")
+async def backfill_compiled_schedules(request: Request, batch_size: int = Query(200, ge=1, le=500)):
+    """
+    Backfill job: ghi scheduleCompiled cho các lớp lưu trước khi lịch được compile lúc create/update.
+    Chỉ ghi các lớp thiếu hoặc khác version / khác kết quả compile.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        query = db.collection('classes').order_by(firestore.FieldPath.document_id())
+        scanned = updated = 0
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            docs = await page_query.limit(batch_size).get()
+            if not docs:
+                break
+
+            batch = db.batch()
+            pending = 0
+            for doc in docs:
+                data = doc.to_dict() or {}
+                compiled = compile_schedule(data)
+                if data.get('scheduleCompiled') != compiled:
+                    batch.update(doc.reference, {'scheduleCompiled': compiled})
+                    pending += 1
+            if pending:
+                await batch.commit()
+
+            scanned += len(docs)
+            updated += pending
+            last_doc = docs[-1]
+            if len(docs) < batch_size:
+                break
+
+        return {"success": True, "scanned": scanned, "updated": updated}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/register")
 async def handle_class_registration(request: Request, reg_data: ClassRegistrationRequest):
     """
     Handle class registration/unregistration with transaction
-    Ensures atomic operation for slot counting
+    Ensures atomic operation for slot counting.
+    Surge mode: queue the request (202 + ticketId), result via /register/tickets/{ticketId}
     """
     try:
         db = request.app.state.firebase_db
@@ -239,141 +287,89 @@ async def handle_class_registration(request: Request, reg_data: ClassRegistratio
             raise HTTPException(status_code=503, detail="Firebase not initialized")
         
         # 1. Resolve User Reference (Triple Fallback Resolution)
-        uid_input = str(reg_data.userId).strip()
-        user_ref = db.collection('users').document(uid_input)
-        user_snap = to_snapshot(user_ref.get())
-        
-        # If direct Doc ID lookup fails, try fallback logic
-        if user_snap is None or not user_snap.exists:
-            found_ref = None
-            
-            # Fallback 1: Search by 'uid' field (Some logic stores UID in a field separate from Doc ID)
-            uid_query = db.collection('users').where('uid', '==', uid_input).limit(1).get()
-            uid_docs = list(uid_query)
-            if uid_docs: 
-                found_ref = uid_docs[0].reference
-            else:
-                # Fallback 2: Search by 'username' field (Resilient to UID typos if username is used as identifier)
-                user_query = db.collection('users').where('username', '==', uid_input.lower()).limit(1).get()
-                user_docs = list(user_query)
-                if user_docs:
-                    found_ref = user_docs[0].reference
-            
-            if not found_ref:
-                raise Exception(f"[ERROR] Không tìm thấy học sinh với ID/UID hoặc Username: '{uid_input}'")
-            
-            user_ref = found_ref
-            # Log resolution for diagnostics (optional, will show in BE terminal)
-            print(f"[AUTH] Resolved identity '{uid_input}' to document: {user_ref.path}")
-        
-        # 2. Resolve Class Reference
-        class_id_input = str(reg_data.classId).strip()
-        class_ref = db.collection('classes').document(class_id_input)
-        # 3. Transaction Logic
+        user_ref = await resolve_user_ref(db, reg_data.userId)
+
+        # 2. Surge mode: per-class queue + group commit
+        if registration_queue.enabled:
+            ticket = registration_queue.submit(db, user_ref, reg_data)
+            return JSONResponse(status_code=202, content={"success": True, "queued": True, **ticket.to_dict()})
+
+        # 3. Resolve Class Reference
+        class_id = str(reg_data.classId).strip()
+        class_ref = db.collection('classes').document(class_id)
+
+        # 4. Transaction Logic
         @firebase_service._firestore_transaction
-        def run_registration(transaction):
-            # Inside transaction: Use transaction.get(ref) or ref.get(transaction=transaction)
-            # Both are supported, but transaction.get() is the canonical transactional read.
-            u_snap = transaction.get(user_ref)
-            c_snap = transaction.get(class_ref)
-            
-            # Handle potential iterable return from transactional get (Rare SDK quirk)
-            if not hasattr(u_snap, 'exists'): u_snap = list(u_snap)[0]
-            if not hasattr(c_snap, 'exists'): c_snap = list(c_snap)[0]
+        async def run_registration(transaction):
+            # Inside transaction: ref.get(transaction=transaction) always returns a single
+            # DocumentSnapshot on the async client (AsyncTransaction.get yields a stream).
+            u_snap, c_snap = await asyncio.gather(
+                user_ref.get(transaction=transaction),
+                class_ref.get(transaction=transaction),
+            )
             
             if not u_snap.exists: 
-                raise Exception(f"[ERROR] Không tìm thấy tài liệu người dùng: {user_ref.path}")
+                # Cached identity pointed at a deleted user -> drop it so the next request re-resolves
+                identity_index.invalidate_user(user_ref.id)
+                raise RegistrationError(f"[ERROR] Không tìm thấy tài liệu người dùng: {user_ref.path}", 404)
             if not c_snap.exists: 
-                raise Exception(f"[ERROR] Không tìm thấy tài liệu lớp học: {class_ref.path}")
+                raise RegistrationError(f"[ERROR] Không tìm thấy tài liệu lớp học: {class_ref.path}", 404)
             
             class_data = c_snap.to_dict() or {}
-            user_data = u_snap.to_dict() or {}
-            
-            if class_data.get('semester') != reg_data.semester:
-                raise Exception(f"[VALIDATION] Lớp học '{class_data.get('name')}' không thuộc học kỳ {reg_data.semester}")
-            
-            # Retrieve list of registered classes safely
-            registered_ids = user_data.get('registeredClassIds')
-            if not isinstance(registered_ids, list):
-                # Fallback / Migration logic for old schema
-                old_class_id = user_data.get('classId')
-                registered_ids = [old_class_id] if old_class_id else []
-            
-            current_slots = int(class_data.get('currentSlots', 0))
-            max_slots = int(class_data.get('maxSlots', 50))
-            
-            if reg_data.isRegister:
-                if reg_data.classId in registered_ids: return
-                
-                # --- CONFLICT CHECK ---
-                d_str, p_str, r_str = get_class_schedule_info(class_data)
-                new_day_set = parse_days(d_str)
-                new_period_set = parse_periods(p_str)
-                new_start, new_end = parse_dates(r_str)
-                
-                print(f"[DEBUG] Checking conflicts for '{class_data.get('name')}' ({reg_data.classId})")
-                print(f"       -> New Schedule: Days={new_day_set}, Periods={new_period_set}, Dates={new_start} to {new_end}")
-
-                for existing_raw_id in registered_ids:
-                    existing_id = str(existing_raw_id).strip()
-                    if not existing_id or existing_id == reg_data.classId: continue
-                    
-                    ex_ref = db.collection('classes').document(existing_id)
-                    ex_snap = to_snapshot(transaction.get(ex_ref))
-                    if ex_snap is None or not ex_snap.exists: continue
-                    
-                    ex_data = ex_snap.to_dict() or {}
-                    
-                    # Accuracy: Only check conflicts within the SAME semester
-                    if ex_data.get('semester') != reg_data.semester: continue
-                    
-                    ex_d_str, ex_p_str, ex_r_str = get_class_schedule_info(ex_data)
-                    ex_day_set = parse_days(ex_d_str)
-                    ex_period_set = parse_periods(ex_p_str)
-                    ex_start, ex_end = parse_dates(ex_r_str)
-
-                    # Intersection Check
-                    day_overlap = new_day_set.intersection(ex_day_set)
-                    period_overlap = new_period_set.intersection(ex_period_set)
-                    date_overlap = max(new_start, ex_start) <= min(new_end, ex_end) if (new_start and ex_start) else True
-                    
-                    print(f"       -> Comparing with '{ex_data.get('name')}' ({existing_id}):")
-                    print(f"          Days Match: {day_overlap}, Periods Match: {period_overlap}, Date Overlap: {date_overlap}")
-                    
-                    if day_overlap and period_overlap and date_overlap:
-                        overlap_days_sorted = sorted(list(day_overlap))
-                        day_names = [f"Thứ {d}" if d < 8 else "Chủ Nhật" for d in overlap_days_sorted]
-                        raise Exception(
-                            f"[CONFLICT] Trùng lịch với môn '{ex_data.get('name', existing_id)}'\n"
-                            f"● Thời gian: {', '.join(day_names)}, Tiết {sorted(list(period_overlap))}\n"
-                            f"● Đợt học: {ex_data.get('dateRange', 'Liên tục')}"
-                        )
-
-                if current_slots >= max_slots: raise Exception("[VALIDATION] Lớp học đã đủ số lượng sinh viên (Hết chỗ)")
-                
-                registered_ids.append(reg_data.classId)
-                transaction.update(class_ref, {'currentSlots': current_slots + 1})
-                transaction.update(user_ref, {
-                    'registeredClassIds': registered_ids,
-                    'classId': reg_data.classId,
-                    'currentSemester': reg_data.semester
-                })
-            else:
-                if reg_data.classId in registered_ids:
-                    registered_ids.remove(reg_data.classId)
-                    new_slots = max(0, current_slots - 1)
-                    transaction.update(class_ref, {'currentSlots': new_slots})
-                    transaction.update(user_ref, {
-                        'registeredClassIds': registered_ids,
-                    })
-
-        # 4. EXECUTE THE TRANSACTION (Universal pattern via decorator)
-        run_registration(db.transaction())
+            registered_ids = registered_ids_of(u_snap.to_dict() or {})
+
+            # All registered classes in ONE get_all inside the transaction, then check in memory
+            existing = {}
+            if reg_data.isRegister and class_id not in registered_ids:
+                print(f"[DEBUG] Checking conflicts for '{class_data.get('name')}' ({class_id})")
+                existing = await read_classes(db, existing_class_ids(registered_ids, class_id), transaction=transaction)
+
+            registered_ids = plan_registration(class_id, reg_data.semester, reg_data.isRegister,
+                                               class_data, registered_ids, existing)
+            if registered_ids is None:
+                return 0
+            # Slot count: currentSlots on the class doc, or one random shard for sharded classes
+            slots = await load_slots(db, class_ref, class_data, transaction)
+            await apply_slot(db, slots, reg_data.isRegister, transaction)
+            slots.write(transaction)
+            transaction.update(user_ref, user_update(class_id, reg_data.semester, reg_data.isRegister, registered_ids))
+            return slots.delta
+
+        # 5. EXECUTE THE TRANSACTION (Universal pattern via decorator)
+        slot_rollup.adjust(class_id, await run_registration(db.transaction()))
         
         action = "đăng ký" if reg_data.isRegister else "hủy đăng ký"
         return {"success": True, "message": f"Đã {action} thành công"}
+    except HTTPException:
+        raise
+    except RegistrationError as e:
+        print(f"[REGISTRATION] Rejected user {reg_data.userId}, class {reg_data.classId}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        import traceback
         print(f"[ERROR] Registration failed for user {reg_data.userId}, class {reg_data.classId}:")
         traceback.print_exc()
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/register/tickets/{ticket_id}")
+async def get_registration_ticket(ticket_id: str, wait: float = Query(0, ge=0, le=30)):
+    """Kết quả của yêu cầu đăng ký đã xếp hàng (wait > 0: long-poll tối đa wait giây)"""
+    ticket = registration_queue.get(ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy yêu cầu đăng ký (có thể đã hết hạn)")
+    ticket = await registration_queue.wait(ticket, wait)
+    return {"success": ticket.status != "failed", **ticket.to_dict()}
+
+
+@router.get("/register/surge")
+async def get_registration_surge():
+    """Trạng thái chế độ surge + thống kê hàng đợi"""
+    return {"success": True, **registration_queue.get_stats()}
+
+
+@router.post("/register/surge")
+async def set_registration_surge(enabled: bool = Query(...)):
+    """Bật / tắt chế độ surge lúc runtime (các yêu cầu đã xếp hàng vẫn được xử lý hết)"""
+    registration_queue.enabled = enabled
+    print(f"[REGISTRATION] Surge mode {'enabled' if enabled else 'disabled'}")
+    return {"success": True, **registration_queue.get_stats()}
@@ -3,99 +3,259 @@ Exams Router - Exam management endpoints
 Handles exam CRUD and results operations
 """
 
-from models.schemas import ExamCreateRequest, ExamResultRequest
-from fastapi import APIRouter, HTTPException, Request
+from models.schemas import BulkExamResultRequest, ExamCreateRequest, ExamResultRequest
+from pydantic import ValidationError
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional, List, Dict, Any
 from services.firebase_service import firebase_service
+from services.batch_loader import BatchLoader, request_loader
+from services.grading_engine import grading_engine
+from services.exam_meta_cache import exam_meta_cache
+from services.identity_index import identity_index
+from services import exam_storage
 
+from google.api_core.exceptions import NotFound
 from google.cloud import firestore
+import asyncio
+import csv
+import heapq
+import io
+import json
+import itertools
+import statistics
 import traceback
 
 router = APIRouter()
 
-def extract_snapshot(res_or_ref):
-    """Universally extracts a DocumentSnapshot from a reference or generator."""
-    if res_or_ref is None: return None
-    if hasattr(res_or_ref, 'exists'): return res_or_ref
-    if hasattr(res_or_ref, 'get'):
-        res = res_or_ref.get()
-        if hasattr(res, 'exists'): return res
-        try:
-            docs = list(res)
-            return docs[0] if docs else None
-        except: return None
-    try:
-        docs = list(res_or_ref)
-        return docs[0] if docs else None
-    except: return None
+async def load_exam_meta(db, exam_ids):
+    """exam_id -> dict metadata (title, subject, ...) từ exam_meta_cache; None nếu đề không tồn tại"""
+    metas = await exam_meta_cache.get_many(db, exam_ids)
+    return {exam_id: meta.to_dict() if meta else None for exam_id, meta in metas.items()}
+
+
+# Listing chỉ đọc các field tóm tắt (Firestore projection) - không tải mảng questions
+EXAM_SUMMARY_FIELDS = ['title', 'subject', 'structure', 'questionCount', 'createdAt']
+
+
+def exam_summary(doc):
+    data = doc.to_dict() or {}
+    return {
+        "id": doc.id,
+        "title": data.get('title'),
+        "subject": data.get('subject'),
+        "structure": data.get('structure'),
+        "questionCount": data.get('questionCount'),
+        "createdAt": str(data.get('createdAt', '')),
+    }
+
+
+async def fetch_page(query, collection, limit, start_after=None, order_field='createdAt'):
+    """
+    Cursor-based pagination: start_after là id của document cuối trang trước.
+    Trả về (docs, nextCursor) - nextCursor None khi đã hết dữ liệu.
+    """
+    if start_after:
+        cursor = await collection.document(start_after).get(field_paths=[order_field])
+        if not cursor.exists:
+            raise HTTPException(status_code=400, detail="Invalid start_after cursor")
+        query = query.start_after(cursor)
+    docs = await query.limit(limit).get()
+    next_cursor = docs[-1].id if len(docs) == limit else None
+    return docs, next_cursor
+
 
 @router.get("/list")
-async def get_all_exams(request: Request):
-    """Get all exams"""
+async def get_all_exams(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    start_after: Optional[str] = Query(None, description="Exam id of the last item of the previous page"),
+):
+    """Get exams (summary only, newest first, paginated)"""
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
-            
-        exams = db.collection('exams').order_by('createdAt', direction='DESCENDING').get()
-        
-        result = []
-        for doc in exams:
-            data = doc.to_dict()
-            result.append({
-                "id": doc.id,
-                "title": data.get('title'),
-                "subject": data.get('subject'),
-                "structure": data.get('structure'),
-                "questionCount": len(data.get('questions', [])),
-                "createdAt": str(data.get('createdAt', '')),
-            })
-        
-        return {"success": True, "exams": result}
+
+        exams_col = db.collection('exams')
+        query = exams_col.select(EXAM_SUMMARY_FIELDS).order_by('createdAt', direction='DESCENDING')
+        docs, next_cursor = await fetch_page(query, exams_col, limit, start_after)
+
+        return {"success": True, "exams": [exam_summary(doc) for doc in docs], "nextCursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/by-subject/{subject}")
-async def get_exams_by_subject(request: Request, subject: str):
-    """Get exams by subject name"""
+async def get_exams_by_subject(
+    request: Request,
+    subject: str,
+    limit: int = Query(50, ge=1, le=200),
+    start_after: Optional[str] = Query(None, description="Exam id of the last item of the previous page"),
+):
+    """Get exams by subject name (summary only - full questions via GET /{exam_id})"""
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
-            
-        exams = db.collection('exams').where('subject', '==', subject).get()
-        
-        result = []
-        for doc in exams:
-            data = doc.to_dict()
-            result.append({
-                "id": doc.id,
-                "title": data.get('title'),
-                "subject": data.get('subject'),
-                "structure": data.get('structure'),
-                "questions": data.get('questions', []),
-                "createdAt": str(data.get('createdAt', '')),
-            })
-        
-        return {"success": True, "exams": result}
+
+        exams_col = db.collection('exams')
+        # Order theo document id: equality filter + __name__ không cần composite index
+        query = (exams_col.where('subject', '==', subject)
+                 .select(EXAM_SUMMARY_FIELDS)
+                 .order_by(firestore.FieldPath.document_id()))
+        docs, next_cursor = await fetch_page(query, exams_col, limit, start_after)
+
+        return {"success": True, "exams": [exam_summary(doc) for doc in docs], "nextCursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/backfill-question-count")
+async def backfill_question_count(request: Request, batch_size: int = Query(200, ge=1, le=500)):
+    """
+    Backfill job: ghi questionCount cho các exam tạo trước khi field này được lưu lúc create.
+    Quét theo trang (document id), chỉ ghi các document thiếu hoặc sai questionCount.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        exams_col = db.collection('exams')
+        query = exams_col.select(['questions', 'questionCount', 'questionStorage']).order_by(firestore.FieldPath.document_id())
+        scanned = updated = 0
+        last_doc = None
+
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            docs = await page_query.limit(batch_size).get()
+            if not docs:
+                break
+
+            batch = db.batch()
+            pending = 0
+            for doc in docs:
+                data = doc.to_dict() or {}
+                if exam_storage.is_paged(data):
+                    continue  # questionCount được ghi cùng lúc với các trang
+                count = len(data.get('questions') or [])
+                if data.get('questionCount') != count:
+                    batch.update(doc.reference, {'questionCount': count})
+                    pending += 1
+            if pending:
+                await batch.commit()
+
+            scanned += len(docs)
+            updated += pending
+            last_doc = docs[-1]
+            if len(docs) < batch_size:
+                break
+
+        return {"success": True, "scanned": scanned, "updated": updated}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/{exam_id}")
-async def get_exam(request: Request, exam_id: str):
-    """Get exam by ID with full questions"""
+async def get_exam(request: Request, exam_id: str, metadata_only: bool = False):
+    """Get exam by ID with full questions (metadata_only=true: không đọc câu hỏi)"""
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
-            
-        doc = db.collection('exams').document(exam_id).get()
+
+        exam_ref = db.collection('exams').document(exam_id)
+        if metadata_only:
+            doc = await exam_ref.get(field_paths=EXAM_SUMMARY_FIELDS + ['updatedAt', 'questionStorage', 'questionPages'])
+        else:
+            doc = await exam_ref.get()
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Exam not found")
-        
-        return {"success": True, "exam": doc.to_dict()}
+
+        exam = doc.to_dict()
+        if not metadata_only and exam_storage.is_paged(exam):
+            exam['questions'] = await exam_storage.load_questions(db, exam_id, exam)
+        return {"success": True, "exam": exam}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{exam_id}/questions")
+async def get_exam_questions(
+    request: Request,
+    exam_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(25, ge=1, le=200),
+):
+    """Paginated questions of an exam (chỉ đọc các trang chứa đoạn được yêu cầu)"""
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        exam_ref = db.collection('exams').document(exam_id)
+        # Đề dạng pages: projection không kéo questions; đề inline: vẫn phải đọc field questions
+        doc = await exam_ref.get(field_paths=exam_storage.STORAGE_FIELDS)
+        if not doc.exists:
+            raise HTTPException(status_code=404, detail="Exam not found")
+
+        data = doc.to_dict()
+        questions = await exam_storage.load_questions(db, exam_id, data, offset=offset, limit=limit)
+        total = data.get('questionCount', len(data.get('questions') or []))
+        return {
+            "success": True,
+            "questions": questions,
+            "offset": offset,
+            "total": total,
+            "nextOffset": offset + len(questions) if offset + len(questions) < total else None,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/migrate-question-storage")
+async def migrate_question_storage(request: Request, batch_size: int = Query(50, ge=1, le=200)):
+    """
+    Migration: chuyển các đề còn lưu questions inline sang subcollection question_pages.
+    Quét theo document id từng trang; chạy lại nhiều lần an toàn (đề đã chuyển được bỏ qua).
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        query = db.collection('exams').select(exam_storage.STORAGE_FIELDS).order_by(firestore.FieldPath.document_id())
+        scanned = migrated = 0
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc else query
+            docs = await page_query.limit(batch_size).get()
+            if not docs:
+                break
+            done = await asyncio.gather(*(
+                exam_storage.migrate_exam(db, doc.reference, doc.to_dict() or {}) for doc in docs
+            ))
+            for doc, changed in zip(docs, done):
+                if changed:
+                    exam_meta_cache.invalidate(doc.id)
+            scanned += len(docs)
+            migrated += sum(done)
+            last_doc = docs[-1]
+            if len(docs) < batch_size:
+                break
+
+        return {"success": True, "scanned": scanned, "migrated": migrated}
     except HTTPException:
         raise
     except Exception as e:
@@ -123,7 +283,9 @@ async def create_exam(request: Request, exam_data: ExamCreateRequest):
             'updatedAt': firebase_service._get_server_timestamp(),
         }
         
-        db.collection('exams').document(doc_id).set(entry)
+        # Câu hỏi -> subcollection question_pages (hoặc inline nếu EXAM_QUESTION_STORAGE=inline)
+        await exam_storage.write_exam(db, doc_id, entry)
+        exam_meta_cache.invalidate(doc_id)
         return {"success": True, "examId": doc_id, "message": "Exam created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -137,7 +299,8 @@ async def delete_exam(request: Request, exam_id: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        db.collection('exams').document(exam_id).delete()
+        await exam_storage.delete_exam(db, exam_id)
+        exam_meta_cache.invalidate(exam_id)
         return {"success": True, "message": "Exam deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -145,138 +308,431 @@ async def delete_exam(request: Request, exam_id: str):
 
 # ============ EXAM RESULTS ============
 
+# ---- exam_stats/{examId}: aggregate duy trì tăng dần cùng lúc với mỗi lần nộp / xóa bài ----
+HISTOGRAM_BUCKETS = 10
+
+
+def score_bucket(correct_count, total_questions):
+    """Bucket theo tỉ lệ câu đúng: bucket i = [i*10%, (i+1)*10%), điểm tuyệt đối vào bucket cuối"""
+    if not total_questions:
+        return 0
+    return min(HISTOGRAM_BUCKETS - 1, int(HISTOGRAM_BUCKETS * (correct_count or 0) / total_questions))
+
+
+# Field của exam_results cần để cộng vào exam_stats (projection khi tính lại)
+STATS_RESULT_FIELDS = ['score', 'scoreBucket', 'correctCount', 'totalQuestions', 'correctQuestions']
+
+
+def exam_stats_totals(results):
+    """(scoreSum, scoreSumSq, histogram, questionCorrect) của các bài làm"""
+    score_sum = score_sum_sq = 0.0
+    histogram, question_correct = {}, {}
+    for result in results:
+        score = float(result.get('score') or 0)
+        score_sum += score
+        score_sum_sq += score * score
+        bucket = result.get('scoreBucket')
+        if bucket is None:
+            bucket = score_bucket(result.get('correctCount'), result.get('totalQuestions'))
+        histogram[str(bucket)] = histogram.get(str(bucket), 0) + 1
+        for question in result.get('correctQuestions') or []:
+            question_correct[str(question)] = question_correct.get(str(question), 0) + 1
+    return score_sum, score_sum_sq, histogram, question_correct
+
+
+def exam_stats_delta(results, sign=1):
+    """Increment-only update (merge=True) cho exam_stats khi thêm (sign=1) / xóa (sign=-1) các bài làm của 1 đề"""
+    score_sum, score_sum_sq, histogram, question_correct = exam_stats_totals(results)
+    return {
+        'examId': results[0].get('examId'),
+        'count': firestore.Increment(sign * len(results)),
+        'scoreSum': firestore.Increment(sign * score_sum),
+        'scoreSumSq': firestore.Increment(sign * score_sum_sq),
+        'histogram': {k: firestore.Increment(sign * n) for k, n in histogram.items()},
+        'questionCorrect': {k: firestore.Increment(sign * n) for k, n in question_correct.items()},
+        'updatedAt': firebase_service._get_server_timestamp(),
+    }
+
+
+def build_result_entry(res_data, exam_meta):
+    """ExamResultRequest + ExamMeta (cache) -> document exam_results (chấm trên server nếu đề có đáp án)"""
+    # Đề không có câu hỏi -> giữ kết quả client gửi (legacy)
+    score, total_questions, correct_count, correct_questions = (
+        res_data.score, res_data.totalQuestions, res_data.correctCount, [])
+    if exam_meta and exam_meta.answer_key.total:
+        graded = grading_engine.grade(exam_meta.answer_key, res_data.answers)
+        score, total_questions, correct_count = graded.score, graded.total_questions, graded.correct_count
+        correct_questions = graded.correct_questions
+
+    return {
+        'examId': res_data.examId,
+        'examTitle': (exam_meta.title if exam_meta else None) or "Đề thi", # Denormalize
+        'studentId': res_data.studentId,
+        'studentName': res_data.studentName,
+        'classId': res_data.classId,
+        'answers': res_data.answers,
+        'score': score,
+        'totalQuestions': total_questions,
+        'correctCount': correct_count,
+        'submittedAt': firebase_service._get_server_timestamp(),
+        # Lưu lại phần đã cộng vào exam_stats để khi xóa trừ đúng phần đó
+        'correctQuestions': correct_questions,
+        'scoreBucket': score_bucket(correct_count, total_questions),
+        'statsApplied': True,
+    }
+
+
+def summarize_exam_stats(exam_id, stats):
+    """exam_stats document -> count / mean / stddev / histogram / tỉ lệ đúng từng câu"""
+    stats = stats or {}
+    count = stats.get('count') or 0
+    score_sum = stats.get('scoreSum') or 0.0
+    mean = score_sum / count if count else None
+    variance = max(0.0, (stats.get('scoreSumSq') or 0.0) / count - mean * mean) if count else None
+    histogram = stats.get('histogram') or {}
+    question_correct = stats.get('questionCorrect') or {}
+    return {
+        "examId": exam_id,
+        "count": count,
+        "mean": round(mean, 2) if mean is not None else None,
+        "stddev": round(variance ** 0.5, 2) if variance is not None else None,
+        "histogram": [
+            {"from": i * 100 // HISTOGRAM_BUCKETS, "to": (i + 1) * 100 // HISTOGRAM_BUCKETS,
+             "count": histogram.get(str(i), 0)}
+            for i in range(HISTOGRAM_BUCKETS)
+        ],
+        "questionCorrect": {
+            i: {"correct": n, "rate": round(n / count, 4) if count else None}
+            for i, n in sorted(question_correct.items(), key=lambda kv: int(kv[0]))
+        },
+        "updatedAt": str(stats.get('updatedAt', '')),
+    }
+
+
 @router.post("/results")
 async def submit_exam_result(request: Request, res_data: ExamResultRequest):
-    """Submit exam result for a student"""
+    """Submit exam result for a student (result + exam_stats increment trong cùng 1 batch write)"""
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        # 1. Fetch Exam title for denormalization
-        exam_title = "Đề thi"
-        try:
-            ex_snap = extract_snapshot(db.collection('exams').document(res_data.examId))
-            if ex_snap and ex_snap.exists:
-                exam_title = ex_snap.to_dict().get('title', exam_title)
-        except: pass
+        # Exam title (denormalization) + answer key (server-side grading), từ cache metadata
+        exam_meta = await exam_meta_cache.get_one(db, res_data.examId)
+        result_data = build_result_entry(res_data, exam_meta)
 
-        result_data = {
-            'examId': res_data.examId,
-            'examTitle': exam_title, # Denormalize
-            'studentId': res_data.studentId,
-            'studentName': res_data.studentName,
-            'classId': res_data.classId,
-            'answers': res_data.answers,
-            'score': res_data.score,
-            'totalQuestions': res_data.totalQuestions,
-            'correctCount': res_data.correctCount,
-            'submittedAt': firebase_service._get_server_timestamp(),
+        result_ref = db.collection('exam_results').document()
+        batch = db.batch()
+        batch.set(result_ref, result_data)
+        batch.set(db.collection('exam_stats').document(res_data.examId), exam_stats_delta([result_data]), merge=True)
+        await batch.commit()
+        return {
+            "success": True, "resultId": result_ref.id, "message": "Result submitted successfully",
+            "score": result_data['score'], "correctCount": result_data['correctCount'],
+            "totalQuestions": result_data['totalQuestions'],
         }
-        
-        doc_ref = db.collection('exam_results').add(result_data)
-        return {"success": True, "resultId": doc_ref[1].id, "message": "Result submitted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Firestore batched write tối đa 500 thao tác
+BATCH_WRITE_LIMIT = 500
+
+
+@router.post("/results/bulk")
+async def submit_exam_results_bulk(request: Request, bulk: BulkExamResultRequest):
+    """
+    Bulk submit (proctor machine / offline tablets sync).
+    Mỗi item được validate riêng, đề được đọc 1 lần cho mỗi examId (1 get_all),
+    kết quả + exam_stats increment (gộp theo đề) ghi bằng batched writes <= 500 thao tác.
+    Trả về trạng thái từng item theo index.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        items = [None] * len(bulk.results)
+        valid = []
+        for index, raw in enumerate(bulk.results):
+            try:
+                valid.append((index, ExamResultRequest.model_validate(raw)))
+            except ValidationError as e:
+                items[index] = {"index": index, "success": False,
+                                "detail": e.errors(include_url=False, include_context=False)}
+
+        exams = await exam_meta_cache.get_many(db, [res.examId for _, res in valid])
+
+        # Chia chunk sao cho (số kết quả + số đề distinct trong chunk) <= 500
+        chunks, chunk, chunk_exams = [], [], set()
+        for index, res in valid:
+            extra = 1 + (res.examId not in chunk_exams)
+            if chunk and len(chunk) + len(chunk_exams) + extra > BATCH_WRITE_LIMIT:
+                chunks.append(chunk)
+                chunk, chunk_exams = [], set()
+            chunk.append((index, res))
+            chunk_exams.add(res.examId)
+        if chunk:
+            chunks.append(chunk)
+
+        results_col = db.collection('exam_results')
+        stats_col = db.collection('exam_stats')
+
+        async def commit_chunk(chunk):
+            batch = db.batch()
+            by_exam = {}
+            written = []
+            for index, res in chunk:
+                entry = build_result_entry(res, exams.get(res.examId))
+                ref = results_col.document()
+                batch.set(ref, entry)
+                by_exam.setdefault(res.examId, []).append(entry)
+                written.append((index, ref.id, entry))
+            for exam_id, entries in by_exam.items():
+                batch.set(stats_col.document(exam_id), exam_stats_delta(entries), merge=True)
+            try:
+                await batch.commit()
+            except Exception as e:
+                print(f"[WARN] Bulk result chunk failed: {e}")
+                for index, _, _ in written:
+                    items[index] = {"index": index, "success": False, "detail": str(e)}
+                return
+            for index, result_id, entry in written:
+                items[index] = {"index": index, "success": True, "resultId": result_id,
+                                "score": entry['score'], "correctCount": entry['correctCount']}
+
+        await asyncio.gather(*(commit_chunk(c) for c in chunks))
+
+        succeeded = sum(1 for item in items if item["success"])
+        return {"success": succeeded == len(items), "total": len(items),
+                "succeeded": succeeded, "failed": len(items) - succeeded, "items": items}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{exam_id}/stats")
+async def get_exam_stats(request: Request, exam_id: str):
+    """Exam dashboard: 1 document read bất kể số lượng bài làm"""
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        snap = await db.collection('exam_stats').document(exam_id).get()
+        return {"success": True, "stats": summarize_exam_stats(exam_id, snap.to_dict() if snap.exists else None)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def update_results(db, updates):
+    """batch.update theo chunk <= 500; bài bị xóa trong lúc đó (NotFound) thì bỏ qua"""
+    for start in range(0, len(updates), BATCH_WRITE_LIMIT):
+        chunk = updates[start:start + BATCH_WRITE_LIMIT]
+        batch = db.batch()
+        for ref, fields in chunk:
+            batch.update(ref, fields)
+        try:
+            await batch.commit()
+        except NotFound:
+            for ref, fields in chunk:
+                try:
+                    await ref.update(fields)
+                except NotFound:
+                    pass
+
+
+async def write_exam_stats(db, exam_id):
+    """
+    Ghi đè exam_stats từ các bài làm hiện có trong MỘT transaction. exam_stats được đọc
+    TRƯỚC query bài làm: mọi lần nộp / xóa đều ghi exam_stats, nên commit chen vào giữa
+    làm transaction chạy lại với dữ liệu mới thay vì bị ghi đè mất.
+    """
+    stats_ref = db.collection('exam_stats').document(exam_id)
+    query = db.collection('exam_results').where('examId', '==', exam_id).select(STATS_RESULT_FIELDS)
+
+    @firebase_service._firestore_transaction
+    async def run(transaction):
+        await stats_ref.get(transaction=transaction)
+        docs = await query.get(transaction=transaction)
+        score_sum, score_sum_sq, histogram, question_correct = exam_stats_totals(
+            [doc.to_dict() or {} for doc in docs])
+        stats = {'examId': exam_id, 'count': len(docs), 'scoreSum': score_sum, 'scoreSumSq': score_sum_sq,
+                 'histogram': histogram, 'questionCorrect': question_correct,
+                 'updatedAt': firebase_service._get_server_timestamp()}
+        transaction.set(stats_ref, stats)
+        return stats
+
+    return await run(db.transaction())
+
+
+async def recompute_exam_stats(db, exam_id, regrade=False):
+    """
+    Tính lại exam_stats từ toàn bộ exam_results của đề; regrade=True thì chấm lại
+    mọi bài bằng đáp án hiện tại (cả lớp trong 1 lượt grade_batch) trước khi tổng hợp.
+    1. Cập nhật điểm / field thống kê của từng bài (batch, ngoài transaction)
+    2. write_exam_stats: exam_stats = tổng các bài đang lưu, trong transaction
+    -> chạy được khi học sinh vẫn đang nộp / giáo viên đang xóa bài.
+    Trả về (stats, số bài có điểm thay đổi).
+    """
+    if regrade:
+        # Đáp án vừa được sửa -> mọi lần nộp từ giờ dùng key mới (bỏ cache TRƯỚC khi đọc bài làm)
+        exam_meta_cache.invalidate(exam_id)
+    exam_snap = await db.collection('exams').document(exam_id).get(field_paths=exam_storage.STORAGE_FIELDS)
+    exam_questions = await exam_storage.load_questions(db, exam_id, exam_snap.to_dict()) if exam_snap.exists else []
+    key = grading_engine.compile_key(exam_id, exam_questions)
+    regrade = regrade and bool(exam_questions)
+
+    # Regrade quét 2 lượt: bài nộp đang bay lúc bỏ cache (đã chấm bằng key cũ) được chấm lại ở lượt 2
+    seen = set()
+    changed = 0
+    for _sweep in range(2 if regrade else 1):
+        docs = await db.collection('exam_results').where('examId', '==', exam_id).get()
+        results = [(doc.reference, doc.to_dict()) for doc in docs if doc.id not in seen]
+        seen.update(doc.id for doc in docs)
+
+        needs_grading = [i for i, (_, data) in enumerate(results) if regrade or data.get('correctQuestions') is None]
+        graded = dict(zip(needs_grading, grading_engine.grade_batch(key, [results[i][1].get('answers') for i in needs_grading])))
+
+        updates = []
+        for i, (ref, data) in enumerate(results):
+            fields = {}
+            grade = graded.get(i)
+            if grade is not None:
+                fields['correctQuestions'] = grade.correct_questions
+                if regrade:
+                    if (data.get('score'), data.get('correctCount')) != (grade.score, grade.correct_count):
+                        changed += 1
+                    data.update(score=grade.score, correctCount=grade.correct_count, totalQuestions=grade.total_questions)
+                    fields.update(score=grade.score, correctCount=grade.correct_count,
+                                  totalQuestions=grade.total_questions, regradedAt=firebase_service._get_server_timestamp())
+            bucket = score_bucket(data.get('correctCount'), data.get('totalQuestions'))
+            if data.get('scoreBucket') != bucket:
+                fields['scoreBucket'] = bucket
+            if not data.get('statsApplied'):
+                fields['statsApplied'] = True
+            if fields:
+                updates.append((ref, fields))
+        await update_results(db, updates)
+
+    return await write_exam_stats(db, exam_id), changed
+
+
+@router.post("/{exam_id}/stats/rebuild")
+async def rebuild_exam_stats(request: Request, exam_id: str):
+    """
+    Tính lại exam_stats từ toàn bộ exam_results của đề (cho dữ liệu nộp trước khi có aggregate).
+    Đánh dấu statsApplied cho các bài làm để các lần xóa sau trừ đúng.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        stats, _ = await recompute_exam_stats(db, exam_id)
+        return {"success": True, "stats": summarize_exam_stats(exam_id, stats)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{exam_id}/regrade")
+async def regrade_exam(request: Request, exam_id: str):
+    """
+    Chấm lại toàn bộ bài làm của đề bằng đáp án hiện tại (sau khi sửa đáp án) và cập nhật exam_stats.
+    An toàn khi học sinh vẫn đang nộp: exam_stats được tính lại trong transaction (write_exam_stats).
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        stats, changed = await recompute_exam_stats(db, exam_id, regrade=True)
+        return {"success": True, "regraded": stats['count'], "changed": changed,
+                "stats": summarize_exam_stats(exam_id, stats)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
         return {"success": True, "results": result_list}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/results/list/all")
-async def get_all_results(request: Request, teacher_name: Optional[str] = None):
+async def get_all_results(
+    request: Request,
+    teacher_name: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    start_after: Optional[str] = Query(None, description="Result id of the last item of the previous page"),
+):
     """
-    Get all exam results (Admin/Teacher view)
-    - If teacher_name is provided: Filter results by classes owned by that teacher.
+    Get exam results, newest first, paginated (Admin/Teacher view)
+    - If teacher_name is provided: only results of classes owned by that teacher
+      (pushed down as where('classId', 'in', ...) per 30 classes, merged by submittedAt).
     - If None: Return all results (Admin view)
+    Teacher queries use the composite index exam_results(classId ASC, submittedAt DESC).
     """
     print(f"[DEBUG] GET /results/list/all - Teacher restriction: '{teacher_name}'")
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
-            
+
+        results_col = db.collection('exam_results')
+        base_query = results_col.order_by('submittedAt', direction='DESCENDING')
+
         # 0. Authorization Context
-        allowed_class_ids = set()
         if teacher_name:
             # Teacher Mode: Fetch classes owned by this teacher
             # Notes: 'teacher' field in classes collection stores the teacher's Name
-            try:
-                classes_query = db.collection('classes').where('teacher', '==', teacher_name).get()
-                for c in classes_query:
-                    allowed_class_ids.add(c.id)
-                print(f"[AUTH] Teacher '{teacher_name}' manages classes: {allowed_class_ids}")
-                
-                if not allowed_class_ids:
-                    return {"success": True, "results": []} # Teacher has no classes
-            except Exception as auth_err:
-                 print(f"[AUTH] Failed to fetch teacher classes: {auth_err}")
-
-        # 1. Fetch all results (or filtered query if possible)
-        # Using post-query filtering for flexibility if classId filtering is complex
-        results_query = db.collection('exam_results').order_by('submittedAt', direction='DESCENDING').get()
-        all_results = list(results_query)
-        print(f"[DEBUG] Found {len(all_results)} total results (pre-filter)")
-
-        # Filter by Class ID if restricted
-        if teacher_name:
-            results = [doc for doc in all_results if doc.to_dict().get('classId') in allowed_class_ids]
-            print(f"[AUTH] Filtered down to {len(results)} results for teacher")
+            classes_query = await db.collection('classes').where('teacher', '==', teacher_name).select([]).get()
+            allowed_class_ids = [c.id for c in classes_query]
+            print(f"[AUTH] Teacher '{teacher_name}' manages classes: {allowed_class_ids}")
+            if not allowed_class_ids:
+                return {"success": True, "results": [], "nextCursor": None} # Teacher has no classes
+            queries = [
+                results_col.where('classId', 'in', allowed_class_ids[i:i + 30])
+                .order_by('submittedAt', direction='DESCENDING')
+                for i in range(0, len(allowed_class_ids), 30)
+            ]
         else:
-            results = all_results
-        
-        # 2. Get unique user IDs to fetch detail in one go
-        # Filter None or empty IDs to prevent query crashes
-        uids_raw = [doc.to_dict().get('studentId') for doc in results]
-        uids = list(set([uid for uid in uids_raw if uid]))
-        
-        user_map = {}
-        if uids:
-            print(f"[DEBUG] Fetching details for {len(uids)} students")
-            # Batch fetch users
-            for i in range(0, len(uids), 30):
-                batch_uids = uids[i:i+30]
-                try:
-                    user_docs = db.collection('users').where('uid', 'in', batch_uids).get()
-                    for u_doc in user_docs:
-                        user_map[u_doc.id] = u_doc.to_dict()
-                        if 'uid' in user_map[u_doc.id]:
-                            user_map[user_map[u_doc.id]['uid']] = user_map[u_doc.id]
-                except Exception as u_err:
-                    print(f"[WARN] Failed fetching users batch: {u_err}")
-
-        # 3. Get unique Exam IDs to fetch titles
-        exam_ids_raw = [doc.to_dict().get('examId') for doc in results]
-        exam_ids = list(set([eid for eid in exam_ids_raw if eid]))
-        
-        exam_map = {}
-        if exam_ids:
-            print(f"[DEBUG] Fetching details for {len(exam_ids)} exams")
-            from google.cloud import firestore
-            for i in range(0, len(exam_ids), 30):
-                batch_exam_ids = exam_ids[i:i+30]
-                try:
-                    exam_docs = db.collection('exams').where(firestore.FieldPath.document_id(), 'in', batch_exam_ids).get()
-                    for e_doc in exam_docs:
-                        exam_map[e_doc.id] = e_doc.to_dict()
-                except Exception as ex_err:
-                    print(f"[WARN] Failed fetching exams batch: {ex_err}")
+            queries = [base_query]
+
+        # 1. Mỗi query chỉ cần tối đa `limit` docs; merge các chunk theo (submittedAt, id) giảm dần
+        if start_after:
+            cursor = await results_col.document(start_after).get(field_paths=['submittedAt'])
+            if not cursor.exists:
+                raise HTTPException(status_code=400, detail="Invalid start_after cursor")
+            queries = [q.start_after(cursor) for q in queries]
+        pages = await asyncio.gather(*(q.limit(limit).get() for q in queries))
+        merged = heapq.merge(*pages, key=lambda d: (d.get('submittedAt'), d.id), reverse=True)
+        page = [(doc.id, doc.to_dict()) for doc in itertools.islice(merged, limit)]
+        next_cursor = page[-1][0] if len(page) == limit else None
+        print(f"[DEBUG] Page of {len(page)} results")
+
+        # 2. Get unique user IDs / Exam IDs of this page only
+        uids = list({data.get('studentId') for _, data in page if data.get('studentId')})
+        exam_ids = list({data.get('examId') for _, data in page if data.get('examId')})
+
+        # 3. Users and exams joins are independent -> batched by the request loader, fanned out at once
+        loader = request_loader(request)
+        user_map, exam_map = await asyncio.gather(
+            loader.load_many_by('users', 'uid', uids, ['fullName', 'birthDate', 'department']),
+            load_exam_meta(db, exam_ids),
+        )
 
         result_list = []
-        for doc in results:
-            data = doc.to_dict()
+        for doc_id, data in page:
             s_id = data.get('studentId')
             e_id = data.get('examId')
-            u_info = user_map.get(s_id, {})
-            e_info = exam_map.get(e_id, {})
+            u_info = user_map.get(s_id) or {}
+            e_info = exam_map.get(e_id) or {}
             
             # Logic Update: Use examId as display title
             display_title = e_id if e_id else (data.get('examTitle') or e_info.get('title', 'Đề thi'))
 
             result_list.append({
-                "id": doc.id,
+                "id": doc_id,
                 "examId": e_id,
                 "examTitle": display_title, 
                 "studentId": s_id,
@@ -289,15 +745,169 @@ async def get_all_results(request: Request, teacher_name: Optional[str] = None):
                 "department": u_info.get('department'),
             })
         
-        return {"success": True, "results": result_list}
+        return {"success": True, "results": result_list, "nextCursor": next_cursor}
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] 500 in get_all_results: {str(e)}")
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
 
+EXPORT_COLUMNS = [
+    "id", "examId", "examTitle", "studentId", "studentName", "birthDate", "department",
+    "classId", "score", "totalQuestions", "correctCount", "submittedAt",
+]
+
+
+async def iter_query(query, page_size):
+    """Duyệt query theo từng trang (cursor = snapshot cuối trang) - chỉ giữ 1 trang trong bộ nhớ"""
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc else query
+        docs = await page_query.limit(page_size).get()
+        for doc in docs:
+            yield doc
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+async def merge_by_submitted_at(queries, page_size):
+    """K-way merge các query (đều order_by submittedAt tăng dần) theo (submittedAt, id)"""
+    iterators = [iter_query(q, page_size).__aiter__() for q in queries]
+    heap = []
+
+    async def push(i):
+        try:
+            doc = await iterators[i].__anext__()
+        except StopAsyncIteration:
+            return
+        heapq.heappush(heap, (doc.get('submittedAt'), doc.id, i, doc))
+
+    await asyncio.gather(*(push(i) for i in range(len(iterators))))
+    while heap:
+        _, _, i, doc = heapq.heappop(heap)
+        yield doc
+        await push(i)
+
+
+async def export_rows(db, queries, page_size):
+    """Từng trang row đã enrich (users/exams join theo trang, loader mới cho mỗi trang -> bộ nhớ hằng)"""
+    page = []
+
+    async def enrich(page):
+        loader = BatchLoader(db)
+        user_map, exam_map = await asyncio.gather(
+            loader.load_many_by('users', 'uid', [d.get('studentId') for _, d in page], ['fullName', 'birthDate', 'department']),
+            load_exam_meta(db, [d.get('examId') for _, d in page]),
+        )
+        rows = []
+        for doc_id, data in page:
+            u_info = user_map.get(data.get('studentId')) or {}
+            e_info = exam_map.get(data.get('examId')) or {}
+            rows.append({
+                "id": doc_id,
+                "examId": data.get('examId'),
+                "examTitle": e_info.get('title') or data.get('examTitle', ''),
+                "studentId": data.get('studentId'),
+                "studentName": data.get('studentName') or u_info.get('fullName', ''),
+                "birthDate": u_info.get('birthDate'),
+                "department": u_info.get('department'),
+                "classId": data.get('classId'),
+                "score": data.get('score'),
+                "totalQuestions": data.get('totalQuestions'),
+                "correctCount": data.get('correctCount'),
+                "submittedAt": str(data.get('submittedAt', '')),
+            })
+        return rows
+
+    async for doc in merge_by_submitted_at(queries, page_size):
+        page.append((doc.id, doc.to_dict()))
+        if len(page) >= page_size:
+            yield await enrich(page)
+            page = []
+    if page:
+        yield await enrich(page)
+
+
+@router.get("/results/export")
+async def export_results(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    semester: Optional[str] = None,
+    class_id: Optional[str] = None,
+    exam_id: Optional[str] = None,
+    teacher_name: Optional[str] = None,
+    page_size: int = Query(500, ge=50, le=1000),
+):
+    """
+    Export exam results (oldest first) as a streamed CSV / NDJSON download.
+    - semester / teacher_name: restrict to classes of that semester / teacher
+    - class_id, exam_id: exact filters
+    Firestore is paged with cursors and rows are enriched page by page, so memory stays
+    bounded by page_size regardless of how many results exist.
+    """
+    db = request.app.state.firebase_db
+    if not db:
+        raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+    # 1. Class scope (None = không giới hạn lớp)
+    class_ids = None
+    if semester or teacher_name:
+        classes_query = db.collection('classes')
+        if semester:
+            classes_query = classes_query.where('semester', '==', semester)
+        if teacher_name:
+            classes_query = classes_query.where('teacher', '==', teacher_name)
+        class_ids = [c.id for c in await classes_query.select([]).get()]
+    if class_id:
+        class_ids = [class_id] if class_ids is None or class_id in class_ids else []
+
+    # 2. Một query cho mỗi 30 lớp ('in' limit), tất cả order_by submittedAt để merge
+    base = db.collection('exam_results')
+    if exam_id:
+        base = base.where('examId', '==', exam_id)
+    if class_ids is None:
+        queries = [base.order_by('submittedAt')]
+    else:
+        queries = [
+            base.where('classId', 'in', class_ids[i:i + 30]).order_by('submittedAt')
+            for i in range(0, len(class_ids), 30)
+        ]
+
+    async def body():
+        try:
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+                # BOM để Excel đọc đúng tiếng Việt
+                yield "\ufeff"
+                writer.writeheader()
+            async for rows in export_rows(db, queries, page_size):
+                if format == "csv":
+                    writer.writerows(rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            if format == "csv":
+                yield buffer.getvalue()
+        except Exception as e:
+            # Header đã gửi -> chỉ có thể log và dừng stream
+            print(f"[ERROR] Results export aborted: {e}")
+            traceback.print_exc()
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"exam_results.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        body(), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/results/by-student/{student_id}")
 async def get_results_by_student(request: Request, student_id: str):
     """Get all exam results for a specific student"""
@@ -318,52 +928,27 @@ async def get_results_by_student(request: Request, student_id: str):
 
         # 1. Fetch Results
         print(f"[DEBUG] Querying exam_results for studentId: {student_id}")
-        results_query = db.collection('exam_results').where('studentId', '==', student_id).get()
+        # 2. Fetch Student Name (doc ID first, fallback 'uid' via identity index) alongside the results query
+        results_query, student = await asyncio.gather(
+            db.collection('exam_results').where('studentId', '==', student_id).get(),
+            identity_index.load_user(db, student_id, ('id', 'uid'), ['fullName']),
+        )
         results = list(results_query)
         print(f"[DEBUG] Found {len(results)} results")
-        
-        # 2. Fetch Student Name
-        student_name = "Học sinh"
-        try:
-            # Use extract_snapshot carefully
-            u_ref = db.collection('users').document(student_id)
-            u_snap = extract_snapshot(u_ref)
-            if u_snap and u_snap.exists:
-                student_name = u_snap.to_dict().get('fullName', student_name)
-            else:
-                # Fallback search by uid
-                u_q = db.collection('users').where('uid', '==', student_id).limit(1).get()
-                docs = list(u_q)
-                if docs:
-                    student_name = docs[0].to_dict().get('fullName', student_name)
-        except Exception as e:
-            print(f"[WARN] Failed to fetch student name: {e}")
 
-        # 3. Fetch Exam Titles
+        student_name = (student[1] if student else {}).get('fullName', "Học sinh")
+
+        # 3. Fetch Exam Titles (one batched get_all through the request loader)
         # Filter cleanly: must have examId and it must be truthy
-        exam_ids_raw = [doc.to_dict().get('examId') for doc in results]
-        exam_ids = list(set([eid for eid in exam_ids_raw if eid]))
-        
-        exam_map = {}
-        if exam_ids:
-            print(f"[DEBUG] Fetching titles for {len(exam_ids)} exams")
-            from google.cloud import firestore
-            for i in range(0, len(exam_ids), 30):
-                batch = exam_ids[i:i+30]
-                try:
-                    # Query by document ID
-                    ex_docs = db.collection('exams').where(firestore.FieldPath.document_id(), 'in', batch).get()
-                    for d in ex_docs:
-                        exam_map[d.id] = d.to_dict()
-                except Exception as ex_err:
-                    print(f"[ERR] Failed fetching exam batch: {ex_err}")
-                    traceback.print_exc()
+        exam_ids = [doc.to_dict().get('examId') for doc in results]
+        print(f"[DEBUG] Fetching titles for {len(set(filter(None, exam_ids)))} exams")
+        exam_map = await load_exam_meta(db, exam_ids)
 
         result_list = []
         for doc in results:
             data = doc.to_dict()
             e_id = data.get('examId')
-            e_info = exam_map.get(e_id, {})
+            e_info = exam_map.get(e_id) or {}
             # Logic Update: Use examId as display title
             e_title = e_id if e_id else (data.get('examTitle') or e_info.get('title', 'Đề thi'))
             
@@ -392,15 +977,120 @@ async def get_results_by_student(request: Request, student_id: str):
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
 
+def score_quantiles(scores):
+    """median / min / max / percentiles của điểm (điểm = số câu đúng)"""
+    scores = sorted(scores)
+    if not scores:
+        return {"median": None, "min": None, "max": None, "percentiles": {}}
+    cuts = statistics.quantiles(scores, n=100, method='inclusive') if len(scores) > 1 else [scores[0]] * 99
+    return {
+        "median": round(statistics.median(scores), 2),
+        "min": scores[0],
+        "max": scores[-1],
+        "percentiles": {f"p{p}": round(cuts[p - 1], 2) for p in (10, 25, 50, 75, 90)},
+    }
+
+
+@router.get("/results/by-exam/{exam_id}")
+async def get_results_by_exam(
+    request: Request,
+    exam_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    start_after: Optional[str] = Query(None, description="Result id of the last item of the previous page"),
+    percentiles: bool = Query(False, description="Also scan every submission's score for median / percentiles"),
+):
+    """
+    Submissions of one exam (newest first, paginated) + aggregates over ALL its submissions.
+    Page query dùng composite index exam_results(examId ASC, submittedAt DESC).
+    Aggregates chỉ có ở trang đầu (các trang sau trả null): count / mean / stddev / histogram
+    (theo tỉ lệ câu đúng) đọc từ exam_stats (1 document); percentiles=true mới quét field
+    score (projection) của mọi bài để tính median / min / max / percentiles.
+    """
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        results_col = db.collection('exam_results')
+        by_exam = results_col.where('examId', '==', exam_id)
+        page_query = by_exam.order_by('submittedAt', direction='DESCENDING')
+
+        async def load_aggregates():
+            # Trang sau không đọc lại aggregate (client tải hết các trang)
+            if start_after is not None:
+                return None
+            stats_ref = db.collection('exam_stats').document(exam_id)
+            if not percentiles:
+                snap = await stats_ref.get()
+                return summarize_exam_stats(exam_id, snap.to_dict() if snap.exists else None)
+
+            snap, score_docs = await asyncio.gather(stats_ref.get(), by_exam.select(['score']).get())
+            scores = []
+            for doc in score_docs:
+                score = (doc.to_dict() or {}).get('score')
+                if isinstance(score, (int, float)):
+                    scores.append(float(score))
+            return {**summarize_exam_stats(exam_id, snap.to_dict() if snap.exists else None),
+                    **score_quantiles(scores)}
+
+        (docs, next_cursor), aggregates = await asyncio.gather(
+            fetch_page(page_query, results_col, limit, start_after, order_field='submittedAt'),
+            load_aggregates(),
+        )
+
+        result_list = []
+        for doc in docs:
+            data = doc.to_dict()
+            result_list.append({
+                "id": doc.id,
+                "examId": data.get('examId'),
+                "examTitle": data.get('examId') or data.get('examTitle', 'Đề thi'),
+                "studentId": data.get('studentId'),
+                "studentName": data.get('studentName', 'Unknown'),
+                "classId": data.get('classId'),
+                "score": data.get('score'),
+                "totalQuestions": data.get('totalQuestions'),
+                "correctCount": data.get('correctCount'),
+                "submittedAt": str(data.get('submittedAt', '')),
+            })
+
+        return {
+            "success": True,
+            "results": result_list,
+            "nextCursor": next_cursor,
+            "aggregates": aggregates,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] 500 in get_results_by_exam: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
+
+
 @router.delete("/results/{result_id}")
 async def delete_result_endpoint(request: Request, result_id: str):
-    """Delete an exam result"""
+    """Delete an exam result (and subtract it from exam_stats in the same transaction)"""
     try:
         db = request.app.state.firebase_db
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
-            
-        db.collection('exam_results').document(result_id).delete()
+
+        result_ref = db.collection('exam_results').document(result_id)
+
+        @firebase_service._firestore_transaction
+        async def run_delete(transaction):
+            snap = await result_ref.get(transaction=transaction)
+            if not snap.exists:
+                return
+            data = snap.to_dict()
+            transaction.delete(result_ref)
+            # Bài nộp trước khi có exam_stats chưa từng được cộng -> không trừ
+            if data.get('statsApplied') and data.get('examId'):
+                stats_ref = db.collection('exam_stats').document(data['examId'])
+                transaction.set(stats_ref, exam_stats_delta([data], sign=-1), merge=True)
+
+        await run_delete(db.transaction())
         return {"success": True, "message": "Result deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,6 +3,8 @@ Settings Router - System settings endpoints
 Handles registration deadlines and other system configurations
 """
 
+import asyncio
+
 from models.schemas import RegistrationSettingsRequest
 from fastapi import APIRouter, HTTPException, Request
 from typing import Optional
@@ -19,9 +21,11 @@ async def get_dashboard_stats(request: Request):
             
         # Count users by role and total classes
         # Note: For large DBs, use aggregation queries. For now, matching existing style.
-        teachers = db.collection('users').where('role', '==', 'teacher').get()
-        students = db.collection('users').where('role', '==', 'student').get()
-        classes = db.collection('classes').get()
+        teachers, students, classes = await asyncio.gather(
+            db.collection('users').where('role', '==', 'teacher').get(),
+            db.collection('users').where('role', '==', 'student').get(),
+            db.collection('classes').get(),
+        )
         
         return {
             "success": True,
@@ -45,7 +49,7 @@ async def get_registration_settings(request: Request, semester: str):
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
         doc_id = f"registration_{semester}"
-        doc = db.collection('settings').document(doc_id).get()
+        doc = await db.collection('settings').document(doc_id).get()
         
         if not doc.exists:
             return {
@@ -80,7 +84,7 @@ async def update_registration_settings(request: Request, reg_data: RegistrationS
             'updatedAt': firebase_service._get_server_timestamp(),
         }
         
-        db.collection('settings').document(doc_id).set(settings_data, merge=True)
+        await db.collection('settings').document(doc_id).set(settings_data, merge=True)
         return {"success": True, "message": "Settings updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -94,7 +98,7 @@ async def get_all_semesters(request: Request):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        settings = db.collection('settings').get()
+        settings = await db.collection('settings').get()
         semesters = []
         for doc in settings:
             if doc.id.startswith('registration_'):
@@ -119,7 +123,7 @@ async def delete_registration_settings(request: Request, semester: str):
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
         doc_id = f"registration_{semester}"
-        db.collection('settings').document(doc_id).delete()
+        await db.collection('settings').document(doc_id).delete()
         return {"success": True, "message": "Settings deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException, Request
 from typing import Optional, List
 from models.schemas import UserCreateRequest, UserUpdateRequest, PasswordUpdateRequest
 from services.firebase_service import firebase_service
+from services.batch_loader import request_loader
+from services.identity_index import INDEXED_KINDS, identity_index
 
 router = APIRouter()
 
@@ -16,12 +18,34 @@ async def get_all_users(request: Request):
         if not db:
              raise HTTPException(status_code=503, detail="Firebase not initialized")
         
-        users = db.collection('users').get()
+        users = await db.collection('users').get()
         return {"success": True, "users": [doc.to_dict() for doc in users]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/identity-index/rebuild")
+async def rebuild_identity_index(request: Request):
+    """Backfill user_identities cho các user tạo trước khi có identity index"""
+    try:
+        db = request.app.state.firebase_db
+        if not db:
+            raise HTTPException(status_code=503, detail="Firebase not initialized")
+
+        result = await identity_index.rebuild(db)
+        return {"success": True, **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/identity-index/stats")
+async def get_identity_index_stats():
+    """Thống kê cache của identity index (process hiện tại)"""
+    return {"success": True, **identity_index.get_stats()}
+
+
 @router.get("/{uid}")
 async def get_user(request: Request, uid: str):
     """Get user by UID or Username (Matched with Dashboard logic)"""
@@ -30,30 +54,24 @@ async def get_user(request: Request, uid: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        # 1. Try UID first
-        doc = db.collection('users').document(uid).get()
-        if doc.exists:
-            return {"success": True, "user": doc.to_dict()}
-            
-        # 2. Try Username fallback
-        query = db.collection('users').where('username', '==', uid.lower().strip()).limit(1).get()
-        user_docs = list(query)
+        # 1. UID lookup and 2. Username fallback through the identity index (one get_all on miss)
+        loader = request_loader(request)
+        found = await identity_index.load_user(db, uid, ('id', 'username'))
+        if found and found[2] == 'id':
+            return {"success": True, "user": found[1]}
         
         user_data = None
-        if user_docs:
-            user_data = user_docs[0].to_dict()
+        if found:
+            user_id, user_data, _kind = found
             if 'uid' not in user_data:
-                user_data['uid'] = user_docs[0].id
-        elif doc.exists:
-            user_data = doc.to_dict()
+                user_data['uid'] = user_id
 
         if user_data:
             # --- JOIN EXTRA INFO FOR STUDENTS ---
             if user_data.get('role') == 'student' and user_data.get('classId'):
                 c_id = user_data['classId']
-                class_doc = db.collection('classes').document(c_id).get()
-                if class_doc.exists:
-                    c_data = class_doc.to_dict()
+                c_data = await loader.load('classes', c_id)
+                if c_data:
                     user_data['className'] = c_data.get('className', c_data.get('name', ''))
                     user_data['teacherName'] = c_data.get('teacherName', c_data.get('teacher', ''))
             
@@ -75,7 +93,7 @@ async def update_user(request: Request, uid: str, user_data: UserUpdateRequest):
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
         doc_ref = db.collection('users').document(uid)
-        if not doc_ref.get().exists:
+        if not (await doc_ref.get()).exists:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Build update data
@@ -88,7 +106,7 @@ async def update_user(request: Request, uid: str, user_data: UserUpdateRequest):
         if user_data.department is not None: update_data['department'] = user_data.department
         
         update_data['updatedAt'] = firebase_service._get_server_timestamp()
-        doc_ref.update(update_data)
+        await doc_ref.update(update_data)
         
         return {"success": True, "message": "User updated successfully"}
     except HTTPException:
@@ -112,7 +130,7 @@ async def get_teachers(request: Request):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        teachers = db.collection('users').where('role', '==', 'teacher').get()
+        teachers = await db.collection('users').where('role', '==', 'teacher').get()
         
         result = []
         for doc in teachers:
@@ -137,7 +155,14 @@ async def delete_user(request: Request, uid: str):
         if not db:
             raise HTTPException(status_code=503, detail="Firebase not initialized")
             
-        db.collection('users').document(uid).delete()
+        # Xóa user cùng các entry identity index trong 1 batch
+        doc_ref = db.collection('users').document(uid)
+        snap = await doc_ref.get(field_paths=list(INDEXED_KINDS))
+        batch = db.batch()
+        if snap.exists:
+            identity_index.unindex_user(db, uid, snap.to_dict(), batch)
+        batch.delete(doc_ref)
+        await batch.commit()
         return {"success": True, "message": "User deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,221 @@
+"""
+AI Providers - Long-lived async clients cho Gemini / Grok / OpenAI
+
+Mỗi provider giữ MỘT client dùng chung (connection pool) cho cả process,
+được mở trong lifespan của main.py và đóng khi shutdown.
+Không có lời gọi đồng bộ nào chạy trên event loop.
+"""
+
+import os
+import json
+import asyncio
+from typing import AsyncIterator, Optional
+
+import httpx
+from google.genai import Client
+from openai import AsyncOpenAI
+
+from services.circuit_breaker import CircuitBreaker
+
+
+# Pool sizing (shared by every provider)
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "100"))
+AI_MAX_KEEPALIVE = int(os.getenv("AI_MAX_KEEPALIVE", "20"))
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=AI_MAX_CONNECTIONS,
+        max_keepalive_connections=AI_MAX_KEEPALIVE,
+    )
+
+
+class AIProvider:
+    """Base provider: 1 long-lived async client, generate(prompt) -> raw text"""
+
+    name = "base"
+    display = "Base"
+
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+        self.client = None
+        # Giới hạn số lời gọi đồng thời tới provider này (AI_<NAME>_MAX_CONCURRENCY)
+        self.max_concurrency = int(os.getenv(f"AI_{self.name.upper()}_MAX_CONCURRENCY", "10"))
+        self.limiter = asyncio.Semaphore(self.max_concurrency)
+        self.breaker = CircuitBreaker(self.name)
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    def open(self):
+        """Tạo client (idempotent). Gọi trong lifespan startup."""
+        if self.client is None and self.is_configured:
+            self.client = self._create_client()
+        return self.client
+
+    def _create_client(self):
+        raise NotImplementedError
+
+    async def aclose(self):
+        """Đóng client / connection pool. Gọi trong lifespan shutdown."""
+        self.client = None
+
+    async def generate(self, prompt: str) -> str:
+        """Gửi prompt, trả về text thô (raise nếu lỗi). Chờ slot nếu provider đang đủ tải."""
+        async with self.limiter:
+            return await self._generate(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming API của provider: yield từng đoạn text (raise nếu lỗi). Giữ slot đến hết stream."""
+        async with self.limiter:
+            async for chunk in self._stream(prompt):
+                yield chunk
+
+    async def _generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield ""
+
+
+class GeminiProvider(AIProvider):
+    name = "gemini"
+    display = "Gemini 2.5 Flash"
+    model = "gemini-2.5-flash"
+
+    def _create_client(self):
+        return Client(api_key=self.api_key)
+
+    async def aclose(self):
+        client, self.client = self.client, None
+        if client is None:
+            return
+        # google-genai >= 1.x exposes aclose() on the async surface
+        aclose = getattr(client.aio, "aclose", None)
+        if aclose:
+            await aclose()
+
+    async def _generate(self, prompt: str) -> str:
+        client = self.open()
+        # client.aio = non-blocking surface of the google-genai SDK
+        response = await client.aio.models.generate_content(
+            model=self.model,
+            contents=prompt
+        )
+        return response.text or ""
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        client = self.open()
+        response = await client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=prompt
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class GrokProvider(AIProvider):
+    name = "grok"
+    display = "Grok 2"
+    model = "grok-2-latest"
+    base_url = "https://api.x.ai/v1"
+
+    def _create_client(self):
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=AI_TIMEOUT,
+            limits=_http_limits(),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            },
+        )
+
+    async def aclose(self):
+        client, self.client = self.client, None
+        if client is not None:
+            await client.aclose()
+
+    async def _generate(self, prompt: str) -> str:
+        client = self.open()
+        response = await client.post(
+            "/chat/completions",
+            json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7
+            }
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data['choices'][0]['message']['content'] or ""
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        client = self.open()
+        async with client.stream(
+            "POST",
+            "/chat/completions",
+            json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7,
+                "stream": True
+            }
+        ) as response:
+            response.raise_for_status()
+            # OpenAI-compatible SSE: "data: {...}" ... "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                choices = json.loads(payload).get('choices') or []
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    yield delta
+
+
+class OpenAIProvider(AIProvider):
+    name = "openai"
+    display = "GPT-4o"
+    model = "gpt-4o"
+
+    def _create_client(self):
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            timeout=AI_TIMEOUT,
+            http_client=httpx.AsyncClient(timeout=AI_TIMEOUT, limits=_http_limits()),
+        )
+
+    async def aclose(self):
+        client, self.client = self.client, None
+        if client is not None:
+            await client.close()
+
+    async def _generate(self, prompt: str) -> str:
+        client = self.open()
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7
+        )
+        if not response.choices:
+            return ""
+        return response.choices[0].message.content or ""
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        client = self.open()
+        stream = await client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
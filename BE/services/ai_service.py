@@ -6,12 +6,21 @@ Logic giống hệt Flutter frontend (syllabus_page.dart)
 """
 
 import os
-import re
+import time
+import asyncio
 import httpx
-from google.genai import Client
-from openai import OpenAI
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from models.schemas import Question
+from services.ai_providers import GeminiProvider, GrokProvider, OpenAIProvider
+from services.circuit_breaker import backoff_delay
+from services.provider_stats import ProviderStats, order_by_expected_cost
+from services.exam_cache import exam_cache, make_cache_key
+from services.exam_parser import IncrementalQuestionParser, parse_ai_response
+from services.long_document import allocate_quotas, estimate_tokens, merge_questions, split_into_chunks
+
+
+# Execution strategies cho fallback chain
+STRATEGIES = ("sequential", "hedged", "race")
 
 
 class AIService:
@@ -22,10 +31,47 @@ class AIService:
         self.grok_key = os.getenv("GROK_API_KEY")
         self.openai_key = os.getenv("OPENAI_API_KEY")
         
-        # Configure Gemini Client
-        self.gemini_client = None
-        if self.gemini_key:
-            self.gemini_client = Client(api_key=self.gemini_key)
+        # Long-lived provider clients (opened in main.py lifespan)
+        self.gemini = GeminiProvider(self.gemini_key)
+        self.grok = GrokProvider(self.grok_key)
+        self.openai = OpenAIProvider(self.openai_key)
+
+        # Rolling telemetry per provider + adaptive fallback order (AI_ADAPTIVE_ORDER=false -> tĩnh)
+        self.stats = {provider.name: ProviderStats(provider.name) for provider in self.providers}
+        self.adaptive_order = os.getenv("AI_ADAPTIVE_ORDER", "true").lower() == "true"
+
+        # Fallback strategy (sequential | hedged | race)
+        self.strategy = os.getenv("AI_STRATEGY", "sequential").lower()
+        self.hedge_delay = float(os.getenv("AI_HEDGE_DELAY", "8"))
+
+        # Số lần thử mỗi provider với lỗi tạm thời (backoff + jitter giữa các lần)
+        self.max_retries = int(os.getenv("AI_MAX_RETRIES", "2"))
+
+        # Số job chạy song song tối đa trong 1 batch
+        self.batch_workers = int(os.getenv("AI_BATCH_WORKERS", "8"))
+
+        # Long-document (map-reduce) mode
+        self.long_doc_threshold = int(os.getenv("LONG_DOC_THRESHOLD_TOKENS", "8000"))
+        self.long_doc_chunk_tokens = int(os.getenv("LONG_DOC_CHUNK_TOKENS", "4000"))
+        self.long_doc_parallelism = int(os.getenv("LONG_DOC_PARALLELISM", "4"))
+
+    @property
+    def providers(self):
+        return [self.gemini, self.grok, self.openai]
+
+    async def startup(self):
+        """Mở connection pool cho tất cả provider đã cấu hình key"""
+        for provider in self.providers:
+            if provider.open() is not None:
+                print(f"[AI] {provider.display} client ready")
+
+    async def shutdown(self):
+        """Đóng connection pool của tất cả provider"""
+        for provider in self.providers:
+            try:
+                await provider.aclose()
+            except Exception as e:
+                print(f"[AI] Failed closing {provider.name} client: {e}")
     
     def _build_prompt(self, text: str, count: int, structure: str) -> str:
         """Tạo prompt giống Flutter frontend"""
@@ -46,117 +92,72 @@ KẾT THÚC CÂU
 """
 
     def _parse_ai_response(self, response: str) -> List[Question]:
-        """Parse AI response thành list Question (giống Flutter)"""
-        questions = []
-        blocks = response.split("KẾT THÚC CÂU")
-        
-        for block in blocks:
-            block = block.strip()
-            if not block:
-                continue
-            
-            q_type = self._get_value_by_label(block, "Loại:")
-            score = self._get_value_by_label(block, "Điểm:")
-            content = self._get_value_by_label(block, "Nội dung:")
-            answer = self._get_value_by_label(block, "Đáp án:")
-            rubric = self._get_value_by_label(block, "Rubric:")
-            
-            # Clean content (remove "Câu 1:" prefix)
-            content = re.sub(r'^(Câu|Câu hỏi)\s*\d+[:.]?\s*', '', content, flags=re.IGNORECASE)
-            
-            # Parse score
-            try:
-                score_float = float(re.search(r'[\d.]+', score).group()) if score else None
-            except:
-                score_float = None
-            
-            questions.append(Question(
-                type=self._clean_text(q_type),
-                content=f"({score} điểm) {self._clean_text(content)}" if score else self._clean_text(content),
-                correct_answer=self._clean_text(answer),
-                rubric=None if rubric == "N/A" else self._clean_text(rubric),
-                score=score_float
-            ))
-        
-        return questions
+        """Parse AI response thành list Question (single-pass, xem services/exam_parser.py)"""
+        return parse_ai_response(response)
 
-    def _get_value_by_label(self, block: str, label: str) -> str:
-        """Extract value từ block text theo label"""
-        if label not in block:
-            return ""
-        
-        start = block.index(label) + len(label)
-        labels = ["Loại:", "Điểm:", "Nội dung:", "Đáp án:", "Rubric:", "KẾT THÚC CÂU"]
-        end = len(block)
-        
-        for l in labels:
-            try:
-                pos = block.index(l, start)
-                if pos < end:
-                    end = pos
-            except ValueError:
-                continue
-        
-        return block[start:end].strip()
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Lỗi tạm thời (quá tải / rate limit / timeout) -> đáng retry; hết quota thì không"""
+        error_str = str(error).lower()
+        if "insufficient_quota" in error_str:
+            return False
+        if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+        return any(code in error_str for code in ("503", "429", "overloaded", "unavailable", "timeout"))
 
-    def _clean_text(self, text: str) -> str:
-        """Remove markdown artifacts"""
-        return text.replace('*', '').replace('_', '').replace('#', '').strip()
+    async def _call_provider(self, provider, prompt: str, max_retries: Optional[int] = None) -> Optional[str]:
+        """
+        Gọi provider qua circuit breaker:
+        - circuit open -> trả None ngay, không tốn round trip
+        - lỗi tạm thời -> retry với exponential backoff + jitter
+        - kết quả cuối cùng được ghi vào breaker (raise lỗi cuối nếu thất bại)
+        """
+        if not provider.is_configured:
+            return None
+        if not provider.breaker.allow():
+            print(f"[AI] {provider.name} circuit open -> skip")
+            return None
 
-    async def generate_with_gemini(self, prompt: str, max_retries: int = 3) -> Tuple[List[Question], bool]:
-        """Gọi Gemini API (New SDK) với retry logic"""
-        if not self.gemini_client:
-            return [], False
-        
-        for attempt in range(max_retries):
-            try:
-                # Dùng gemini-1.5-flash là model chuẩn và stable nhất hiện tại
-                response = self.gemini_client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=prompt
-                )
-                
-                if response.text:
-                    questions = self._parse_ai_response(response.text)
-                    return questions, True
-                    
-            except Exception as e:
-                error_str = str(e)
-                # Nếu 503 hoặc overloaded, retry
-                if '503' in error_str or 'overloaded' in error_str.lower():
-                    if attempt < max_retries - 1:
+        # AI_MAX_RETRIES <= 0 vẫn gọi provider 1 lần (không âm thầm trả None)
+        max_retries = max(1, self.max_retries if max_retries is None else max_retries)
+        try:
+            for attempt in range(max_retries):
+                try:
+                    ai_text = await provider.generate(prompt)
+                except Exception as e:
+                    if self._is_retryable(e) and attempt < max_retries - 1:
+                        await asyncio.sleep(backoff_delay(attempt))
                         continue
+                    provider.breaker.record_failure()
+                    raise
+                if ai_text:
+                    provider.breaker.record_success()
                 else:
-                    print(f"Gemini error: {e}")
-                    break
+                    provider.breaker.record_failure()
+                return ai_text
+        except asyncio.CancelledError:
+            provider.breaker.record_cancelled()
+            raise
+
+    async def generate_with_gemini(self, prompt: str, max_retries: Optional[int] = None) -> Tuple[List[Question], bool]:
+        """Gọi Gemini API (async surface của New SDK) với retry + circuit breaker"""
+        try:
+            ai_text = await self._call_provider(self.gemini, prompt, max_retries)
+            if ai_text:
+                questions = self._parse_ai_response(ai_text)
+                return questions, True
+        except Exception as e:
+            print(f"Gemini error: {e}")
         
         return [], False
 
     async def generate_with_grok(self, prompt: str) -> Tuple[List[Question], bool]:
-        """Gọi Grok API"""
-        if not self.grok_key:
-            return [], False
-        
+        """Gọi Grok API (pooled httpx.AsyncClient) với retry + circuit breaker"""
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    "https://api.x.ai/v1/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.grok_key}"
-                    },
-                    json={
-                        "model": "grok-2-latest",
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.7
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    ai_text = data['choices'][0]['message']['content']
-                    questions = self._parse_ai_response(ai_text)
-                    return questions, True
+            ai_text = await self._call_provider(self.grok, prompt)
+            if ai_text:
+                questions = self._parse_ai_response(ai_text)
+                return questions, True
                     
         except Exception as e:
             print(f"Grok error: {e}")
@@ -164,20 +165,10 @@ KẾT THÚC CÂU
         return [], False
 
     async def generate_with_openai(self, prompt: str) -> Tuple[List[Question], bool]:
-        """Gọi OpenAI API (cứu cánh cuối cùng)"""
-        if not self.openai_key:
-            return [], False
-        
+        """Gọi OpenAI API (cứu cánh cuối cùng, AsyncOpenAI dùng chung) với retry + circuit breaker"""
         try:
-            client = OpenAI(api_key=self.openai_key)
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
-            
-            if response.choices:
-                ai_text = response.choices[0].message.content
+            ai_text = await self._call_provider(self.openai, prompt)
+            if ai_text:
                 questions = self._parse_ai_response(ai_text)
                 return questions, True
                 
@@ -190,30 +181,287 @@ KẾT THÚC CÂU
         
         return [], False
 
-    async def generate_exam(self, text: str, count: int, structure: str) -> Tuple[List[Question], str]:
+    def provider_order(self) -> List[str]:
+        """Thứ tự fallback hiện tại: tĩnh (Gemini → Grok → OpenAI) hoặc theo telemetry"""
+        names = [provider.name for provider in self.providers]
+        if not self.adaptive_order:
+            return names
+        return order_by_expected_cost(names, self.stats)
+
+    def _fallback_chain(self):
+        """(provider, generate_fn) theo thứ tự ưu tiên hiện tại"""
+        generate_fns = {
+            "gemini": (self.gemini, self.generate_with_gemini),
+            "grok": (self.grok, self.generate_with_grok),
+            "openai": (self.openai, self.generate_with_openai),
+        }
+        return [generate_fns[name] for name in self.provider_order()]
+
+    async def _attempt(self, provider, generate_fn, prompt: str, count: int) -> Tuple[List[Question], bool]:
+        """Gọi 1 provider và ghi telemetry (latency, số câu parse được / yêu cầu, lý do fallback)"""
+        if not provider.is_configured:
+            return [], False
+        stats = self.stats[provider.name]
+        if provider.breaker.is_open():
+            stats.record_fallback("circuit_open")
+            return [], False
+
+        started = time.perf_counter()
+        # CancelledError (thua hedged race) không được ghi nhận
+        questions, success = await generate_fn(prompt)
+        elapsed = time.perf_counter() - started
+
+        ok = bool(success and questions)
+        stats.record_call(elapsed, ok, len(questions), count)
+        if not ok:
+            stats.record_fallback("parse_failed" if success else "error")
+        return questions, success
+
+    async def _run_chain(self, prompt: str, hedge_delay: Optional[float], count: int = 0) -> Tuple[List[Question], str]:
+        """
+        Chạy fallback chain, khởi động provider kế tiếp khi:
+        - provider đang chạy thất bại, hoặc
+        - sau hedge_delay giây vẫn chưa có kết quả (None = không bao giờ hedge).
+        Đề đầu tiên parse thành công sẽ thắng, các lời gọi còn lại bị cancel.
+        """
+        queue = self._fallback_chain()
+        priority = {provider.name: i for i, (provider, _) in enumerate(queue)}
+        pending = {}
+
+        def launch_next():
+            provider, fn = queue.pop(0)
+            pending[asyncio.create_task(self._attempt(provider, fn, prompt, count))] = provider.name
+
+        try:
+            launch_next()
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=hedge_delay if queue else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # Hedge: provider hiện tại chậm -> khởi động provider kế tiếp song song
+                    launch_next()
+                    continue
+
+                for task in sorted(done, key=lambda t: priority[pending[t]]):
+                    name = pending.pop(task)
+                    try:
+                        questions, success = task.result()
+                    except Exception as e:
+                        print(f"[AI] {name} crashed: {e}")
+                        questions, success = [], False
+                    if success and questions:
+                        return questions, name
+                    if queue:
+                        launch_next()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return [], "none"
+
+    async def generate_exam(self, text: str, count: int, structure: str, strategy: Optional[str] = None,
+                            force_refresh: bool = False) -> Tuple[List[Question], str]:
         """
         Main function - Generate exam với multi-fallback
+        strategy: sequential (mặc định) | hedged (AI_HEDGE_DELAY giây) | race
+        force_refresh: bỏ qua exam cache và gọi AI lại
         Returns: (questions, model_used)
         """
+        strategy = (strategy or self.strategy).lower()
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown AI strategy '{strategy}' (expected one of {', '.join(STRATEGIES)})")
+
+        cache_key = make_cache_key(text, count, structure)
+        if not force_refresh:
+            cached = await exam_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         prompt = self._build_prompt(text, count, structure)
-        
-        # 1. Try Gemini first
-        questions, success = await self.generate_with_gemini(prompt)
-        if success and questions:
-            return questions, "gemini"
-        
-        # 2. Fallback to Grok
-        questions, success = await self.generate_with_grok(prompt)
-        if success and questions:
-            return questions, "grok"
-        
-        # 3. Final fallback to OpenAI
-        questions, success = await self.generate_with_openai(prompt)
-        if success and questions:
-            return questions, "openai"
-        
-        # All failed
-        return [], "none"
+        if strategy == "race":
+            questions, model_used = await self._run_chain(prompt, hedge_delay=0, count=count)
+        elif strategy == "hedged":
+            questions, model_used = await self._run_chain(prompt, hedge_delay=self.hedge_delay, count=count)
+        else:
+            # sequential: theo provider_order(), chỉ chuyển khi provider trước thất bại
+            questions, model_used = await self._run_chain(prompt, hedge_delay=None, count=count)
+
+        if questions:
+            await exam_cache.set(cache_key, questions, model_used)
+        return questions, model_used
+
+    def is_long_document(self, text: str) -> bool:
+        """Tài liệu vượt ngưỡng LONG_DOC_THRESHOLD_TOKENS -> nên dùng map-reduce"""
+        return estimate_tokens(text) > self.long_doc_threshold
+
+    async def generate_exam_long(self, text: str, count: int, structure: str, strategy: Optional[str] = None,
+                                 force_refresh: bool = False, chunk_tokens: Optional[int] = None,
+                                 parallelism: Optional[int] = None) -> Tuple[List[Question], str, dict]:
+        """
+        Long-document mode (map-reduce):
+        1. split: chia text thành chunk <= chunk_tokens
+        2. map: mỗi chunk tạo số câu theo quota, chạy song song (tối đa parallelism)
+        3. reduce: gộp, bỏ trùng, cân lại tổng điểm 10.0
+        Returns: (questions, model_used, stages) - stages chứa latency từng bước
+        """
+        chunk_tokens = chunk_tokens or self.long_doc_chunk_tokens
+        workers = asyncio.Semaphore(parallelism or self.long_doc_parallelism)
+
+        started = time.perf_counter()
+        chunks = split_into_chunks(text, chunk_tokens)
+        quotas = allocate_quotas(chunks, count)
+        split_elapsed = time.perf_counter() - started
+
+        async def map_chunk(chunk: str, quota: int):
+            if quota <= 0:
+                return [], "none", 0.0
+            async with workers:
+                chunk_started = time.perf_counter()
+                questions, model_used = await self.generate_exam(
+                    chunk, quota, structure, strategy=strategy, force_refresh=force_refresh
+                )
+                return questions, model_used, time.perf_counter() - chunk_started
+
+        started = time.perf_counter()
+        mapped = await asyncio.gather(*(map_chunk(c, q) for c, q in zip(chunks, quotas)))
+        map_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        questions = merge_questions([m[0] for m in mapped], quotas)
+        reduce_elapsed = time.perf_counter() - started
+
+        models = []
+        for _, model_used, _ in mapped:
+            if model_used != "none" and model_used not in models:
+                models.append(model_used)
+
+        stages = {
+            "split": round(split_elapsed, 4),
+            "map": round(map_elapsed, 4),
+            "reduce": round(reduce_elapsed, 4),
+            "chunks": [
+                {
+                    "index": i,
+                    "tokens": estimate_tokens(chunk),
+                    "quota": quota,
+                    "questions": len(result[0]),
+                    "model_used": result[1],
+                    "elapsed": round(result[2], 3),
+                }
+                for i, (chunk, quota, result) in enumerate(zip(chunks, quotas, mapped))
+            ],
+        }
+        return questions, "+".join(models) or "none", stages
+
+    async def stream_exam(self, text: str, count: int, structure: str, force_refresh: bool = False):
+        """
+        Streaming variant của generate_exam (dùng streaming API của từng provider).
+        Yield các event dict:
+        - {"event": "question", "index", "question", "model_used"} ngay khi 1 câu hoàn chỉnh
+        - {"event": "done", "model_used", "total_questions"} khi xong
+        - {"event": "error", "detail"} nếu tất cả provider thất bại
+        Provider chỉ được fallback khi chưa phát ra câu nào.
+        """
+        cache_key = make_cache_key(text, count, structure)
+        if not force_refresh:
+            cached = await exam_cache.get(cache_key)
+            if cached is not None:
+                questions, model_used = cached
+                for index, question in enumerate(questions):
+                    yield {"event": "question", "index": index, "question": question.model_dump(), "model_used": model_used}
+                yield {"event": "done", "model_used": model_used, "total_questions": len(questions), "cached": True}
+                return
+
+        prompt = self._build_prompt(text, count, structure)
+        providers = {provider.name: provider for provider in self.providers}
+        for name in self.provider_order():
+            provider, stats = providers[name], self.stats[name]
+            if not provider.is_configured:
+                continue
+            if not provider.breaker.allow():
+                print(f"[AI] {provider.name} circuit open -> skip")
+                stats.record_fallback("circuit_open")
+                continue
+
+            parser = IncrementalQuestionParser()
+            questions = []
+            started = time.perf_counter()
+            first_chunk = True
+            try:
+                async for chunk in provider.stream(prompt):
+                    if first_chunk:
+                        stats.record_ttft(time.perf_counter() - started)
+                        first_chunk = False
+                    for question in parser.feed(chunk):
+                        yield {"event": "question", "index": len(questions), "question": question.model_dump(), "model_used": provider.name}
+                        questions.append(question)
+                for question in parser.close():
+                    yield {"event": "question", "index": len(questions), "question": question.model_dump(), "model_used": provider.name}
+                    questions.append(question)
+            except asyncio.CancelledError:
+                provider.breaker.record_cancelled()
+                raise
+            except Exception as e:
+                print(f"{provider.display} stream error: {e}")
+                provider.breaker.record_failure()
+                stats.record_call(time.perf_counter() - started, False, len(questions), count)
+                stats.record_fallback("stream_error")
+                if questions:
+                    # Đã gửi câu hỏi cho client -> không thể đổi provider giữa chừng
+                    yield {"event": "error", "detail": f"{provider.name} bị ngắt sau {len(questions)} câu: {e}"}
+                    return
+                continue
+
+            provider.breaker.record_success()
+            stats.record_call(time.perf_counter() - started, bool(questions), len(questions), count)
+            if not questions:
+                stats.record_fallback("parse_failed")
+            if questions:
+                await exam_cache.set(cache_key, questions, provider.name)
+                yield {"event": "done", "model_used": provider.name, "total_questions": len(questions)}
+                return
+
+        yield {"event": "error", "detail": "Tất cả AI đều không thể tạo đề. Vui lòng thử lại."}
+
+    async def generate_exam_batch(self, jobs: List[dict], max_workers: Optional[int] = None):
+        """
+        Chạy nhiều job generate_exam với worker pool giới hạn (mỗi provider còn có cap riêng).
+        jobs: list kwargs cho generate_exam (text, count, structure, strategy, force_refresh)
+        Yield kết quả từng job ngay khi job đó xong (không theo thứ tự gửi lên).
+        """
+        workers = asyncio.Semaphore(max_workers or self.batch_workers)
+
+        async def run(index: int, job: dict) -> dict:
+            async with workers:
+                started = time.perf_counter()
+                try:
+                    questions, model_used = await self.generate_exam(**job)
+                    status = "success" if questions else "failed"
+                    detail = None if questions else "Tất cả AI đều không thể tạo đề."
+                except Exception as e:
+                    questions, model_used, status, detail = [], "none", "failed", str(e)
+                return {
+                    "event": "job",
+                    "index": index,
+                    "status": status,
+                    "model_used": model_used,
+                    "total_questions": len(questions),
+                    "questions": [q.model_dump() for q in questions],
+                    "elapsed": round(time.perf_counter() - started, 3),
+                    "detail": detail,
+                }
+
+        tasks = [asyncio.create_task(run(i, job)) for i, job in enumerate(jobs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client ngắt kết nối -> hủy các job còn lại
+            for task in tasks:
+                task.cancel()
 
 
 # Singleton instance
@@ -0,0 +1,123 @@
+"""
+Batch Loader - DataLoader cho các phép join users / exams / classes trong 1 request
+
+- load(collection, doc_id): gom mọi key được yêu cầu trong cùng 1 vòng event loop,
+  bỏ trùng, rồi lấy tất cả bằng MỘT lời gọi db.get_all
+- load_by(collection, field, value): như trên nhưng tra theo field
+  (where field in [...], các batch 30 giá trị chạy song song)
+- Kết quả được memoize theo request: key đã load không bị đọc lại
+"""
+
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+# Firestore giới hạn 30 giá trị cho toán tử 'in'
+IN_QUERY_LIMIT = 30
+
+
+class BatchLoader:
+    """Loader gắn với 1 request (tạo qua request_loader)"""
+
+    def __init__(self, db):
+        self.db = db
+        self._cache: Dict[tuple, asyncio.Future] = {}
+        # (collection, field, fields) -> {value: future} chờ dispatch
+        self._queue: Dict[tuple, Dict[Any, asyncio.Future]] = {}
+        self._scheduled = False
+        self._tasks = set()
+
+    def load(self, collection: str, doc_id: str, fields: Optional[Iterable[str]] = None) -> asyncio.Future:
+        """Future -> dict dữ liệu của document (None nếu không tồn tại)"""
+        return self._enqueue(collection, None, doc_id, fields)
+
+    def load_by(self, collection: str, field: str, value: Any,
+                fields: Optional[Iterable[str]] = None) -> asyncio.Future:
+        """Future -> document đầu tiên có field == value, None nếu không có"""
+        return self._enqueue(collection, field, value, fields)
+
+    async def load_many(self, collection: str, doc_ids: Iterable[str],
+                        fields: Optional[Iterable[str]] = None) -> Dict[str, Optional[dict]]:
+        doc_ids = [i for i in dict.fromkeys(doc_ids) if i]
+        values = await asyncio.gather(*(self.load(collection, i, fields) for i in doc_ids))
+        return dict(zip(doc_ids, values))
+
+    async def load_many_by(self, collection: str, field: str, values: Iterable[Any],
+                           fields: Optional[Iterable[str]] = None) -> Dict[Any, Optional[dict]]:
+        values = [v for v in dict.fromkeys(values) if v]
+        docs = await asyncio.gather(*(self.load_by(collection, field, v, fields) for v in values))
+        return dict(zip(values, docs))
+
+    def _enqueue(self, collection, field, value, fields) -> asyncio.Future:
+        fields = tuple(sorted(fields)) if fields is not None else None
+        group = (collection, field, fields)
+        key = group + (value,)
+        if key in self._cache:
+            return self._cache[key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[key] = future
+        self._queue.setdefault(group, {})[value] = future
+        if not self._scheduled:
+            self._scheduled = True
+            # Trễ 2 vòng event loop: các task vừa được tạo (vd: trong asyncio.gather)
+            # kịp chạy tới lời gọi load() của chúng trước khi dispatch
+            loop.call_soon(loop.call_soon, self._dispatch)
+        return future
+
+    def _dispatch(self):
+        queue, self._queue = self._queue, {}
+        self._scheduled = False
+        for (collection, field, fields), pending in queue.items():
+            fetch = self._fetch_by_id if field is None else self._fetch_by_field
+            task = asyncio.ensure_future(self._resolve(fetch(collection, field, list(pending), fields), pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _resolve(fetch, pending: Dict[Any, asyncio.Future]):
+        try:
+            found = await fetch
+        except Exception as e:
+            print(f"[WARN] Batch load failed: {e}")
+            found = {}
+        for value, future in pending.items():
+            if not future.done():
+                future.set_result(found.get(value))
+
+    async def _fetch_by_id(self, collection, _field, doc_ids: List[str], fields) -> Dict[str, dict]:
+        col = self.db.collection(collection)
+        refs = [col.document(doc_id) for doc_id in doc_ids]
+        found = {}
+        async for snap in self.db.get_all(refs, field_paths=list(fields) if fields is not None else None):
+            if snap.exists:
+                found[snap.id] = snap.to_dict()
+        return found
+
+    async def _fetch_by_field(self, collection, field, values: List[Any], fields) -> Dict[Any, dict]:
+        col = self.db.collection(collection)
+        batches = [values[i:i + IN_QUERY_LIMIT] for i in range(0, len(values), IN_QUERY_LIMIT)]
+
+        def make_query(batch):
+            query = col.where(field, 'in', batch)
+            return query.select(list(fields) + [field]) if fields is not None else query
+
+        responses = await asyncio.gather(*(make_query(b).get() for b in batches), return_exceptions=True)
+        found = {}
+        for res in responses:
+            if isinstance(res, Exception):
+                print(f"[WARN] Failed fetching {collection}.{field} batch: {res}")
+                continue
+            for doc in res:
+                data = doc.to_dict()
+                found.setdefault(data.get(field), data)
+        return found
+
+
+def request_loader(request) -> BatchLoader:
+    """BatchLoader dùng chung cho cả request (memo sống đến hết request)"""
+    loader = getattr(request.state, 'batch_loader', None)
+    if loader is None:
+        loader = BatchLoader(request.app.state.firebase_db)
+        request.state.batch_loader = loader
+    return loader
@@ -0,0 +1,116 @@
+"""
+Circuit Breaker - Ngắt provider AI đang lỗi thay vì trả giá timeout cho mỗi request
+
+closed    -> cho qua, ghi nhận kết quả trong rolling window (theo thời gian)
+open      -> error rate vượt ngưỡng: bỏ qua provider ngay lập tức trong open_seconds
+half_open -> hết open_seconds: cho đúng 1 request thăm dò; thành công -> closed, lỗi -> open
+"""
+
+import os
+import random
+import time
+from collections import deque
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Breaker cho 1 provider, error rate tính trên rolling window window_seconds"""
+
+    def __init__(self, name: str, window_seconds: float = None, min_calls: int = None,
+                 error_rate: float = None, open_seconds: float = None):
+        self.name = name
+        self.window_seconds = window_seconds or float(os.getenv("AI_BREAKER_WINDOW", "60"))
+        self.min_calls = min_calls or int(os.getenv("AI_BREAKER_MIN_CALLS", "5"))
+        self.error_rate = error_rate or float(os.getenv("AI_BREAKER_ERROR_RATE", "0.5"))
+        self.open_seconds = open_seconds or float(os.getenv("AI_BREAKER_OPEN_SECONDS", "30"))
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._outcomes = deque()  # (timestamp, ok)
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._probe_in_flight = False
+        print(f"[BREAKER] {self.name} OPEN for {self.open_seconds}s")
+
+    def is_open(self) -> bool:
+        """True nếu lúc này allow() sẽ từ chối (không đổi state)"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at < self.open_seconds
+        return self.state == HALF_OPEN and self._probe_in_flight
+
+    def allow(self) -> bool:
+        """True nếu được phép gọi provider lúc này"""
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < self.open_seconds:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            print(f"[BREAKER] {self.name} CLOSED (probe succeeded)")
+            self.state = CLOSED
+            self._outcomes.clear()
+            self._failures = 0
+            self._probe_in_flight = False
+        self._outcomes.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+        self._outcomes.append((now, False))
+        self._failures += 1
+        self._trim(now)
+        total = len(self._outcomes)
+        if self.state == CLOSED and total >= self.min_calls and self._failures / total >= self.error_rate:
+            self._open(now)
+
+    def record_cancelled(self):
+        """Lời gọi bị hủy (vd: thua trong hedged race) -> không tính kết quả, trả lại slot thăm dò"""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        self._trim(now)
+        total = len(self._outcomes)
+        return {
+            "state": self.state,
+            "calls": total,
+            "failures": self._failures,
+            "error_rate": round(self._failures / total, 4) if total else 0.0,
+            "window_seconds": self.window_seconds,
+            "times_opened": self.times_opened,
+            "retry_in": round(max(0.0, self.open_seconds - (now - self.opened_at)), 1) if self.state == OPEN else 0.0,
+        }
+
+
+def backoff_delay(attempt: int, base: float = None, cap: float = None) -> float:
+    """Exponential backoff với full jitter: random(0, min(cap, base * 2^attempt))"""
+    base = base if base is not None else float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+    cap = cap if cap is not None else float(os.getenv("AI_RETRY_MAX_DELAY", "8"))
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,118 @@
+"""
+Class Registration - Logic đăng ký / hủy đăng ký lớp dùng chung cho
+endpoint trực tiếp (1 transaction / request) và hàng đợi surge (group commit)
+
+- RegistrationError mang status_code: lỗi nghiệp vụ (trùng lịch, hết chỗ, sai học kỳ,
+  không tìm thấy) không còn bị trộn với lỗi hệ thống thành HTTP 400 chung
+- plan_registration là hàm thuần: nhận trạng thái hiện tại, trả trạng thái mới,
+  nên group commit có thể áp liên tiếp nhiều yêu cầu lên cùng 1 lớp trong bộ nhớ;
+  số chỗ do services/slot_counter giữ (currentSlots hoặc các shard)
+"""
+
+from typing import Any, Dict, List, Optional
+
+from services.class_schedule import schedule_conflict, schedule_of
+from services.identity_index import identity_index
+
+# Field của lớp cần cho kiểm tra trùng lịch (projection khi đọc các lớp đã đăng ký)
+SCHEDULE_FIELDS = ['name', 'semester', 'schedule', 'dayOfWeek', 'periods', 'dateRange', 'scheduleCompiled']
+
+
+class RegistrationError(Exception):
+    """Lỗi nghiệp vụ khi đăng ký lớp (message hiển thị thẳng cho người dùng)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def resolve_user_ref(db, user_id: str):
+    """Doc ID -> field 'uid' -> field 'username' qua identity index (cache: 0 lần đọc)"""
+    uid_input = str(user_id).strip()
+    resolved = await identity_index.resolve(db, uid_input, ('id', 'uid', 'username'))
+    if resolved is None:
+        raise RegistrationError(f"[ERROR] Không tìm thấy học sinh với ID/UID hoặc Username: '{uid_input}'", 404)
+    if resolved != uid_input:
+        print(f"[AUTH] Resolved identity '{uid_input}' to document: users/{resolved}")
+    return db.collection('users').document(resolved)
+
+
+def registered_ids_of(user_data: Dict[str, Any]) -> List[str]:
+    """registeredClassIds (bản sao), fallback schema cũ chỉ có classId"""
+    registered_ids = user_data.get('registeredClassIds')
+    if isinstance(registered_ids, list):
+        return list(registered_ids)
+    old_class_id = user_data.get('classId')
+    return [old_class_id] if old_class_id else []
+
+
+def existing_class_ids(registered_ids: List[str], class_id: str) -> List[str]:
+    """Các lớp đã đăng ký cần đọc để kiểm tra trùng lịch (bỏ trùng, bỏ lớp đang xét)"""
+    return [i for i in dict.fromkeys(str(r).strip() for r in registered_ids) if i and i != class_id]
+
+
+async def read_classes(db, class_ids: List[str], transaction=None) -> Dict[str, Dict[str, Any]]:
+    """Các lớp (chỉ field lịch học) bằng 1 lời gọi get_all"""
+    if not class_ids:
+        return {}
+    col = db.collection('classes')
+    found = {}
+    async for snap in db.get_all([col.document(i) for i in class_ids],
+                                 field_paths=SCHEDULE_FIELDS, transaction=transaction):
+        if snap.exists:
+            found[snap.id] = snap.to_dict() or {}
+    return found
+
+
+def plan_registration(class_id: str, semester: str, is_register: bool, class_data: Dict[str, Any],
+                      registered_ids: List[str], existing: Dict[str, Dict[str, Any]]) -> Optional[List[str]]:
+    """
+    registered_ids mới hoặc None nếu không có gì thay đổi (chưa tính số chỗ -> xem slot_counter).
+    existing = dữ liệu lịch các lớp đã đăng ký; raise RegistrationError khi bị từ chối.
+    """
+    if class_data.get('semester') != semester:
+        raise RegistrationError(f"[VALIDATION] Lớp học '{class_data.get('name')}' không thuộc học kỳ {semester}")
+
+    if not is_register:
+        if class_id not in registered_ids:
+            return None
+        return [i for i in registered_ids if i != class_id]
+
+    if class_id in registered_ids:
+        return None
+
+    # --- CONFLICT CHECK (precompiled day×period bitmask + date ordinals) ---
+    new_schedule = schedule_of(class_data)
+    for existing_id in existing_class_ids(registered_ids, class_id):
+        ex_data = existing.get(existing_id)
+        if ex_data is None: continue
+
+        # Accuracy: Only check conflicts within the SAME semester
+        if ex_data.get('semester') != semester: continue
+
+        conflict = schedule_conflict(new_schedule, schedule_of(ex_data))
+        if conflict:
+            overlap_days, overlap_periods = conflict
+            day_names = [f"Thứ {d}" if d < 8 else "Chủ Nhật" for d in overlap_days]
+            raise RegistrationError(
+                f"[CONFLICT] Trùng lịch với môn '{ex_data.get('name', existing_id)}'\n"
+                f"● Thời gian: {', '.join(day_names)}, Tiết {overlap_periods}\n"
+                f"● Đợt học: {ex_data.get('dateRange', 'Liên tục')}",
+                409,
+            )
+
+    return registered_ids + [class_id]
+
+
+async def apply_slot(db, slots, is_register: bool, transaction=None):
+    """Giữ / trả 1 chỗ trên FieldSlots / ShardedSlots; hết chỗ -> RegistrationError"""
+    if not is_register:
+        await slots.release(db, transaction)
+    elif not await slots.reserve(db, transaction):
+        raise RegistrationError("[VALIDATION] Lớp học đã đủ số lượng sinh viên (Hết chỗ)", 409)
+
+
+def user_update(class_id: str, semester: str, is_register: bool, registered_ids: List[str]) -> Dict[str, Any]:
+    if is_register:
+        return {'registeredClassIds': registered_ids, 'classId': class_id, 'currentSemester': semester}
+    return {'registeredClassIds': registered_ids}
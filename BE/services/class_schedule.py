@@ -0,0 +1,132 @@
+"""
+Class Schedule - Chuẩn hóa lịch học của lớp để kiểm tra trùng lịch bằng phép bit
+
+Lịch dạng text ("2-4-6 | Tiết 1-3 | P.101 | 01/09/2025 - 15/12/2025") được parse
+MỘT lần lúc lưu lớp thành:
+    mask  : bitmask thứ × tiết (bit = (thứ - 2) * PERIODS_PER_DAY + tiết), lưu dạng hex
+    start : date ordinal ngày bắt đầu (None = không giới hạn)
+    end   : date ordinal ngày kết thúc
+Hai lớp trùng lịch <=> (mask_a & mask_b) != 0 và 2 khoảng ngày giao nhau.
+"""
+
+import re
+from datetime import datetime
+
+# Thứ 2..8 (8 = Chủ Nhật), tiết 0..31
+PERIODS_PER_DAY = 32
+SCHEDULE_VERSION = 1
+
+
+def parse_periods(p_str):
+    """Bulletproof: extracts all numbers/ranges from strings like 'Tiết 1-3, 5'"""
+    if not p_str: return set()
+    res = set()
+    try:
+        # Normalize: remove "Tiết", " ", etc
+        clean = str(p_str).upper().replace('TIẾT', '').strip()
+        # Handle commas and ranges
+        segments = [s.strip() for s in clean.replace(',', ' ').split()]
+        for seg in segments:
+            if '-' in seg:
+                parts = re.findall(r'\d+', seg)
+                if len(parts) >= 2:
+                    res.update(range(int(parts[0]), int(parts[-1]) + 1))
+            else:
+                nums = re.findall(r'\d+', seg)
+                for n in nums: res.add(int(n))
+    except: pass
+    return res
+
+def parse_days(d_str):
+    """Bulletproof: extracts days from '2-4-6', 'Thứ 2,4', etc"""
+    if not d_str: return set()
+    res = set()
+    try:
+        clean = str(d_str).lower().replace('thứ', '').strip()
+        # Special case: Sunday
+        if 'nhật' in clean or 'cn' in clean: res.add(8)
+        # Extract all digits
+        nums = re.findall(r'\d+', clean)
+        for n in nums:
+            val = int(n)
+            if 2 <= val <= 8: res.add(val)
+    except: pass
+    return res
+
+def parse_dates(dr_str):
+    if not dr_str: return None, None
+    try:
+        # Extract anything that looks like a date dd/mm/yyyy
+        dates = re.findall(r'\d{1,2}/\d{1,2}/\d{4}', str(dr_str))
+        if len(dates) >= 2:
+            d1 = datetime.strptime(dates[0], "%d/%m/%Y").date()
+            d2 = datetime.strptime(dates[1], "%d/%m/%Y").date()
+            return min(d1, d2), max(d1, d2)
+    except: pass
+    return None, None
+
+def get_class_schedule_info(data):
+    """Extracts components with robust fallback to 'schedule' string"""
+    days = data.get('dayOfWeek')
+    periods = data.get('periods')
+    dates = data.get('dateRange')
+    
+    # Fallback to schedule string parsing if fields missing
+    sched = data.get('schedule', '')
+    if sched and '|' in sched:
+        parts = [p.strip() for p in sched.split('|')]
+        # Format: Days | Periods | Room | DateRange
+        if not days and len(parts) >= 1: days = parts[0]
+        if not periods and len(parts) >= 2: periods = parts[1]
+        if not dates:
+            if len(parts) >= 4: dates = parts[3]
+            elif len(parts) == 3: dates = parts[2]
+            
+    return days, periods, dates
+
+
+def compile_schedule(data):
+    """class doc -> {'mask': hex, 'start': ordinal|None, 'end': ordinal|None, 'v': SCHEDULE_VERSION}"""
+    d_str, p_str, r_str = get_class_schedule_info(data or {})
+    mask = 0
+    periods = [p for p in parse_periods(p_str) if 0 <= p < PERIODS_PER_DAY]
+    for day in parse_days(d_str):
+        for period in periods:
+            mask |= 1 << ((day - 2) * PERIODS_PER_DAY + period)
+    start, end = parse_dates(r_str)
+    return {
+        'mask': format(mask, 'x'),
+        'start': start.toordinal() if start else None,
+        'end': end.toordinal() if end else None,
+        'v': SCHEDULE_VERSION,
+    }
+
+
+def schedule_of(data):
+    """Lịch đã compile trên class doc; doc chưa backfill / khác version thì compile tại chỗ"""
+    compiled = (data or {}).get('scheduleCompiled')
+    if not isinstance(compiled, dict) or compiled.get('v') != SCHEDULE_VERSION:
+        compiled = compile_schedule(data)
+    return compiled
+
+
+def schedule_conflict(a, b):
+    """Phần trùng (thứ -> tiết) của 2 lịch đã compile, None nếu không trùng"""
+    overlap = int(a.get('mask') or '0', 16) & int(b.get('mask') or '0', 16)
+    if not overlap:
+        return None
+    # Thiếu khoảng ngày ở 1 trong 2 lớp -> coi như giao nhau (giống logic cũ)
+    if a.get('start') is not None and b.get('start') is not None:
+        if max(a['start'], b['start']) > min(a['end'], b['end']):
+            return None
+
+    days, periods = set(), set()
+    bit = 0
+    while overlap:
+        if overlap & 1:
+            day, period = divmod(bit, PERIODS_PER_DAY)
+            days.add(day + 2)
+            periods.add(period)
+        overlap >>= 1
+        bit += 1
+    return sorted(days), sorted(periods)
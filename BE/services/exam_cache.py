@@ -0,0 +1,160 @@
+"""
+Exam Cache - Content-addressed cache cho đề thi do AI tạo
+
+Key = sha256(text đã chuẩn hóa, count, structure[, provider nếu caller chỉ định])
+(strategy sequential / hedged / race không nằm trong key: nó không quyết định nội dung đề)
+- Tier 1: LRU trong bộ nhớ (giới hạn số entry + TTL)
+- Tier 2 (tùy chọn): file JSON trên đĩa, sống sót qua restart (EXAM_CACHE_DIR)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from models.schemas import Question
+
+
+def normalize_text(text: str) -> str:
+    """NFC + gộp khoảng trắng, để cùng 1 tài liệu luôn ra cùng 1 key"""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(text: str, count: int, structure: str, provider: Optional[str] = None) -> str:
+    parts = [normalize_text(text), int(count), normalize_text(structure)]
+    if provider:
+        parts.append(provider)
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExamCache:
+    """LRU (size + TTL) trước, disk tier sau"""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, List[Question], str]]" = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl_seconds <= 0 or (time.time() - created_at) < self.ttl_seconds
+
+    def _remember(self, key: str, created_at: float, questions: List[Question], model_used: str):
+        self._entries[key] = (created_at, questions, model_used)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # ---- disk tier ----
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str):
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["createdAt"], [Question(**q) for q in data["questions"]], data["model_used"]
+        except Exception as e:
+            print(f"[CACHE] Corrupted disk entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, created_at: float, questions: List[Question], model_used: str):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "createdAt": created_at,
+                "model_used": model_used,
+                "questions": [q.model_dump() for q in questions],
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remove_disk(self, key: str):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    # ---- public API ----
+    async def get(self, key: str) -> Optional[Tuple[List[Question], str]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._is_fresh(entry[0]):
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1], entry[2]
+            del self._entries[key]
+            self.stats["expired"] += 1
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                if self._is_fresh(entry[0]):
+                    self._remember(key, *entry)
+                    self.stats["disk_hits"] += 1
+                    return entry[1], entry[2]
+                self.stats["expired"] += 1
+                await asyncio.to_thread(self._remove_disk, key)
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, questions: List[Question], model_used: str):
+        created_at = time.time()
+        self._remember(key, created_at, questions, model_used)
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, created_at, questions, model_used)
+            except Exception as e:
+                print(f"[CACHE] Failed writing disk entry {key}: {e}")
+
+    def _clear_disk(self) -> int:
+        removed = 0
+        for name in os.listdir(self.disk_dir):
+            if name.endswith((".json", ".json.tmp")):
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    async def clear(self) -> int:
+        """Xóa cả 2 tier (không thì entry trên đĩa quay lại ở lần get sau); trả về số file đã xóa"""
+        self._entries.clear()
+        if not self.disk_dir:
+            return 0
+        return await asyncio.to_thread(self._clear_disk)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_enabled": bool(self.disk_dir),
+            "hit_rate": round((self.stats["hits"] + self.stats["disk_hits"]) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Singleton instance
+exam_cache = ExamCache(
+    max_entries=int(os.getenv("EXAM_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("EXAM_CACHE_TTL", "86400")),
+    disk_dir=os.getenv("EXAM_CACHE_DIR") or None,
+)
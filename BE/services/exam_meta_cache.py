@@ -0,0 +1,160 @@
+"""
+Exam Meta Cache - Cache metadata đề thi trong process (title, subject, structure,
+questionCount, answer key đã compile + hash)
+
+- Nộp bài / listing kết quả đọc metadata từ đây thay vì đọc lại document đề thi
+- LRU giới hạn số entry + TTL (EXAM_META_CACHE_MAX_ENTRIES, EXAM_META_CACHE_TTL)
+- Invalidate khi create_exam / delete_exam, và (tùy chọn, EXAM_META_CACHE_LISTEN=true)
+  bởi Firestore snapshot listener khi đề bị sửa từ nơi khác
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from services import exam_storage
+from services.grading_engine import AnswerKey, grading_engine
+
+# Field cần đọc khi cache miss (questions chỉ dùng để compile answer key)
+EXAM_META_FIELDS = ['title', 'subject', 'structure'] + exam_storage.STORAGE_FIELDS
+
+
+@dataclass(frozen=True)
+class ExamMeta:
+    exam_id: str
+    title: Optional[str]
+    subject: Optional[str]
+    structure: Optional[str]
+    question_count: int
+    answer_key: AnswerKey
+    answer_key_hash: str
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.exam_id,
+            "title": self.title,
+            "subject": self.subject,
+            "structure": self.structure,
+            "questionCount": self.question_count,
+            "answerKeyHash": self.answer_key_hash,
+        }
+
+
+def build_exam_meta(exam_id: str, data: dict, questions: list) -> ExamMeta:
+    key = grading_engine.compile_key(exam_id, questions)
+    return ExamMeta(
+        exam_id=exam_id,
+        title=data.get('title'),
+        subject=data.get('subject'),
+        structure=data.get('structure'),
+        question_count=data.get('questionCount', len(questions)),
+        answer_key=key,
+        answer_key_hash=hashlib.sha256("\x1f".join(key.codes).encode("utf-8")).hexdigest()[:16],
+    )
+
+
+class ExamMetaCache:
+    """LRU + TTL; lock vì snapshot listener invalidate từ thread khác"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # exam_id -> (cached_at, ExamMeta)
+        self._lock = threading.Lock()
+        self._watch = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, exam_id: str) -> Optional[ExamMeta]:
+        with self._lock:
+            entry = self._entries.get(exam_id)
+            if entry is None:
+                return None
+            cached_at, meta = entry
+            if self.ttl_seconds > 0 and time.time() - cached_at >= self.ttl_seconds:
+                del self._entries[exam_id]
+                return None
+            self._entries.move_to_end(exam_id)
+            return meta
+
+    def put(self, meta: ExamMeta):
+        with self._lock:
+            self._entries[meta.exam_id] = (time.time(), meta)
+            self._entries.move_to_end(meta.exam_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, exam_id: str):
+        with self._lock:
+            if self._entries.pop(exam_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def get_many(self, db, exam_ids: Iterable[str]) -> Dict[str, Optional[ExamMeta]]:
+        """Hit lấy từ cache, miss đọc bằng 1 lời gọi db.get_all; đề không tồn tại -> None"""
+        found, missing = {}, []
+        for exam_id in dict.fromkeys(i for i in exam_ids if i):
+            meta = self.get(exam_id)
+            if meta is not None:
+                found[exam_id] = meta
+            else:
+                missing.append(exam_id)
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            col = db.collection('exams')
+            docs = {}
+            async for snap in db.get_all([col.document(i) for i in missing], field_paths=EXAM_META_FIELDS):
+                if snap.exists:
+                    docs[snap.id] = snap.to_dict()
+            # Đề lưu dạng pages: đọc câu hỏi từ subcollection (song song) để compile answer key
+            questions = await exam_storage.load_questions_many(db, docs)
+            for exam_id, data in docs.items():
+                meta = build_exam_meta(exam_id, data, questions[exam_id])
+                self.put(meta)
+                found[exam_id] = meta
+            for exam_id in missing:
+                found.setdefault(exam_id, None)
+        return found
+
+    async def get_one(self, db, exam_id: str) -> Optional[ExamMeta]:
+        return (await self.get_many(db, [exam_id])).get(exam_id)
+
+    # ---- Firestore snapshot listener (sync client, callback chạy ở thread của SDK) ----
+    def start_listener(self, sync_db):
+        if self._watch is not None or sync_db is None:
+            return
+
+        def on_snapshot(_docs, changes, _read_time):
+            for change in changes:
+                # ADDED gồm cả snapshot ban đầu -> chỉ cần bỏ entry khi đề bị sửa / xóa
+                if change.type.name in ("MODIFIED", "REMOVED"):
+                    self.invalidate(change.document.id)
+
+        self._watch = sync_db.collection('exams').on_snapshot(on_snapshot)
+        print("[EXAM META] Snapshot listener started")
+
+    def stop_listener(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {**self.stats, "size": size, "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds}
+
+
+# Singleton instance
+exam_meta_cache = ExamMetaCache(
+    max_entries=int(os.getenv("EXAM_META_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("EXAM_META_CACHE_TTL", "300")),
+)
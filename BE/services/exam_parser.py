@@ -0,0 +1,147 @@
+"""
+Exam Parser - Parse output của AI thành list Question
+
+Single-pass: regex biên dịch sẵn quét response một lần, nhận diện cả label
+(Loại/Điểm/Nội dung/Đáp án/Rubric) lẫn dấu KẾT THÚC CÂU, và một state machine nhỏ
+gom giá trị cho từng câu.
+- Label đầu dòng: chịu được biến thể (hoa/thường, markdown, gạch đầu dòng,
+  "Đáp án đúng:", "Tiêu chí chấm điểm:", ...)
+- Label giữa dòng (nhiều label trên 1 dòng, "Rubric: N/A KẾT THÚC CÂU"): nhận như
+  parser cũ; chỉ quét khi response có label chuẩn không nằm ở đầu dòng
+Kết quả giống hệt parser cũ với mọi layout parser cũ đọc được (tests/golden/exam_parser).
+"""
+
+import heapq
+import re
+import unicodedata
+from typing import List
+
+from models.schemas import Question
+
+
+# field -> regex các biến thể label (không gồm dấu ':')
+_LABEL_PATTERNS = {
+    "type": r"Loại(?:\s+câu(?:\s+hỏi)?)?",
+    "score": r"Điểm(?:\s+số)?",
+    "content": r"Nội\s+dung(?:\s+câu\s+hỏi)?",
+    "answer": r"Đáp\s+án(?:\s+đúng)?",
+    "rubric": r"Rubric|Tiêu\s+chí(?:\s+chấm(?:\s+điểm)?)?",
+}
+
+_END_PATTERN = r"KẾT\s+THÚC\s+CÂU"
+_SEPARATOR = r"[*#]*[ \t]*[:：][*#]*"
+_TOKEN_BODY = (
+    rf"(?:(?P<end>{_END_PATTERN})"
+    + "".join(rf"|(?P<{field}>{pattern}){_SEPARATOR}" for field, pattern in _LABEL_PATTERNS.items())
+    + ")"
+)
+# Đầu dòng: cho phép khoảng trắng, markdown, gạch đầu dòng trước label, không phân biệt hoa/thường
+_LINE_TOKEN_RE = re.compile(r"^[ \t*#>-]*" + _TOKEN_BODY, re.IGNORECASE | re.MULTILINE)
+_TOKEN_AT_RE = re.compile(_TOKEN_BODY, re.IGNORECASE)
+# Giữa dòng ("Rubric: N/A KẾT THÚC CÂU", nhiều label trên 1 dòng): chỉ nhận label viết chuẩn
+# như parser cũ (đúng hoa/thường, 1 dấu cách) để "điểm:" trong câu văn không bị cắt nhầm.
+# Không có group -> re quét nhanh theo ký tự đầu; group lấy lại bằng _TOKEN_AT_RE
+_INLINE_SCAN_RE = re.compile("|".join(
+    [_END_PATTERN.replace(r"\s+", " ")]
+    + ["(?:" + pattern.replace(r"\s+", " ") + ")" + _SEPARATOR for pattern in _LABEL_PATTERNS.values()]
+))
+# Chữ đầu của mọi label chuẩn: đếm bằng str.count để biết có cần quét giữa dòng không
+_CANONICAL_HEADS = ("KẾT THÚC CÂU", "Loại", "Điểm", "Nội dung", "Đáp án", "Rubric", "Tiêu chí")
+_QUESTION_PREFIX_RE = re.compile(r'^(Câu|Câu hỏi)\s*\d+[:.]?\s*', re.IGNORECASE)
+_SCORE_RE = re.compile(r'[\d.]+')
+
+
+def clean_text(text: str) -> str:
+    """Remove markdown artifacts (str.replace nhanh hơn str.translate với chuỗi Unicode)"""
+    return text.replace('*', '').replace('_', '').replace('#', '').strip()
+
+
+def _build_question(fields: dict) -> Question:
+    score = fields.get("score", "")
+    content = _QUESTION_PREFIX_RE.sub('', fields.get("content", ""))
+    rubric = fields.get("rubric", "")
+
+    try:
+        score_float = float(_SCORE_RE.search(score).group()) if score else None
+    except (AttributeError, ValueError):
+        score_float = None
+
+    return Question(
+        type=clean_text(fields.get("type", "")),
+        content=f"({score} điểm) {clean_text(content)}" if score else clean_text(content),
+        correct_answer=clean_text(fields.get("answer", "")),
+        rubric=None if rubric.upper() == "N/A" else clean_text(rubric),
+        score=score_float
+    )
+
+
+def _tokens(text: str) -> list:
+    """Các match label / KẾT THÚC CÂU theo thứ tự xuất hiện"""
+    tokens = list(_LINE_TOKEN_RE.finditer(text))
+    at_line_start = sum(1 for m in tokens if text.startswith(_CANONICAL_HEADS, m.start(m.lastgroup)))
+    if at_line_start == sum(map(text.count, _CANONICAL_HEADS)):
+        return tokens   # output chuẩn: mọi label nằm ở đầu dòng
+
+    inline = (_TOKEN_AT_RE.match(text, m.start()) for m in _INLINE_SCAN_RE.finditer(text))
+    merged, last_end = [], -1
+    for match in heapq.merge(tokens, inline, key=lambda m: m.start()):
+        if match.start() >= last_end:   # label đầu dòng cũng khớp lần quét giữa dòng
+            merged.append(match)
+            last_end = match.end()
+    return merged
+
+
+def parse_ai_response(response: str) -> List[Question]:
+    """Parse toàn bộ response trong 1 lần quét"""
+    response = unicodedata.normalize("NFC", response or "")
+    questions = []
+    fields = {}
+    field = None
+    value_start = 0
+
+    for match in _tokens(response):
+        if field is not None and field not in fields:
+            fields[field] = response[value_start:match.start()].strip()
+        field = match.lastgroup
+        value_start = match.end()
+
+        if field == "end":
+            if fields:
+                questions.append(_build_question(fields))
+            fields = {}
+            field = None
+
+    # Câu cuối không có dấu KẾT THÚC CÂU
+    if field is not None and field not in fields:
+        fields[field] = response[value_start:].strip()
+    if fields:
+        questions.append(_build_question(fields))
+
+    return questions
+
+
+class IncrementalQuestionParser:
+    """
+    Parser cho output dạng stream: feed() từng chunk text,
+    trả về các Question ngay khi gặp dấu KẾT THÚC CÂU của câu đó.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[Question]:
+        # NFC cả buffer: dấu tổ hợp (NFD) có thể bị tách sang chunk sau
+        self._buffer = unicodedata.normalize("NFC", self._buffer + (chunk or ""))
+        last_end = None
+        for match in _tokens(self._buffer):
+            if match.lastgroup == "end":
+                last_end = match.end()
+        if last_end is None:
+            return []
+        complete, self._buffer = self._buffer[:last_end], self._buffer[last_end:]
+        return parse_ai_response(complete)
+
+    def close(self) -> List[Question]:
+        """Mọi câu còn lại sau dấu kết thúc cuối cùng"""
+        tail, self._buffer = self._buffer, ""
+        return parse_ai_response(tail)
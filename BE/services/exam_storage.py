@@ -0,0 +1,133 @@
+"""
+Exam Storage - Lưu câu hỏi của đề thi ngoài document cha
+
+exams/{examId}                        -> metadata (title, subject, structure, questionCount,
+                                         questionStorage="pages", questionPages)
+exams/{examId}/question_pages/{0000}  -> {"index": 0, "questions": [...]} (tối đa PAGE_SIZE câu / trang)
+
+- Đọc metadata không còn kéo theo toàn bộ câu hỏi, đề dài không chạm giới hạn 1 MiB / document
+- Đề cũ (questions inline) vẫn đọc được; migrate_exam chuyển sang dạng trang
+- EXAM_QUESTION_STORAGE=inline giữ cách lưu cũ cho đề mới
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from google.cloud import firestore
+
+QUESTION_STORAGE = os.getenv("EXAM_QUESTION_STORAGE", "pages").lower()
+PAGE_SIZE = int(os.getenv("EXAM_QUESTIONS_PAGE_SIZE", "25"))
+PAGES_COLLECTION = "question_pages"
+# Field của document cha cần để biết câu hỏi nằm ở đâu
+STORAGE_FIELDS = ['questions', 'questionStorage', 'questionPages', 'questionCount']
+
+
+def _page_id(index: int) -> str:
+    return f"{index:04d}"
+
+
+def is_paged(data: Optional[Dict[str, Any]]) -> bool:
+    return bool(data) and data.get('questionStorage') == 'pages'
+
+
+def _split_pages(questions: List[Any]) -> List[List[Any]]:
+    return [questions[i:i + PAGE_SIZE] for i in range(0, len(questions), PAGE_SIZE)]
+
+
+async def write_exam(db, exam_id: str, entry: Dict[str, Any]):
+    """
+    set() document đề thi; ở chế độ pages, câu hỏi được tách ra subcollection
+    trong cùng 1 batch (kèm xóa các trang thừa của phiên bản cũ).
+    """
+    exam_ref = db.collection('exams').document(exam_id)
+    questions = list(entry.get('questions') or [])
+    if QUESTION_STORAGE != 'pages':
+        await exam_ref.set({**entry, 'questionCount': len(questions)})
+        return
+
+    old = await exam_ref.get(field_paths=['questionPages'])
+    old_pages = (old.to_dict() or {}).get('questionPages', 0) if old.exists else 0
+    pages = _split_pages(questions)
+
+    parent = {k: v for k, v in entry.items() if k != 'questions'}
+    parent.update(questionCount=len(questions), questionStorage='pages', questionPages=len(pages))
+
+    batch = db.batch()
+    batch.set(exam_ref, parent)
+    pages_col = exam_ref.collection(PAGES_COLLECTION)
+    for index, page in enumerate(pages):
+        batch.set(pages_col.document(_page_id(index)), {'index': index, 'questions': page})
+    for index in range(len(pages), old_pages or 0):
+        batch.delete(pages_col.document(_page_id(index)))
+    await batch.commit()
+
+
+async def load_questions(db, exam_id: str, data: Optional[Dict[str, Any]],
+                         offset: int = 0, limit: Optional[int] = None) -> List[Any]:
+    """
+    Câu hỏi [offset, offset + limit) của đề; data = document cha (ít nhất STORAGE_FIELDS).
+    Dạng pages chỉ đọc các trang chứa đoạn cần lấy (1 lời gọi get_all).
+    """
+    data = data or {}
+    end = None if limit is None else offset + limit
+    if not is_paged(data):
+        return list(data.get('questions') or [])[offset:end]
+
+    page_count = data.get('questionPages') or 0
+    first = offset // PAGE_SIZE
+    last = page_count - 1 if end is None else min(page_count - 1, (end - 1) // PAGE_SIZE)
+    if page_count == 0 or first > last:
+        return []
+
+    pages_col = db.collection('exams').document(exam_id).collection(PAGES_COLLECTION)
+    refs = [pages_col.document(_page_id(i)) for i in range(first, last + 1)]
+    pages = {}
+    async for snap in db.get_all(refs):
+        if snap.exists:
+            page = snap.to_dict()
+            pages[page.get('index', int(snap.id))] = page.get('questions') or []
+
+    questions = []
+    for index in range(first, last + 1):
+        questions.extend(pages.get(index, []))
+    start = offset - first * PAGE_SIZE
+    return questions[start:None if end is None else start + (end - offset)]
+
+
+async def load_questions_many(db, docs: Dict[str, Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """exam_id -> toàn bộ câu hỏi, các đề dạng pages được đọc song song"""
+    exam_ids = list(docs)
+    questions = await asyncio.gather(*(load_questions(db, i, docs[i]) for i in exam_ids))
+    return dict(zip(exam_ids, questions))
+
+
+async def delete_exam(db, exam_id: str):
+    """Xóa đề thi cùng các trang câu hỏi"""
+    exam_ref = db.collection('exams').document(exam_id)
+    batch = db.batch()
+    async for page_ref in exam_ref.collection(PAGES_COLLECTION).list_documents():
+        batch.delete(page_ref)
+    batch.delete(exam_ref)
+    await batch.commit()
+
+
+async def migrate_exam(db, exam_ref, data: Dict[str, Any]) -> bool:
+    """Đề inline -> pages (trang + bỏ field questions trong cùng 1 batch); False nếu không cần"""
+    if is_paged(data) or 'questions' not in data:
+        return False
+    questions = list(data.get('questions') or [])
+    pages = _split_pages(questions)
+
+    batch = db.batch()
+    pages_col = exam_ref.collection(PAGES_COLLECTION)
+    for index, page in enumerate(pages):
+        batch.set(pages_col.document(_page_id(index)), {'index': index, 'questions': page})
+    batch.update(exam_ref, {
+        'questions': firestore.DELETE_FIELD,
+        'questionCount': len(questions),
+        'questionStorage': 'pages',
+        'questionPages': len(pages),
+    })
+    await batch.commit()
+    return True
@@ -4,6 +4,7 @@ Firebase Admin SDK integration
 """
 
 import os
+import asyncio
 
 
 class FirebaseService:
@@ -12,6 +13,8 @@ class FirebaseService:
     def __init__(self):
         # print(f"[DEBUG] FirebaseService initialized. Instance: {id(self)}")
         self.db = None
+        # Non-blocking client used by the routers (google.cloud.firestore.AsyncClient)
+        self.async_db = None
         self._initialized = False
         # No auto-init. Must call initialize() explicitly.
 
@@ -19,7 +22,7 @@ class FirebaseService:
     @property
     def is_initialized(self) -> bool:
         """Check if Firebase is truly connected"""
-        if self._initialized and self.db is not None:
+        if self._initialized and self.db is not None and self.async_db is not None:
             return True
         # Try to recover if initialized but flag/db missing? 
         return False
@@ -30,16 +33,17 @@ class FirebaseService:
         """Khởi tạo Firebase Admin SDK"""
         try:
             import firebase_admin
-            from firebase_admin import credentials, firestore
+            from firebase_admin import credentials, firestore, firestore_async
             
             # Prevent re-initialization if already in memory
-            if self._initialized and self.db is not None:
+            if self._initialized and self.db is not None and self.async_db is not None:
                 return True
             
             # Use Firebase internal check to avoid Multi-App errors on reload
             import firebase_admin
             if firebase_admin._apps:
                 self.db = firestore.client()
+                self.async_db = firestore_async.client()
                 self._initialized = True
                 return True
             
@@ -58,6 +62,7 @@ class FirebaseService:
                     firebase_admin.initialize_app(cred)
                 
                 self.db = firestore.client()
+                self.async_db = firestore_async.client()
                 self._initialized = True
                 print(f"[OK] Firebase Connected. DB Instance: {id(self.db)}")
                 return True
@@ -77,9 +82,9 @@ class FirebaseService:
         return SERVER_TIMESTAMP
     
     def _firestore_transaction(self, func):
-        """Decorator for Firestore transactions"""
+        """Decorator for Firestore transactions (async client, coroutine body)"""
         from google.cloud import firestore
-        return firestore.transactional(func)
+        return firestore.async_transactional(func)
     
     async def verify_token(self, id_token: str) -> dict:
         """
@@ -91,7 +96,8 @@ class FirebaseService:
         
         try:
             from firebase_admin import auth
-            decoded_token = auth.verify_id_token(id_token)
+            # verify_id_token may fetch Google public certs -> keep it off the event loop
+            decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token)
             return {
                 "uid": decoded_token.get("uid"),
                 "email": decoded_token.get("email"),
@@ -102,11 +108,11 @@ class FirebaseService:
     
     async def get_user_role(self, uid: str) -> str:
         """Get user role từ Firestore"""
-        if not self._initialized or not self.db:
+        if not self._initialized or not self.async_db:
             return "student"
         
         try:
-            doc = self.db.collection("users").document(uid).get()
+            doc = await self.async_db.collection("users").document(uid).get()
             if doc.exists:
                 return doc.to_dict().get("role", "student")
         except Exception as e:
@@ -116,16 +122,16 @@ class FirebaseService:
     
     async def save_exam(self, exam_data: dict, doc_id: str = None) -> str:
         """Lưu đề thi vào Firestore"""
-        if not self._initialized or not self.db:
+        if not self._initialized or not self.async_db:
             return None
         
+        # Câu hỏi được tách ra subcollection question_pages (xem exam_storage)
+        from services import exam_storage
         try:
-            if doc_id:
-                self.db.collection("exams").document(doc_id).set(exam_data)
-                return doc_id
-            else:
-                doc_ref = self.db.collection("exams").add(exam_data)
-                return doc_ref[1].id
+            if not doc_id:
+                doc_id = self.async_db.collection("exams").document().id
+            await exam_storage.write_exam(self.async_db, doc_id, exam_data)
+            return doc_id
         except Exception as e:
             print(f"Error saving exam: {e}")
             return None
@@ -0,0 +1,91 @@
+"""
+Grading Engine - Chấm trắc nghiệm phía server
+
+- compile_key: đáp án của đề được chuẩn hóa thành tuple mã lựa chọn MỘT lần
+  (memoize theo exam_id + nội dung đáp án -> sửa đáp án sẽ tự compile lại)
+- grade_batch: chấm cả lớp trên key đã compile, mỗi bài là 1 lượt so sánh theo cột
+- Quy tắc so sánh giống client (exam_execution_page.dart): trim + upper, khớp nguyên chuỗi
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    exam_id: str
+    codes: Tuple[str, ...]   # "" = câu không có đáp án -> không bao giờ đúng
+
+    @property
+    def total(self) -> int:
+        return len(self.codes)
+
+
+@dataclass(frozen=True)
+class GradeResult:
+    correct_count: int
+    total_questions: int
+    correct_questions: List[int]
+
+    @property
+    def score(self) -> float:
+        # Giống client: điểm = số câu đúng
+        return float(self.correct_count)
+
+
+def normalize_choice(value: Any) -> str:
+    return str(value if value is not None else "").strip().upper()
+
+
+def _answer_of(question: Dict[str, Any]) -> str:
+    return normalize_choice(question.get('correctAnswer') or question.get('correct_answer'))
+
+
+class GradingEngine:
+    """Cache các AnswerKey đã compile (LRU theo exam_id)"""
+
+    def __init__(self, max_keys: int = 256):
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[str, AnswerKey]" = OrderedDict()
+
+    def compile_key(self, exam_id: str, questions: Optional[List[Dict[str, Any]]]) -> AnswerKey:
+        codes = tuple(_answer_of(q) for q in questions or [])
+        cached = self._keys.get(exam_id)
+        if cached is not None and cached.codes == codes:
+            self._keys.move_to_end(exam_id)
+            return cached
+
+        key = AnswerKey(exam_id=exam_id, codes=codes)
+        self._keys[exam_id] = key
+        self._keys.move_to_end(exam_id)
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+        return key
+
+    @staticmethod
+    def _submission_codes(key: AnswerKey, answers: Optional[Dict[str, Any]]) -> List[str]:
+        """answers {"0": "A", ...} -> list mã đã chuẩn hóa, thẳng hàng với key"""
+        answers = answers or {}
+        return [normalize_choice(answers.get(str(i))) for i in range(key.total)]
+
+    def grade(self, key: AnswerKey, answers: Optional[Dict[str, Any]]) -> GradeResult:
+        return self.grade_batch(key, [answers])[0]
+
+    def grade_batch(self, key: AnswerKey, submissions: Iterable[Optional[Dict[str, Any]]]) -> List[GradeResult]:
+        """Chấm nhiều bài trên cùng 1 key (key và chỉ số câu chỉ dựng 1 lần cho cả batch)"""
+        gradable = [(i, code) for i, code in enumerate(key.codes) if code]
+        results = []
+        for answers in submissions:
+            given = self._submission_codes(key, answers)
+            correct = [i for i, code in gradable if given[i] == code]
+            results.append(GradeResult(
+                correct_count=len(correct),
+                total_questions=key.total,
+                correct_questions=correct,
+            ))
+        return results
+
+
+# Singleton instance
+grading_engine = GradingEngine()
@@ -0,0 +1,281 @@
+"""
+Identity Index - Tra user theo doc ID / uid / username / email bằng tối đa 1 lần đọc
+
+user_identities/{kind}:{value}  -> {"userId": <doc ID trong users>, "kind", "value"}
+
+- resolve: cache LRU trong process (0 lần đọc); miss -> MỘT lời gọi get_all gồm
+  users/{identifier} + các entry index ứng viên, lấy theo thứ tự ưu tiên của caller.
+  Cache hit ở key ưu tiên thấp chỉ được dùng khi các key đứng trước đã biết là miss
+  (ghi nhớ IDENTITY_MISS_TTL giây), nếu không vẫn đọc các key đó trước
+- Index được ghi khi đăng ký user, xóa khi xóa user; user cũ chưa có entry được tìm
+  bằng query field như trước (IDENTITY_INDEX_FALLBACK) rồi tự ghi bổ sung entry
+- AUTH và CORE chạy process riêng: entry cache trỏ tới user đã bị xóa được phát hiện
+  khi đọc document (không tồn tại) -> bỏ cache và resolve lại
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from google.cloud import firestore
+
+INDEX_COLLECTION = "user_identities"
+# Loại định danh có entry trong index ('id' = doc ID, đọc thẳng users/{id})
+INDEXED_KINDS = ('uid', 'username', 'email')
+FALLBACK_QUERIES = os.getenv("IDENTITY_INDEX_FALLBACK", "true").lower() == "true"
+
+
+def normalize(kind: str, value) -> str:
+    value = str(value or "").strip()
+    return value.lower() if kind in ('username', 'email') else value
+
+
+def _entry_id(kind: str, value: str) -> str:
+    # Doc ID không được chứa '/'
+    return f"{kind}:{quote(value, safe='@.+-_')}"
+
+
+def identities_of(user_id: str, data: Optional[dict]) -> List[Tuple[str, str]]:
+    """Các (kind, value) cần có entry cho 1 user (uid trùng doc ID thì không cần)"""
+    data = data or {}
+    keys = []
+    for kind in INDEXED_KINDS:
+        value = normalize(kind, data.get(kind))
+        if value and not (kind == 'uid' and value == user_id):
+            keys.append((kind, value))
+    return keys
+
+
+class IdentityIndex:
+    """LRU (kind, value) -> doc ID trước collection user_identities"""
+
+    def __init__(self, max_entries: int = 10000, fallback_queries: bool = True, miss_ttl: float = 60):
+        self.max_entries = max_entries
+        self.fallback_queries = fallback_queries
+        self.miss_ttl = miss_ttl
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        # key vừa đọc thấy không tồn tại -> hạn (monotonic); chỉ dùng để bỏ qua key ưu tiên hơn
+        # đứng trước 1 cache hit, không bao giờ tự trả "không tìm thấy"
+        self._misses: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "index_reads": 0, "fallback_queries": 0, "healed": 0}
+
+    # ---- cache ----
+    def _get(self, key: Tuple[str, str]) -> Optional[str]:
+        user_id = self._entries.get(key)
+        if user_id is not None:
+            self._entries.move_to_end(key)
+        return user_id
+
+    def _put(self, key: Tuple[str, str], user_id: str):
+        self._misses.pop(key, None)
+        self._entries[key] = user_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _put_miss(self, key: Tuple[str, str]):
+        self._misses[key] = time.monotonic() + self.miss_ttl
+        self._misses.move_to_end(key)
+        while len(self._misses) > self.max_entries:
+            self._misses.popitem(last=False)
+
+    def _known_miss(self, key: Tuple[str, str], now: float) -> bool:
+        expires = self._misses.get(key)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._misses[key]
+            return False
+        return True
+
+    def invalidate_user(self, user_id: str):
+        for key in [k for k, v in self._entries.items() if v == user_id]:
+            del self._entries[key]
+
+    # ---- resolve ----
+    @staticmethod
+    def candidates(identifier: str, kinds: Sequence[str]) -> List[Tuple[str, str]]:
+        """Ứng viên (kind, value) theo thứ tự ưu tiên; kind 'username@' = phần trước @ của email"""
+        found = []
+        for kind in kinds:
+            if kind == 'username@':
+                if "@" not in identifier:
+                    continue
+                key = ('username', normalize('username', identifier.split("@")[0]))
+            else:
+                key = (kind, normalize(kind, identifier))
+            if key[1] and key not in found:
+                found.append(key)
+        return found
+
+    async def _resolve(self, db, keys: List[Tuple[str, str]]) -> Optional[Tuple[str, str, Optional[dict]]]:
+        """(doc ID, kind khớp, dữ liệu user nếu đã đọc được trong lúc resolve)"""
+        # Cache hit chỉ được trả khi mọi key ưu tiên hơn đứng trước nó đã biết là miss;
+        # key trước đó chưa biết -> đọc chúng (1 get_all), không có mới lấy kết quả cache
+        cached = None
+        now = time.monotonic()
+        for i, key in enumerate(keys):
+            user_id = self._get(key)
+            if user_id is not None:
+                cached = (user_id, key[0], None)
+                keys = [k for k in keys[:i] if not self._known_miss(k, now)]
+                break
+        if cached is not None and not keys:
+            self.stats["hits"] += 1
+            return cached
+        self.stats["misses"] += 1
+
+        users = db.collection('users')
+        index = db.collection(INDEX_COLLECTION)
+        refs = [users.document(v) if k == 'id' else index.document(_entry_id(k, v)) for k, v in keys]
+        snaps = {}
+        self.stats["index_reads"] += 1
+        async for snap in db.get_all(refs):
+            snaps[snap.reference.path] = snap
+
+        for (kind, value), ref in zip(keys, refs):
+            snap = snaps.get(ref.path)
+            if snap is None or not snap.exists:
+                self._put_miss((kind, value))
+                continue
+            if kind == 'id':
+                self._put((kind, value), value)
+                return value, kind, snap.to_dict() or {}
+            user_id = (snap.to_dict() or {}).get('userId')
+            if user_id:
+                self._put((kind, value), user_id)
+                return user_id, kind, None
+            self._put_miss((kind, value))
+
+        if cached is not None:
+            return cached
+        if self.fallback_queries:
+            return await self._resolve_by_query(db, [k for k in keys if k[0] != 'id'])
+        return None
+
+    async def _resolve_by_query(self, db, keys: List[Tuple[str, str]]) -> Optional[Tuple[str, str, Optional[dict]]]:
+        """User cũ chưa có entry: query theo field (song song), ghi bổ sung entry khi tìm thấy"""
+        if not keys:
+            return None
+        self.stats["fallback_queries"] += 1
+        users = db.collection('users')
+        responses = await asyncio.gather(*(users.where(k, '==', v).limit(1).get() for k, v in keys))
+        for (kind, value), docs in zip(keys, responses):
+            docs = list(docs)
+            if not docs:
+                continue
+            doc = docs[0]
+            data = doc.to_dict() or {}
+            try:
+                await self.index_user(db, doc.id, data)
+                self.stats["healed"] += 1
+            except Exception as e:
+                print(f"[WARN] Failed to index identities of user {doc.id}: {e}")
+            self._put((kind, value), doc.id)
+            return doc.id, kind, data
+        return None
+
+    async def resolve(self, db, identifier: str, kinds: Sequence[str] = ('id', 'uid', 'username')) -> Optional[str]:
+        """Doc ID của user: cache hit 0 lần đọc, miss 1 get_all"""
+        found = await self._resolve(db, self.candidates(str(identifier or ""), kinds))
+        return found[0] if found else None
+
+    async def load_user(self, db, identifier: str, kinds: Sequence[str] = ('id', 'uid', 'username'),
+                        field_paths: Optional[List[str]] = None) -> Optional[Tuple[str, dict, str]]:
+        """
+        (doc ID, dữ liệu user, kind khớp) hoặc None.
+        Ngoài lần đọc document user (vốn cần) không tốn thêm lần đọc nào khi cache hit.
+        """
+        keys = self.candidates(str(identifier or ""), kinds)
+        if not keys:
+            return None
+        for _attempt in range(2):
+            found = await self._resolve(db, keys)
+            if found is None:
+                return None
+            user_id, kind, data = found
+            if data is None:
+                snap = await db.collection('users').document(user_id).get(field_paths=field_paths)
+                if not snap.exists:
+                    # user đã bị xóa (có thể ở process khác) -> bỏ cache, resolve lại từ Firestore
+                    self.invalidate_user(user_id)
+                    continue
+                data = snap.to_dict() or {}
+            elif field_paths is not None:
+                data = {f: data[f] for f in field_paths if f in data}
+            return user_id, data, kind
+        return None
+
+    # ---- ghi index ----
+    def entries(self, db, user_id: str, data: Optional[dict]) -> Dict[str, Tuple[object, dict]]:
+        index = db.collection(INDEX_COLLECTION)
+        return {
+            _entry_id(kind, value): (index.document(_entry_id(kind, value)),
+                                     {'userId': user_id, 'kind': kind, 'value': value})
+            for kind, value in identities_of(user_id, data)
+        }
+
+    async def index_user(self, db, user_id: str, data: Optional[dict], batch=None, create: bool = False):
+        """
+        Ghi các entry của user; create=True dùng batch.create -> commit lỗi nếu định danh đã
+        thuộc user khác (kiểm tra trùng username nguyên tử). Có batch thì caller tự commit.
+        """
+        entries = list(self.entries(db, user_id, data).values())
+        own_batch = batch is None
+        batch = batch or db.batch()
+        for ref, entry in entries:
+            (batch.create if create else batch.set)(ref, entry)
+        if own_batch:
+            await batch.commit()
+            self.remember(user_id, data)
+
+    def remember(self, user_id: str, data: Optional[dict]):
+        """Đưa các định danh của user vào cache (sau khi index đã được ghi)"""
+        for kind, value in identities_of(user_id, data):
+            self._put((kind, value), user_id)
+        self._put(('id', user_id), user_id)
+
+    def unindex_user(self, db, user_id: str, data: Optional[dict], batch):
+        """Xóa các entry của user trong batch của caller + bỏ cache"""
+        for ref, _entry in self.entries(db, user_id, data).values():
+            batch.delete(ref)
+        self.invalidate_user(user_id)
+
+    async def rebuild(self, db, page_size: int = 150) -> dict:
+        """Backfill entry cho mọi user (phân trang theo doc ID, 1 batch / trang, tối đa 3 entry / user)"""
+        scanned = indexed = 0
+        last = None
+        while True:
+            query = db.collection('users').order_by(firestore.FieldPath.document_id()) \
+                .select(list(INDEXED_KINDS)).limit(page_size)
+            if last is not None:
+                query = query.start_after(last)
+            docs = list(await query.get())
+            if not docs:
+                break
+            batch = db.batch()
+            for doc in docs:
+                entries = self.entries(db, doc.id, doc.to_dict())
+                for ref, entry in entries.values():
+                    batch.set(ref, entry)
+                indexed += len(entries)
+            await batch.commit()
+            scanned += len(docs)
+            last = docs[-1]
+        return {"scanned": scanned, "indexed": indexed}
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "size": len(self._entries), "known_misses": len(self._misses),
+                "max_entries": self.max_entries,
+                "fallback_queries_enabled": self.fallback_queries}
+
+
+# Singleton instance
+identity_index = IdentityIndex(
+    max_entries=int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "10000")),
+    fallback_queries=FALLBACK_QUERIES,
+    miss_ttl=float(os.getenv("IDENTITY_MISS_TTL", "60")),
+)
@@ -0,0 +1,121 @@
+"""
+Long Document - Chia tài liệu dài thành chunk theo token budget (map-reduce)
+
+- split_into_chunks: cắt theo đoạn văn / câu, mỗi chunk <= chunk_tokens (ước lượng)
+- allocate_quotas: chia số câu hỏi cho từng chunk theo độ dài
+- merge_questions: gộp kết quả, bỏ câu trùng, cân lại tổng điểm = 10.0
+"""
+
+import math
+import os
+import re
+import unicodedata
+from typing import List
+
+from models.schemas import Question
+
+
+# Không có tokenizer chung cho 3 provider -> ước lượng theo số ký tự
+# (tiếng Việt có dấu trung bình ~3 ký tự / token)
+CHARS_PER_TOKEN = float(os.getenv("LONG_DOC_CHARS_PER_TOKEN", "3"))
+TOTAL_SCORE = 10.0
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+_SCORE_PREFIX_RE = re.compile(r"^\([\d.,]+\s*điểm\)\s*")
+_DEDUPE_STRIP_RE = re.compile(r"[\W_]+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _split_oversized(piece: str, max_chars: int) -> List[str]:
+    """Đoạn văn quá dài: cắt theo câu, câu quá dài thì cắt cứng"""
+    parts = []
+    for sentence in _SENTENCE_RE.split(piece):
+        while len(sentence) > max_chars:
+            parts.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if sentence:
+            parts.append(sentence)
+    return parts
+
+
+def split_into_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """Gom các đoạn văn liên tiếp vào chunk cho tới khi chạm token budget"""
+    max_chars = max(1, int(chunk_tokens * CHARS_PER_TOKEN))
+    chunks, current, current_len = [], [], 0
+
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_oversized(paragraph, max_chars)
+        for piece in pieces:
+            if current and current_len + len(piece) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current, current_len = [], 0
+            current.append(piece)
+            current_len += len(piece) + 2
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def allocate_quotas(chunks: List[str], count: int) -> List[int]:
+    """Chia count câu theo tỉ lệ độ dài chunk (largest remainder), tổng đúng bằng count"""
+    total = sum(len(c) for c in chunks) or 1
+    exact = [count * len(c) / total for c in chunks]
+    quotas = [int(x) for x in exact]
+    by_remainder = sorted(range(len(chunks)), key=lambda i: exact[i] - quotas[i], reverse=True)
+    for i in by_remainder[:count - sum(quotas)]:
+        quotas[i] += 1
+    return quotas
+
+
+def _dedupe_key(question: Question) -> str:
+    content = _SCORE_PREFIX_RE.sub("", question.content)
+    content = unicodedata.normalize("NFC", content).casefold()
+    return _DEDUPE_STRIP_RE.sub("", content)
+
+
+def rebalance_scores(questions: List[Question], total: float = TOTAL_SCORE) -> List[Question]:
+    """Scale điểm theo tỉ lệ cũ để tổng = total (câu thiếu điểm nhận điểm trung bình)"""
+    if not questions:
+        return questions
+
+    known = [q.score for q in questions if q.score and q.score > 0]
+    fallback = (sum(known) / len(known)) if known else 1.0
+    raw = [q.score if q.score and q.score > 0 else fallback for q in questions]
+    factor = total / sum(raw)
+    scores = [round(s * factor, 2) for s in raw]
+    # Dồn sai số làm tròn vào câu cuối để tổng đúng tuyệt đối
+    scores[-1] = round(total - sum(scores[:-1]), 2)
+
+    rebalanced = []
+    for question, score in zip(questions, scores):
+        content = _SCORE_PREFIX_RE.sub("", question.content)
+        rebalanced.append(question.model_copy(update={
+            "score": score,
+            "content": f"({score:g} điểm) {content}",
+        }))
+    return rebalanced
+
+
+def merge_questions(per_chunk: List[List[Question]], quotas: List[int]) -> List[Question]:
+    """Reduce: nối kết quả theo thứ tự chunk (mỗi chunk tối đa quota câu), bỏ trùng, cân điểm"""
+    merged, seen = [], set()
+    for questions, quota in zip(per_chunk, quotas):
+        taken = 0
+        for question in questions:
+            if taken >= quota:
+                break
+            key = _dedupe_key(question)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            merged.append(question)
+            taken += 1
+    return rebalance_scores(merged)
@@ -0,0 +1,67 @@
+"""
+Provider Stats - Telemetry rolling window cho từng AI provider
+
+Ghi nhận mỗi lần gọi: latency, time-to-first-token (stream), số câu parse được
+so với số câu yêu cầu, và lý do fallback. Dùng để xếp thứ tự provider theo
+"expected latency-to-success" = latency trung bình / tỉ lệ thành công.
+"""
+
+import os
+from collections import Counter, deque
+
+
+STATS_WINDOW = int(os.getenv("AI_STATS_WINDOW", "100"))
+STATS_MIN_SAMPLES = int(os.getenv("AI_STATS_MIN_SAMPLES", "5"))
+# Prior cho provider chưa đủ mẫu: coi như latency AI_PRIOR_LATENCY giây, thành công 90%
+PRIOR_LATENCY = float(os.getenv("AI_PRIOR_LATENCY", "15"))
+PRIOR_SUCCESS_RATE = 0.9
+
+
+class ProviderStats:
+    """Rolling window (STATS_WINDOW lần gọi gần nhất) cho 1 provider"""
+
+    def __init__(self, name: str, window: int = STATS_WINDOW):
+        self.name = name
+        self._calls = deque(maxlen=window)       # (latency, ok, parse_ratio)
+        self._ttft = deque(maxlen=window)        # time to first token (stream)
+        self._fallbacks = deque(maxlen=window)   # lý do chuyển sang provider khác
+
+    def record_call(self, latency: float, ok: bool, parsed: int = 0, requested: int = 0):
+        ratio = min(1.0, parsed / requested) if requested else (1.0 if ok else 0.0)
+        self._calls.append((latency, ok, ratio))
+
+    def record_ttft(self, ttft: float):
+        self._ttft.append(ttft)
+
+    def record_fallback(self, reason: str):
+        self._fallbacks.append(reason)
+
+    def expected_cost(self) -> float:
+        """Giây kỳ vọng để có 1 đề thành công (thấp hơn = ưu tiên hơn)"""
+        if len(self._calls) < STATS_MIN_SAMPLES:
+            return PRIOR_LATENCY / PRIOR_SUCCESS_RATE
+        successes = [latency for latency, ok, _ in self._calls if ok]
+        success_rate = len(successes) / len(self._calls)
+        mean_latency = (sum(successes) / len(successes)) if successes else PRIOR_LATENCY
+        return mean_latency / max(success_rate, 0.05)
+
+    def snapshot(self) -> dict:
+        calls = len(self._calls)
+        successes = [c for c in self._calls if c[1]]
+        latencies = sorted(c[0] for c in self._calls)
+        return {
+            "samples": calls,
+            "success_rate": round(len(successes) / calls, 4) if calls else None,
+            "mean_latency": round(sum(latencies) / calls, 3) if calls else None,
+            "p95_latency": round(latencies[min(calls - 1, int(calls * 0.95))], 3) if calls else None,
+            "mean_ttft": round(sum(self._ttft) / len(self._ttft), 3) if self._ttft else None,
+            "parse_success_rate": round(sum(c[2] for c in self._calls) / calls, 4) if calls else None,
+            "fallback_reasons": dict(Counter(self._fallbacks)),
+            "expected_cost": round(self.expected_cost(), 3),
+        }
+
+
+def order_by_expected_cost(names, stats: dict) -> list:
+    """Sắp xếp provider theo expected_cost; hòa nhau thì giữ thứ tự tĩnh ban đầu"""
+    return sorted(names, key=lambda n: (stats[n].expected_cost(), list(names).index(n)))
+
@@ -0,0 +1,286 @@
+"""
+Registration Queue - Chế độ surge cho đợt mở đăng ký lớp
+
+Khi bật (CLASS_REGISTRATION_SURGE=true hoặc POST /api/classes/register/surge):
+- POST /register chỉ xếp yêu cầu vào hàng đợi của lớp và trả ngay 202 + ticketId
+- Mỗi lớp có 1 worker chạy tuần tự: gom các yêu cầu đang chờ (tối đa
+  REGISTRATION_GROUP_MAX) và áp tất cả trong MỘT transaction (group commit)
+  -> document lớp "nóng" không còn bị nhiều transaction tranh nhau abort / retry
+- Client lấy kết quả cuối qua GET /register/tickets/{ticketId}?wait=...
+
+Hàng đợi và ticket nằm trong process (core-service chạy 1 process).
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from services.class_registration import (
+    RegistrationError,
+    apply_slot,
+    existing_class_ids,
+    plan_registration,
+    read_classes,
+    registered_ids_of,
+    user_update,
+)
+from services.firebase_service import firebase_service
+from services.identity_index import identity_index
+from services.slot_counter import MAX_SHARDS, load_slots, slot_rollup
+
+# Transaction tối đa 500 write: 1 / học sinh + bộ đếm chỗ (currentSlots hoặc tối đa MAX_SHARDS shard)
+MAX_GROUP_LIMIT = 500 - MAX_SHARDS
+
+
+@dataclass
+class RegistrationTicket:
+    ticket_id: str
+    user_id: str
+    class_id: str
+    semester: str
+    is_register: bool
+    user_ref: Any = field(repr=False)
+    status: str = "queued"          # queued -> done | failed
+    status_code: int = 202
+    message: str = ""
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def finish(self, error: Optional[Exception]):
+        if error is None:
+            action = "đăng ký" if self.is_register else "hủy đăng ký"
+            self.status, self.status_code, self.message = "done", 200, f"Đã {action} thành công"
+        else:
+            self.status = "failed"
+            self.status_code = getattr(error, 'status_code', 500)
+            self.message = str(error)
+        self.finished_at = time.time()
+        self.done.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "ticketId": self.ticket_id,
+            "status": self.status,
+            "statusCode": self.status_code,
+            "message": self.message,
+            "classId": self.class_id,
+            "isRegister": self.is_register,
+            "waitedMs": round(((self.finished_at or time.time()) - self.created_at) * 1000),
+        }
+
+
+class RegistrationQueue:
+    """Hàng đợi theo lớp + 1 worker tuần tự / lớp (tạo khi có yêu cầu, tự thoát khi rảnh)"""
+
+    def __init__(self, enabled: bool = False, max_group: int = 100, max_pending: int = 20000,
+                 idle_seconds: float = 30, ticket_ttl: float = 600):
+        self.enabled = enabled
+        self.max_group = max(1, min(max_group, MAX_GROUP_LIMIT))
+        self.max_pending = max_pending
+        self.idle_seconds = idle_seconds
+        self.ticket_ttl = ticket_ttl
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._tickets: "OrderedDict[str, RegistrationTicket]" = OrderedDict()
+        self._pending = 0
+        self._closing = False
+        self.stats = {"queued": 0, "applied": 0, "rejected": 0, "failed": 0,
+                      "groups": 0, "max_group_size": 0, "commit_ms_total": 0.0}
+
+    # ---- API cho router ----
+    def submit(self, db, user_ref, reg) -> RegistrationTicket:
+        if self._closing:
+            raise RegistrationError("[ERROR] Hệ thống đang dừng, vui lòng thử lại sau", 503)
+        if self._pending >= self.max_pending:
+            raise RegistrationError("[ERROR] Hệ thống đăng ký đang quá tải, vui lòng thử lại sau", 503)
+        self._prune_tickets()
+
+        class_id = str(reg.classId).strip()
+        ticket = RegistrationTicket(
+            ticket_id=uuid.uuid4().hex,
+            user_id=str(reg.userId).strip(),
+            class_id=class_id,
+            semester=reg.semester,
+            is_register=reg.isRegister,
+            user_ref=user_ref,
+        )
+        self._tickets[ticket.ticket_id] = ticket
+
+        queue = self._queues.get(class_id)
+        if queue is None:
+            queue = self._queues[class_id] = asyncio.Queue()
+        queue.put_nowait(ticket)
+        self._pending += 1
+        self.stats["queued"] += 1
+        if class_id not in self._workers:
+            self._workers[class_id] = asyncio.ensure_future(self._worker(db, class_id, queue))
+        return ticket
+
+    def get(self, ticket_id: str) -> Optional[RegistrationTicket]:
+        return self._tickets.get(ticket_id)
+
+    async def wait(self, ticket: RegistrationTicket, timeout: float) -> RegistrationTicket:
+        if timeout > 0 and not ticket.done.is_set():
+            try:
+                await asyncio.wait_for(ticket.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return ticket
+
+    # ---- Worker ----
+    async def _worker(self, db, class_id: str, queue: asyncio.Queue):
+        try:
+            while True:
+                try:
+                    first = await asyncio.wait_for(queue.get(), self.idle_seconds)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        break
+                    continue
+                if first is None:   # sentinel của shutdown, đứng sau mọi yêu cầu đã xếp
+                    break
+
+                group, stop = [first], False
+                while len(group) < self.max_group and not queue.empty():
+                    item = queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    group.append(item)
+
+                await self._commit_group(db, class_id, group)
+                if stop:
+                    break
+        finally:
+            # Không có await giữa lần kiểm tra queue rỗng và đây -> submit sau đó sẽ tạo worker mới
+            self._workers.pop(class_id, None)
+            if self._queues.get(class_id) is queue:
+                del self._queues[class_id]
+
+    async def _commit_group(self, db, class_id: str, group: List[RegistrationTicket]):
+        started = time.perf_counter()
+        try:
+            outcomes = await self._run_group(db, class_id, group)
+        except Exception as e:
+            print(f"[ERROR] Group commit failed for class {class_id} ({len(group)} requests): {e}")
+            outcomes = {t.ticket_id: RegistrationError(
+                "[ERROR] Không thể xử lý đăng ký lúc này, vui lòng thử lại", 503) for t in group}
+
+        for ticket in group:
+            error = outcomes.get(ticket.ticket_id)
+            ticket.finish(error)
+            if error is None:
+                self.stats["applied"] += 1
+            elif isinstance(error, RegistrationError) and error.status_code < 500:
+                self.stats["rejected"] += 1
+            else:
+                self.stats["failed"] += 1
+        self._pending -= len(group)
+        self.stats["groups"] += 1
+        self.stats["max_group_size"] = max(self.stats["max_group_size"], len(group))
+        self.stats["commit_ms_total"] += (time.perf_counter() - started) * 1000
+
+    async def _run_group(self, db, class_id: str, group: List[RegistrationTicket]) -> Dict[str, Optional[Exception]]:
+        class_ref = db.collection('classes').document(class_id)
+        user_refs = {t.user_ref.path: t.user_ref for t in group}
+
+        @firebase_service._firestore_transaction
+        async def run(transaction):
+            # Đọc 1: lớp + mọi học sinh trong nhóm
+            snaps = {}
+            async for snap in db.get_all([class_ref] + list(user_refs.values()), transaction=transaction):
+                snaps[snap.reference.path] = snap
+            c_snap = snaps.get(class_ref.path)
+            if c_snap is None or not c_snap.exists:
+                error = RegistrationError(f"[ERROR] Không tìm thấy tài liệu lớp học: {class_ref.path}", 404)
+                return {t.ticket_id: error for t in group}, 0
+
+            class_data = c_snap.to_dict() or {}
+            registered = {path: registered_ids_of(snap.to_dict() or {})
+                          for path, snap in snaps.items() if path in user_refs and snap.exists}
+
+            # Đọc 2: lịch mọi lớp mà các học sinh này đã đăng ký + bộ đếm chỗ (mọi shard nếu chia shard)
+            needed = {i for ids in registered.values() for i in existing_class_ids(ids, class_id)}
+            existing, slots = await asyncio.gather(
+                read_classes(db, sorted(needed), transaction=transaction),
+                load_slots(db, class_ref, class_data, transaction, all_shards=True),
+            )
+
+            # Áp tuần tự theo thứ tự xếp hàng trên trạng thái trong bộ nhớ
+            outcomes: Dict[str, Optional[Exception]] = {}
+            updates: Dict[str, dict] = {}
+            for t in group:
+                path = t.user_ref.path
+                if path not in registered:
+                    identity_index.invalidate_user(t.user_ref.id)
+                    outcomes[t.ticket_id] = RegistrationError(f"[ERROR] Không tìm thấy tài liệu người dùng: {path}", 404)
+                    continue
+                try:
+                    new_ids = plan_registration(class_id, t.semester, t.is_register, class_data,
+                                                registered[path], existing)
+                    if new_ids is not None:
+                        await apply_slot(db, slots, t.is_register, transaction)
+                except RegistrationError as e:
+                    outcomes[t.ticket_id] = e
+                    continue
+                outcomes[t.ticket_id] = None
+                if new_ids is not None:
+                    registered[path] = new_ids
+                    updates.setdefault(path, {}).update(user_update(class_id, t.semester, t.is_register, new_ids))
+
+            slots.write(transaction)
+            for path, data in updates.items():
+                transaction.update(user_refs[path], data)
+            return outcomes, slots.delta
+
+        outcomes, delta = await run(db.transaction())
+        slot_rollup.adjust(class_id, delta)
+        return outcomes
+
+    # ---- Quản trị ----
+    def _prune_tickets(self):
+        cutoff = time.time() - self.ticket_ttl
+        while self._tickets:
+            ticket = next(iter(self._tickets.values()))
+            if ticket.finished_at is None or ticket.finished_at > cutoff:
+                break
+            self._tickets.popitem(last=False)
+
+    async def shutdown(self, timeout: float = 10):
+        """Ngừng nhận, xử lý nốt các yêu cầu đã xếp hàng (tối đa timeout giây)"""
+        self._closing = True
+        for queue in self._queues.values():
+            queue.put_nowait(None)
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, still_running = await asyncio.wait(workers, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        for ticket in self._tickets.values():
+            if not ticket.done.is_set():
+                ticket.finish(RegistrationError("[ERROR] Hệ thống đang dừng, vui lòng thử lại sau", 503))
+
+    def get_stats(self) -> dict:
+        groups = self.stats["groups"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "pending": self._pending,
+            "active_classes": len(self._workers),
+            "avg_group_size": round((self.stats["applied"] + self.stats["rejected"] + self.stats["failed"]) / groups, 2) if groups else 0,
+            "max_group": self.max_group,
+        }
+
+
+# Singleton instance
+registration_queue = RegistrationQueue(
+    enabled=os.getenv("CLASS_REGISTRATION_SURGE", "false").lower() == "true",
+    max_group=int(os.getenv("REGISTRATION_GROUP_MAX", "100")),
+    max_pending=int(os.getenv("REGISTRATION_QUEUE_MAX_PENDING", "20000")),
+)
@@ -0,0 +1,252 @@
+"""
+Slot Counter - Đếm số chỗ đã đăng ký của lớp, tùy chọn chia shard cho lớp "nóng"
+
+classes/{classId}                      -> slotShards = N (không có / 0 = đếm trên currentSlots như cũ)
+classes/{classId}/slot_shards/{00..}   -> {"index", "count", "capacity"}
+
+- Giữ chỗ bằng capacity reservation: tổng capacity các shard = maxSlots và mỗi shard
+  không vượt capacity của nó -> tổng count không bao giờ vượt maxSlots (chính xác tuyệt đối)
+- Đăng ký chỉ ghi 1 shard ngẫu nhiên còn chỗ -> thông lượng ghi tăng theo số shard;
+  shard chọn trước đã đầy thì đọc các shard còn lại trong cùng transaction
+- Đường đọc (list / get lớp) lấy tổng từ rollup cache (SLOT_ROLLUP_TTL giây), được cộng
+  dồn ngay sau mỗi lần ghi thành công trong process
+"""
+
+import os
+import random
+import time
+from typing import Dict, Iterable, List, Optional
+
+from google.cloud import firestore
+
+from services.firebase_service import firebase_service
+
+SHARDS_COLLECTION = "slot_shards"
+MAX_SHARDS = 100
+# Số shard cho lớp mới tạo (0 = không chia shard)
+DEFAULT_SHARDS = int(os.getenv("CLASS_SLOT_SHARDS", "0"))
+
+
+def shard_count_of(class_data: Optional[dict]) -> int:
+    return int((class_data or {}).get('slotShards') or 0)
+
+
+def _shard_id(index: int) -> str:
+    return f"{index:02d}"
+
+
+def _shard_refs(class_ref, indices: Iterable[int]) -> list:
+    col = class_ref.collection(SHARDS_COLLECTION)
+    return [col.document(_shard_id(i)) for i in indices]
+
+
+async def read_shards(db, class_ref, indices: Iterable[int], transaction=None) -> Dict[int, dict]:
+    """index -> {"count", "capacity"} (1 lời gọi get_all); shard thiếu coi như rỗng"""
+    indices = list(indices)
+    found = {i: {'count': 0, 'capacity': 0} for i in indices}
+    if not indices:
+        return found
+    async for snap in db.get_all(_shard_refs(class_ref, indices), transaction=transaction):
+        if snap.exists:
+            data = snap.to_dict() or {}
+            found[int(data.get('index', snap.id))] = {
+                'count': int(data.get('count', 0)),
+                'capacity': int(data.get('capacity', 0)),
+            }
+    return found
+
+
+def split_capacity(max_slots: int, counts: List[int]) -> List[int]:
+    """capacity_i >= count_i và sum(capacity) = maxSlots (chỗ trống chia đều cho các shard)"""
+    capacities = list(counts)
+    remaining = max_slots - sum(counts)
+    if remaining > 0 and capacities:
+        base, extra = divmod(remaining, len(capacities))
+        for i in range(len(capacities)):
+            capacities[i] += base + (1 if i < extra else 0)
+    return capacities
+
+
+def split_count(total: int, shards: int) -> List[int]:
+    base, extra = divmod(max(0, total), shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+# ---- Trạng thái số chỗ trong 1 transaction ----
+class FieldSlots:
+    """Lớp không chia shard: currentSlots / maxSlots trên document lớp"""
+
+    complete = True
+
+    def __init__(self, class_ref, class_data: dict):
+        self.class_ref = class_ref
+        self.count = self.original = int(class_data.get('currentSlots', 0))
+        self.max_slots = int(class_data.get('maxSlots', 50))
+
+    @property
+    def delta(self) -> int:
+        return self.count - self.original
+
+    async def reserve(self, db=None, transaction=None) -> bool:
+        if self.count >= self.max_slots:
+            return False
+        self.count += 1
+        return True
+
+    async def release(self, db=None, transaction=None) -> bool:
+        self.count = max(0, self.count - 1)
+        return True
+
+    def write(self, transaction):
+        if self.delta:
+            transaction.update(self.class_ref, {'currentSlots': self.count})
+
+
+class ShardedSlots:
+    """Lớp chia shard: chỉ các shard đã đọc được dùng, write() ghi các shard bị đổi"""
+
+    def __init__(self, class_ref, shard_count: int, shards: Dict[int, dict]):
+        self.class_ref = class_ref
+        self.shard_count = shard_count
+        self.shards = shards
+        self._dirty = set()
+        self.delta = 0
+
+    @property
+    def complete(self) -> bool:
+        return len(self.shards) >= self.shard_count
+
+    async def _load_rest(self, db, transaction):
+        missing = [i for i in range(self.shard_count) if i not in self.shards]
+        self.shards.update(await read_shards(db, self.class_ref, missing, transaction))
+
+    async def _pick(self, db, transaction, has_room) -> Optional[int]:
+        candidates = [i for i, s in self.shards.items() if has_room(s)]
+        if not candidates and not self.complete:
+            await self._load_rest(db, transaction)
+            candidates = [i for i, s in self.shards.items() if has_room(s)]
+        return random.choice(candidates) if candidates else None
+
+    async def reserve(self, db=None, transaction=None) -> bool:
+        index = await self._pick(db, transaction, lambda s: s['count'] < s['capacity'])
+        if index is None:
+            return False
+        self.shards[index]['count'] += 1
+        self._dirty.add(index)
+        self.delta += 1
+        return True
+
+    async def release(self, db=None, transaction=None) -> bool:
+        index = await self._pick(db, transaction, lambda s: s['count'] > 0)
+        if index is None:
+            return True
+        self.shards[index]['count'] -= 1
+        self._dirty.add(index)
+        self.delta -= 1
+        return True
+
+    def write(self, transaction):
+        for index in self._dirty:
+            ref = _shard_refs(self.class_ref, [index])[0]
+            transaction.update(ref, {'count': self.shards[index]['count']})
+
+
+async def load_slots(db, class_ref, class_data: dict, transaction=None, all_shards: bool = False):
+    """
+    FieldSlots / ShardedSlots cho lớp; mặc định chỉ đọc 1 shard ngẫu nhiên
+    (all_shards=True cho group commit: nhiều lượt giữ chỗ trên cùng 1 lần đọc)
+    """
+    shard_count = shard_count_of(class_data)
+    if shard_count <= 0:
+        return FieldSlots(class_ref, class_data)
+    indices = range(shard_count) if all_shards else [random.randrange(shard_count)]
+    return ShardedSlots(class_ref, shard_count, await read_shards(db, class_ref, indices, transaction))
+
+
+# ---- Cấu hình shard ----
+async def configure_shards(db, class_id: str, shards: int) -> Optional[dict]:
+    """
+    Bật / đổi số shard / tắt (shards=0) cho lớp, hoặc chia lại capacity khi maxSlots đổi.
+    Tổng số đã đăng ký được giữ nguyên; None nếu lớp không tồn tại.
+    """
+    shards = max(0, min(int(shards), MAX_SHARDS))
+    class_ref = db.collection('classes').document(class_id)
+
+    @firebase_service._firestore_transaction
+    async def run(transaction):
+        snap = await class_ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        data = snap.to_dict() or {}
+        old_count = shard_count_of(data)
+        old = await read_shards(db, class_ref, range(old_count), transaction) if old_count else {}
+        total = sum(s['count'] for s in old.values()) if old_count else int(data.get('currentSlots', 0))
+        max_slots = int(data.get('maxSlots', 50))
+
+        shard_col = class_ref.collection(SHARDS_COLLECTION)
+        if shards > 0:
+            counts = [old[i]['count'] for i in range(shards)] if shards == old_count else split_count(total, shards)
+            for index, (count, capacity) in enumerate(zip(counts, split_capacity(max_slots, counts))):
+                transaction.set(shard_col.document(_shard_id(index)),
+                                {'index': index, 'count': count, 'capacity': capacity})
+        for index in range(shards, old_count):
+            transaction.delete(shard_col.document(_shard_id(index)))
+        # currentSlots trên document lớp = ảnh chụp tổng lúc cấu hình (đúng hoàn toàn khi shards=0)
+        transaction.update(class_ref, {
+            'slotShards': shards if shards > 0 else firestore.DELETE_FIELD,
+            'currentSlots': total,
+        })
+        return {"classId": class_id, "slotShards": shards, "currentSlots": total, "maxSlots": max_slots}
+
+    result = await run(db.transaction())
+    slot_rollup.invalidate(class_id)
+    return result
+
+
+async def delete_shards(db, class_ref, batch):
+    async for shard_ref in class_ref.collection(SHARDS_COLLECTION).list_documents():
+        batch.delete(shard_ref)
+
+
+# ---- Rollup cho đường đọc ----
+class SlotRollup:
+    """class_id -> tổng count các shard, cache TTL trong process"""
+
+    def __init__(self, ttl_seconds: float = 5):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, tuple] = {}   # class_id -> (cached_at, total)
+
+    async def totals(self, db, shard_counts: Dict[str, int]) -> Dict[str, int]:
+        """shard_counts: class_id -> số shard; các lớp chưa có trong cache đọc chung 1 get_all"""
+        now = time.time()
+        found, missing = {}, []
+        for class_id in shard_counts:
+            entry = self._entries.get(class_id)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                found[class_id] = entry[1]
+            else:
+                missing.append(class_id)
+
+        if missing:
+            col = db.collection('classes')
+            refs = [ref for class_id in missing for ref in _shard_refs(col.document(class_id), range(shard_counts[class_id]))]
+            totals = dict.fromkeys(missing, 0)
+            async for snap in db.get_all(refs):
+                if snap.exists:
+                    totals[snap.reference.parent.parent.id] += int((snap.to_dict() or {}).get('count', 0))
+            for class_id, total in totals.items():
+                self._entries[class_id] = (now, total)
+            found.update(totals)
+        return found
+
+    def adjust(self, class_id: str, delta: int):
+        entry = self._entries.get(class_id)
+        if entry is not None and delta:
+            self._entries[class_id] = (entry[0], max(0, entry[1] + delta))
+
+    def invalidate(self, class_id: str):
+        self._entries.pop(class_id, None)
+
+
+# Singleton instance
+slot_rollup = SlotRollup(ttl_seconds=float(os.getenv("SLOT_ROLLUP_TTL", "5")))
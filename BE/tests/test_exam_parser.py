@@ -0,0 +1,67 @@
+"""
+Golden test cho services/exam_parser
+
+tests/golden/exam_parser/<tên>.txt = response của AI, <tên>.json = list Question mong đợi.
+    cd BE && python -m pytest -q tests
+"""
+
+import json
+import unicodedata
+from pathlib import Path
+
+import pytest
+
+from benchmarks.bench_exam_parser import legacy_parse
+from services.exam_parser import IncrementalQuestionParser, parse_ai_response
+
+GOLDEN_DIR = Path(__file__).parent / "golden" / "exam_parser"
+CASES = sorted(p.stem for p in GOLDEN_DIR.glob("*.txt"))
+# Layout mà parser cũ cũng đọc đúng -> 2 parser phải cho cùng kết quả
+LEGACY_CASES = ["standard", "standard_50", "inline_terminator", "one_line"]
+
+
+def load_case(name):
+    text = (GOLDEN_DIR / f"{name}.txt").read_text(encoding="utf-8")
+    expected = json.loads((GOLDEN_DIR / f"{name}.json").read_text(encoding="utf-8"))
+    return text, expected
+
+
+def dump(questions):
+    return [q.model_dump() for q in questions]
+
+
+def stream(text, chunk_size):
+    parser = IncrementalQuestionParser()
+    questions = []
+    for i in range(0, len(text), chunk_size):
+        questions += parser.feed(text[i:i + chunk_size])
+    return questions + parser.close()
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_parse_matches_golden(name):
+    text, expected = load_case(name)
+    assert dump(parse_ai_response(text)) == expected
+
+
+@pytest.mark.parametrize("name", CASES)
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_stream_nfd_matches_golden(name, chunk_size):
+    # Dấu tổ hợp (NFD) bị tách giữa 2 chunk vẫn phải cho cùng kết quả
+    text, expected = load_case(name)
+    assert dump(stream(unicodedata.normalize("NFD", text), chunk_size)) == expected
+
+
+@pytest.mark.parametrize("name", LEGACY_CASES)
+def test_same_as_legacy_parser(name):
+    text, expected = load_case(name)
+    assert dump(legacy_parse(text)) == expected
+
+
+def test_close_returns_unterminated_tail():
+    text, expected = load_case("malformed")
+    parser = IncrementalQuestionParser()
+    # Câu cuối không có dấu KẾT THÚC CÂU -> chỉ được trả ở close()
+    assert dump(parser.feed(text)) == expected[:-1]
+    assert dump(parser.close()) == expected[-1:]
+    assert parser.close() == []
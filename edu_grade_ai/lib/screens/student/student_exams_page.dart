@@ -221,8 +221,12 @@ class _StudentExamsPageState extends State<StudentExamsPage> {
                   borderRadius: BorderRadius.circular(8),
                 ),
               ),
-              onPressed: () {
-                List<dynamic> questionsRaw = exam['questions'] ?? [];
+              onPressed: () async {
+                final detail = await apiService.getExamDetail(
+                  exam['id']?.toString() ?? '',
+                );
+                if (!mounted) return;
+                List<dynamic> questionsRaw = detail?['questions'] ?? [];
                 List<Question> questionList = questionsRaw
                     .map((q) => Question.fromMap(q as Map<String, dynamic>))
                     .toList();
@@ -291,8 +291,13 @@ class ApiService {
           "isRegister": isRegister,
         }),
       );
+      final data = jsonDecode(utf8.decode(response.bodyBytes));
+      if (response.statusCode == 202 && data['queued'] == true) {
+        // Surge mode: yêu cầu đã vào hàng đợi -> chờ kết quả cuối
+        await _waitRegistrationTicket(data['ticketId']);
+        return;
+      }
       if (response.statusCode != 200) {
-        final data = jsonDecode(utf8.decode(response.bodyBytes));
         throw data['detail'] ?? "Lỗi đăng ký lớp (${response.statusCode})";
       }
     } catch (e) {
@@ -301,6 +306,22 @@ class ApiService {
     }
   }
 
+  Future<void> _waitRegistrationTicket(String ticketId) async {
+    final url = Uri.parse('$baseUrl/classes/register/tickets/$ticketId')
+        .replace(queryParameters: {'wait': '20'});
+    while (true) {
+      final response = await http.get(url, headers: headers);
+      final data = jsonDecode(utf8.decode(response.bodyBytes));
+      if (response.statusCode != 200) {
+        throw data['detail'] ?? "Lỗi đăng ký lớp (${response.statusCode})";
+      }
+      if (data['status'] == 'done') return;
+      if (data['status'] == 'failed') {
+        throw data['message'] ?? "Lỗi đăng ký lớp";
+      }
+    }
+  }
+
   Future<List<dynamic>> getStudentsInClass(String classId) async {
     final url = Uri.parse('$baseUrl/classes/$classId/students');
     try {
@@ -317,32 +338,33 @@ class ApiService {
 
   // --- EXAMS ---
 
-  Future<List<dynamic>> getAllExams() async {
-    final url = Uri.parse('$baseUrl/exams/list');
+  // Listing trả về tóm tắt theo trang (nextCursor) - câu hỏi lấy qua getExamDetail
+  Future<List<dynamic>> _getExamPages(String path) async {
+    final List<dynamic> exams = [];
+    String? cursor;
     try {
-      final response = await http.get(url, headers: headers);
-      if (response.statusCode == 200) {
+      do {
+        final url = Uri.parse('$baseUrl$path').replace(
+          queryParameters: cursor == null ? null : {'start_after': cursor},
+        );
+        final response = await http.get(url, headers: headers);
+        if (response.statusCode != 200) break;
         final data = jsonDecode(utf8.decode(response.bodyBytes));
-        return data['exams'] ?? [];
-      }
-      return [];
+        exams.addAll(data['exams'] ?? []);
+        cursor = data['nextCursor'];
+      } while (cursor != null);
     } catch (e) {
-      return [];
+      return exams;
     }
+    return exams;
+  }
+
+  Future<List<dynamic>> getAllExams() async {
+    return _getExamPages('/exams/list');
   }
 
   Future<List<dynamic>> getExamsBySubject(String subject) async {
-    final url = Uri.parse('$baseUrl/exams/by-subject/$subject');
-    try {
-      final response = await http.get(url, headers: headers);
-      if (response.statusCode == 200) {
-        final data = jsonDecode(utf8.decode(response.bodyBytes));
-        return data['exams'] ?? [];
-      }
-      return [];
-    } catch (e) {
-      return [];
-    }
+    return _getExamPages('/exams/by-subject/${Uri.encodeComponent(subject)}');
   }
 
   Future<void> createExam(Map<String, dynamic> data) async {
@@ -392,28 +414,39 @@ class ApiService {
     String? examId,
     String? teacherName,
   }) async {
-    Uri url;
+    String path;
+    final Map<String, String> params = {};
     if (studentId != null) {
-      url = Uri.parse('$baseUrl/exams/results/by-student/$studentId');
+      path = '/exams/results/by-student/$studentId';
     } else if (examId != null) {
-      url = Uri.parse('$baseUrl/exams/results/by-exam/$examId');
+      path = '/exams/results/by-exam/$examId';
     } else {
-      String query = "";
+      path = '/exams/results/list/all';
       if (teacherName != null && teacherName.isNotEmpty) {
-        query = "?teacher_name=$teacherName";
+        params['teacher_name'] = teacherName;
       }
-      url = Uri.parse('$baseUrl/exams/results/list/all$query');
     }
+    // Các endpoint phân trang trả về nextCursor -> tải lần lượt tới trang cuối
+    final List<dynamic> results = [];
+    String? cursor;
     try {
-      final response = await http.get(url, headers: headers);
-      if (response.statusCode == 200) {
+      do {
+        final url = Uri.parse('$baseUrl$path').replace(
+          queryParameters: {
+            ...params,
+            if (cursor != null) 'start_after': cursor,
+          },
+        );
+        final response = await http.get(url, headers: headers);
+        if (response.statusCode != 200) break;
         final data = jsonDecode(utf8.decode(response.bodyBytes));
-        return data['results'] ?? [];
-      }
-      return [];
+        results.addAll(data['results'] ?? []);
+        cursor = data['nextCursor'];
+      } while (cursor != null);
     } catch (e) {
-      return [];
+      return results;
     }
+    return results;
   }
 
   Future<void> deleteExamResult(String id) async {